@@ -0,0 +1,55 @@
+"""
+Общие классы админки
+
+RelationAdmin - базовый класс админки для связей пользователя с объектами
+(избранное, список покупок, подписки). Изменения через админку не проходят
+через api.relations, поэтому после сохранения и удаления вызывается метод
+relations_changed с id затронутых пользователей и объектов, в котором
+наследники пересчитывают зависящие от связей данные.
+
+На главной странице админки выводится ссылка на профили запросов
+(api.admin_profiles).
+"""
+
+from django.contrib import admin
+
+admin.site.index_template = 'admin/profiling_index.html'
+
+
+class RelationAdmin(admin.ModelAdmin):
+    # имя поля объекта в модели связи
+    relation_field = None
+
+    def relations_changed(self, user_ids, target_ids):
+        """
+        Вызывается после изменения связей через админку
+        """
+
+    def save_model(self, request, obj, form, change):
+        previous = dict.fromkeys(('user', self.relation_field))
+        if change:
+            previous.update({
+                name: form.initial[name]
+                for name in previous
+                if name in form.changed_data
+            })
+        super().save_model(request, obj, form, change)
+        target_id = getattr(obj, f'{self.relation_field}_id')
+        self.relations_changed(
+            {obj.user_id, previous['user']} - {None},
+            {target_id, previous[self.relation_field]} - {None},
+        )
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.relations_changed(
+            {obj.user_id}, {getattr(obj, f'{self.relation_field}_id')}
+        )
+
+    def delete_queryset(self, request, queryset):
+        rows = list(queryset.values_list('user', self.relation_field))
+        super().delete_queryset(request, queryset)
+        self.relations_changed(
+            {user_id for user_id, _ in rows},
+            {target_id for _, target_id in rows},
+        )
@@ -0,0 +1,161 @@
+"""
+Фильтры списков админки для больших таблиц
+
+Стандартные фильтры по полю выводят все различные значения поля, поэтому
+на больших таблицах страница списка выполняет полный просмотр таблицы и
+выводит тысячи ссылок. Фильтры этого модуля не загружают значения:
+
+    InputFilter - поле ввода, значение сравнивается с полем lookup
+    AutocompleteFilter - выбор объекта по внешнему ключу с поиском через
+    стандартный autocomplete админки (запрашивает только найденные
+    объекты)
+
+Фильтры создаются функциями input_filter и autocomplete_filter. Админка с
+AutocompleteFilter должна наследовать AdminFiltersMixin, чтобы на
+странице были скрипты select2.
+"""
+
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.admin.widgets import (
+    SELECT2_TRANSLATIONS, AutocompleteSelect
+)
+from django.core.exceptions import ValidationError
+from django.utils.translation import get_language
+
+
+class InputFilter(admin.SimpleListFilter):
+    """
+    Фильтр с полем ввода
+
+    Атрибуты:
+        lookup - выражение фильтра, например name__istartswith
+    """
+    template = 'admin/input_filter.html'
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        # фильтр выводится, только если lookups не пустой
+        return ((None, None),)
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value()})
+        return queryset
+
+    def choices(self, changelist):
+        yield {
+            'query_parts': [
+                (name, value) for name, value in changelist.params.items()
+                if name not in (self.parameter_name, PAGE_VAR)
+            ],
+        }
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """
+    Фильтр по внешнему ключу с выбором объекта через autocomplete
+
+    Атрибуты:
+        field_name - имя внешнего ключа модели; в админке связанной модели
+        должны быть заданы search_fields
+    """
+    template = 'admin/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.field = model._meta.get_field(self.field_name)
+        self.parameter_name = '{}__{}__exact'.format(
+            self.field_name, self.field.target_field.name
+        )
+        super().__init__(request, params, model, model_admin)
+        self.admin_site = model_admin.admin_site
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            return queryset.filter(**{self.parameter_name: self.value()})
+        except (ValueError, ValidationError) as error:
+            raise IncorrectLookupParameters(error)
+
+    def widget(self):
+        """
+        Поле выбора объекта; при выбранном значении выполняется один запрос
+        за выбранным объектом
+        """
+        field = forms.ModelChoiceField(
+            queryset=self.field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(
+                self.field, self.admin_site, attrs={'style': 'width: 100%'}
+            ),
+            required=False,
+        )
+        return field.widget.render(self.parameter_name, self.value())
+
+    def choices(self, changelist):
+        yield {
+            'query_string': changelist.get_query_string(
+                remove=[self.parameter_name, PAGE_VAR]
+            ),
+            'widget': self.widget(),
+        }
+
+
+def input_filter(lookup, title):
+    """
+    Создает фильтр с полем ввода для выражения lookup
+    """
+    return type('InputFilter', (InputFilter,), {
+        'lookup': lookup,
+        'title': title,
+        'parameter_name': lookup,
+    })
+
+
+def autocomplete_filter(field_name, title):
+    """
+    Создает фильтр по внешнему ключу field_name с autocomplete
+    """
+    return type('AutocompleteFilter', (AutocompleteFilter,), {
+        'field_name': field_name,
+        'title': title,
+    })
+
+
+class AdminFiltersMixin:
+    """
+    Подключает скрипты и стили select2 для AutocompleteFilter
+    """
+
+    @property
+    def media(self):
+        i18n_name = SELECT2_TRANSLATIONS.get(get_language())
+        i18n_file = (
+            (f'admin/js/vendor/select2/i18n/{i18n_name}.js',)
+            if i18n_name else ()
+        )
+        return super().media + forms.Media(
+            js=(
+                'admin/js/vendor/jquery/jquery.js',
+                'admin/js/vendor/select2/select2.full.js',
+                *i18n_file,
+                'admin/js/jquery.init.js',
+                'admin/js/autocomplete.js',
+                'api/js/autocomplete_filter.js',
+            ),
+            css={
+                'screen': (
+                    'admin/css/vendor/select2/select2.css',
+                    'admin/css/autocomplete.css',
+                ),
+            },
+        )
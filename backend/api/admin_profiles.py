@@ -0,0 +1,68 @@
+"""
+Страницы админки для профилей запросов (api.profiling)
+
+Страницы доступны сотрудникам (admin.site.admin_view):
+    profile_list - список сохраненных профилей
+    profile_stats - 50 функций с наибольшим суммарным временем (pstats)
+    profile_download - скачать файл профиля (pstats или свернутые стеки)
+
+Ссылка на список профилей выводится на главной странице админки.
+"""
+
+import io
+import pstats
+
+from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from .profiling import get_profile_file, list_profiles
+
+app_name = 'profiles'
+
+
+def get_file(name, kind):
+    profile_file = get_profile_file(name, kind)
+    if profile_file is None:
+        raise Http404('Профиль не найден')
+    return profile_file
+
+
+def profile_list(request):
+    return TemplateResponse(request, 'admin/profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Профили запросов',
+        'profiles': list_profiles(),
+    })
+
+
+def profile_stats(request, name):
+    stream = io.StringIO()
+    stats = pstats.Stats(str(get_file(name, 'pstats')), stream=stream)
+    stats.sort_stats('cumulative').print_stats(50)
+    return TemplateResponse(request, 'admin/profile_stats.html', {
+        **admin.site.each_context(request),
+        'title': f'Профиль {name}',
+        'stats': stream.getvalue(),
+    })
+
+
+def profile_download(request, name, kind):
+    profile_file = get_file(name, kind)
+    return FileResponse(
+        open(profile_file, 'rb'), as_attachment=True,
+        filename=profile_file.name
+    )
+
+
+urlpatterns = [
+    path('', admin.site.admin_view(profile_list), name='list'),
+    path(
+        '<str:name>/', admin.site.admin_view(profile_stats), name='stats'
+    ),
+    path(
+        '<str:name>/<str:kind>/', admin.site.admin_view(profile_download),
+        name='download'
+    ),
+]
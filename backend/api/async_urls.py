@@ -0,0 +1,69 @@
+"""
+Маршруты API для ASGI (backend.asgi)
+
+Горячие маршруты чтения обслуживаются асинхронными представлениями
+api.async_views, остальные - теми же представлениями, что в api.urls.
+Имена маршрутов совпадают с api.urls.
+"""
+
+from functools import partial
+
+from django.urls import path, re_path
+
+from .async_views import (
+    async_read_view, list_objects, load_recipe_context, retrieve_object,
+    subscriptions
+)
+from .urls import urlpatterns as sync_urlpatterns, v1_router
+
+app_name = 'api'
+
+# синхронные представления маршрутов роутера по имени маршрута; адреса
+# объектов заданы тем же выражением, что у роутера
+callbacks = {pattern.name: pattern.callback for pattern in v1_router.urls}
+
+urlpatterns = [
+    path(
+        'recipes/',
+        async_read_view(
+            partial(list_objects, load_context=load_recipe_context),
+            callbacks['recipes-list'],
+            sync_params=('have',)
+        ),
+        name='recipes-list'
+    ),
+    re_path(
+        r'^recipes/(?P<pk>[^/.]+)/$',
+        async_read_view(
+            partial(retrieve_object, load_context=load_recipe_context),
+            callbacks['recipes-detail']
+        ),
+        name='recipes-detail'
+    ),
+    path(
+        'tags/',
+        async_read_view(list_objects, callbacks['tags-list']),
+        name='tags-list'
+    ),
+    re_path(
+        r'^tags/(?P<pk>[^/.]+)/$',
+        async_read_view(retrieve_object, callbacks['tags-detail']),
+        name='tags-detail'
+    ),
+    path(
+        'ingredients/',
+        async_read_view(list_objects, callbacks['ingredients-list']),
+        name='ingredients-list'
+    ),
+    re_path(
+        r'^ingredients/(?P<pk>[^/.]+)/$',
+        async_read_view(retrieve_object, callbacks['ingredients-detail']),
+        name='ingredients-detail'
+    ),
+    path(
+        'users/subscriptions/',
+        async_read_view(subscriptions, callbacks['users-subscriptions']),
+        name='users-subscriptions'
+    ),
+    *sync_urlpatterns,
+]
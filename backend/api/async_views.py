@@ -0,0 +1,254 @@
+"""
+Асинхронные представления горячих маршрутов чтения API для ASGI
+
+Под ASGI (backend.asgi) запросы GET к спискам и страницам
+рецептов, тегов и ингредиентов и к подпискам обрабатывают асинхронные
+представления: запросы к базе выполняются асинхронным ORM, и пока запрос
+ждет базу или медленного клиента, процесс обрабатывает другие запросы.
+Остальные методы (в том числе HEAD: для него вьюсет рецептов выбирает
+сериализатор записи), а также запросы, для которых нет асинхронной
+реализации (параметр have списка рецептов, браузерный API), передаются
+синхронному вьюсету маршрута.
+
+Асинхронное представление создает экземпляр вьюсета маршрута и
+использует его queryset, фильтры, пагинацию, права доступа,
+сериализаторы и рендеринг, поэтому ответы совпадают с ответами под WSGI
+(проверяется командой benchmark_concurrency). Сериализаторы выполняются
+в цикле событий и не обращаются к базе: связанные объекты и id для полей
+is_favorited, is_in_shopping_cart и is_subscribed загружаются заранее.
+Запрос к базе из сериализатора завершится ошибкой
+SynchronousOnlyOperation.
+
+Классы:
+    AsyncTokenAuthentication - проверка токена асинхронным ORM
+
+Функции:
+    async_read_view - асинхронное представление маршрута вьюсета
+    list_objects - список объектов вьюсета
+    retrieve_object - объект вьюсета
+    subscriptions - подписки пользователя
+    load_recipe_context - id для полей RecipeGetSerializer
+"""
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from recipes.serializers import (
+    SubscribeSerializer, get_recipes_limit, get_user_recipe_ids,
+    group_user_recipe_ids
+)
+from recipes.services import get_latest_recipes
+from users.models import Subscribe
+from .tracing import span
+
+
+class AsyncTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с запросом к базе через асинхронный ORM
+
+    aauthenticate разбирает заголовок Authorization методом
+    TokenAuthentication.authenticate, проверяет токен асинхронным
+    запросом и запоминает результат, который DRF Request затем получает
+    из authenticate без запроса к базе. Объект создается на каждый запрос.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.result = None
+
+    def authenticate_credentials(self, key):
+        # вызывается из TokenAuthentication.authenticate после разбора
+        # заголовка, токен проверяется в aauthenticate
+        self.key = key
+
+    async def aauthenticate(self, request):
+        TokenAuthentication.authenticate(self, request)
+        if self.key is None:
+            return
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related('user').aget(
+                key=self.key
+            )
+        except model.DoesNotExist:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        self.result = (token.user, token)
+
+    def authenticate(self, request):
+        return self.result
+
+
+async def dispatch(view, handler, request, args, kwargs):
+    """
+    APIView.dispatch для асинхронного обработчика
+
+    Возвращает None, если ответ должен построить синхронный вьюсет.
+    """
+    authenticator = AsyncTokenAuthentication()
+    request = Request(
+        request,
+        parsers=view.get_parsers(),
+        authenticators=[authenticator],
+        negotiator=view.get_content_negotiator(),
+        parser_context=view.get_parser_context(request),
+    )
+    view.request = request
+    view.headers = view.default_response_headers
+    view.format_kwarg = view.get_format_suffix(**kwargs)
+    # браузерный API строит формы с запросами к базе
+    renderer, media_type = view.perform_content_negotiation(request)
+    if not isinstance(renderer, JSONRenderer):
+        return None
+    try:
+        with span('authentication'):
+            await authenticator.aauthenticate(request)
+        view.initial(request, *args, **kwargs)
+        response = await handler(view, request, **kwargs)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    view.response = view.finalize_response(request, response, *args, **kwargs)
+    # рендеринг здесь, иначе Django выполнит его в потоке sync_to_async
+    return view.response.render()
+
+
+def async_read_view(handler, callback, sync_params=()):
+    """
+    Асинхронное представление маршрута вьюсета
+
+    handler(view, request, **kwargs) - корутина, которая обрабатывает
+    GET и возвращает Response. callback - синхронное представление
+    маршрута из DefaultRouter, оно обрабатывает остальные методы и
+    запросы с параметрами sync_params.
+    """
+    fallback = sync_to_async(callback)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET' and not any(
+            name in request.GET for name in sync_params
+        ):
+            viewset = callback.cls(**callback.initkwargs)
+            # как ViewSetMixin.as_view
+            viewset.action_map = callback.actions
+            for method, action in callback.actions.items():
+                setattr(viewset, method, getattr(viewset, action))
+            viewset.head = viewset.get
+            viewset.action = callback.actions['get']
+            viewset.args = args
+            viewset.kwargs = kwargs
+            response = await dispatch(viewset, handler, request, args, kwargs)
+            if response is not None:
+                return response
+        return await fallback(request, *args, **kwargs)
+
+    # как у представлений DRF; actions - для api.middleware.get_view
+    view.csrf_exempt = True
+    view.actions = callback.actions
+    return view
+
+
+async def filter_queryset(view, queryset):
+    """
+    filter_queryset вьюсета
+
+    Проверка параметров фильтров может обращаться к базе (например,
+    ModelMultipleChoiceFilter тегов), поэтому при наличии параметров
+    фильтрация выполняется в потоке запроса. Без параметров фильтры не
+    меняют queryset.
+    """
+    filterset_class = getattr(view, 'filterset_class', None)
+    if filterset_class is None or not any(
+        name in view.request.query_params
+        for name in filterset_class.base_filters
+    ):
+        return queryset
+    return await sync_to_async(view.filter_queryset)(queryset)
+
+
+async def load_recipe_context(request, recipes, context):
+    """
+    Загружает id рецептов в избранном и списке покупок пользователя в
+    контекст RecipeGetSerializer и id авторов его подписок в запрос одним
+    запросом
+    """
+    if request.user.is_anonymous or not recipes:
+        return
+    context.update(group_user_recipe_ids(request, [
+        pair async for pair in get_user_recipe_ids(request, recipes)
+    ]))
+
+
+async def list_objects(view, request, load_context=None):
+    """
+    ListModelMixin.list: список объектов, с пагинацией вьюсета, если она
+    задана
+    """
+    queryset = await filter_queryset(view, view.get_queryset())
+    page = None
+    if view.paginator is not None:
+        with span('pagination'):
+            page = await view.paginator.apaginate_queryset(
+                queryset, request, view=view
+            )
+    objects = page if page is not None else [obj async for obj in queryset]
+    context = view.get_serializer_context()
+    if load_context is not None:
+        await load_context(request, objects, context)
+    data = view.get_serializer(objects, many=True, context=context).data
+    if page is not None:
+        return view.get_paginated_response(data)
+    return Response(data)
+
+
+async def retrieve_object(view, request, load_context=None, **kwargs):
+    """
+    RetrieveModelMixin.retrieve: объект по ключу из адреса
+    """
+    queryset = await filter_queryset(view, view.get_queryset())
+    lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+    try:
+        obj = await queryset.aget(
+            **{view.lookup_field: kwargs[lookup_url_kwarg]}
+        )
+    except (
+        queryset.model.DoesNotExist, TypeError, ValueError, ValidationError
+    ):
+        raise Http404
+    view.check_object_permissions(request, obj)
+    context = view.get_serializer_context()
+    if load_context is not None:
+        await load_context(request, [obj], context)
+    return Response(view.get_serializer(obj, context=context).data)
+
+
+async def subscriptions(view, request):
+    """
+    CustomUserViewSet.subscriptions
+    """
+    queryset = Subscribe.objects.filter(
+        user=request.user
+    ).select_related('author')
+    with span('pagination'):
+        page = await view.paginator.apaginate_queryset(
+            queryset, request, view=view
+        )
+    # запрос с оконной функцией строится компилятором базы, который может
+    # обращаться к соединению, поэтому выполняется в потоке запроса
+    latest_recipes = await sync_to_async(get_latest_recipes)(
+        [subscribe.author_id for subscribe in page],
+        get_recipes_limit(request)
+    )
+    serializer = SubscribeSerializer(
+        page,
+        many=True,
+        context={'request': request, 'latest_recipes': latest_recipes}
+    )
+    return view.get_paginated_response(serializer.data)
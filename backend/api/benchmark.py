@@ -0,0 +1,421 @@
+"""
+Сценарии запросов к API для измерения производительности
+
+Сценарий - генератор, который возвращает запросы Request и получает
+ответы на них: так следующий запрос может использовать результат
+предыдущего (например, удалить только что созданный рецепт). Сценарии
+покрывают все маршруты api/urls.py; добавление и удаление связей
+выполняются парами, поэтому повторные прогоны не меняют данные.
+
+Данные создаются командой generate_fake_data с фиксированным seed в
+тестовой базе, поэтому результаты разных прогонов сравнимы.
+
+Классы:
+    Request - запрос сценария
+    Dataset - данные, по которым строятся запросы
+
+Функции:
+    test_database - контекстный менеджер тестового окружения и базы
+    create_dataset - заполнить базу и выбрать пользователей и рецепты
+    get_scenarios - сценарии по имени
+    run_scenario - выполнить один проход сценария
+"""
+
+import base64
+import io
+import logging
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import combinations
+from urllib.parse import quote
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.db.models import Count
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.relations import (
+    favorite_relation, shopping_cart_relation, subscribe_relation
+)
+from recipes.management.commands.generate_fake_data import IMAGE_CONTENT
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+PASSWORD = 'benchmark-password'
+# наибольший размер данных Dataset
+MAX_SIZE = 50
+IMAGE = 'data:image/png;base64,' + base64.b64encode(IMAGE_CONTENT).decode()
+
+# name - имя маршрута в отчете, auth - запрос от имени пользователя
+# dataset.user, status - ожидаемый код ответа
+Request = namedtuple(
+    'Request', ('name', 'method', 'path', 'data', 'status', 'auth'),
+    defaults=(None, 200, True)
+)
+
+
+class Dataset:
+    """
+    Данные для запросов
+
+    Атрибуты:
+        user - пользователь, от имени которого выполняются запросы (автор
+        с наибольшим количеством рецептов)
+        other - пользователь для запросов получения и удаления токена
+        author - автор, на которого user не подписан
+        favorite_author - автор первого рецепта в избранном и списке
+        покупок user (для фильтра списка рецептов по автору)
+        recipe - чужой рецепт, которого нет в избранном и списке покупок
+        own_recipe - рецепт пользователя user
+        tags - slug двух тегов
+        ingredients - id ингредиентов нового рецепта
+        tag_ids - id тегов нового рецепта
+        size - размер страницы, количество ингредиентов и тегов (не больше
+        количества тегов в базе) нового рецепта, рецептов в избранном и
+        списке покупок user и его подписок
+    """
+
+    def __init__(self, user, other, authors, recipes, own_recipe, tags,
+                 ingredients, tag_ids):
+        self.user = user
+        self.other = other
+        self.author = User.objects.get(pk=authors[0])
+        self.recipe = Recipe.objects.get(pk=recipes[0])
+        self.favorite_author = Recipe.objects.get(pk=recipes[1]).author
+        self.own_recipe = own_recipe
+        self.tags = tags
+        self._ingredients = ingredients
+        self._tag_ids = tag_ids
+        self._authors = authors[1:]
+        self._recipes = recipes[1:]
+        self.size = 0
+
+    def resize(self, size):
+        """
+        Изменяет размер данных, по которым строятся запросы
+
+        Связи пользователя user приводятся к size первым рецептам и авторам
+        из заранее выбранных MAX_SIZE, связи с recipe и author удаляются.
+        """
+        if size > MAX_SIZE:
+            raise ValueError(f'Size must not exceed {MAX_SIZE}')
+        for relation, ids, target in (
+            (favorite_relation, self._recipes, self.recipe.pk),
+            (shopping_cart_relation, self._recipes, self.recipe.pk),
+            (subscribe_relation, self._authors, self.author.pk),
+        ):
+            relation.bulk_add(self.user, ids[:size])
+            relation.bulk_remove(self.user, ids[size:] + [target])
+        self.ingredients = self._ingredients[:size]
+        self.tag_ids = self._tag_ids[:size]
+        self.size = size
+
+
+@contextmanager
+def test_database(verbosity=0):
+    """
+    Тестовое окружение Django и пустая тестовая база
+
+    Как при запуске тестов: DEBUG выключен, база создается заново и
+    удаляется на выходе, файлы пишутся во временный MEDIA_ROOT. Строки
+    статистики запросов api.sql уровня DEBUG не выводятся. При вызове из
+    теста (manage.py test) окружение и тестовая база уже созданы
+    (setup_test_environment создает django.core.mail.outbox), команда
+    использует их.
+    """
+    runner = None
+    if not hasattr(mail, 'outbox'):
+        runner = DiscoverRunner(verbosity=verbosity, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+    sql_logger = logging.getLogger('api.sql')
+    old_level = sql_logger.level
+    sql_logger.setLevel(max(old_level, logging.WARNING))
+    try:
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                yield
+    finally:
+        sql_logger.setLevel(old_level)
+        if runner is not None:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+
+def create_dataset(users, recipes, seed, size):
+    """
+    Заполняет базу командой generate_fake_data и возвращает Dataset
+    размера size
+    """
+    call_command(
+        'generate_fake_data', users=users, recipes=recipes, seed=seed,
+        password=PASSWORD, derived=True, stdout=io.StringIO()
+    )
+    user = User.objects.order_by('-recipes_count', 'pk').first()
+    dataset = Dataset(
+        user=user,
+        other=User.objects.exclude(pk=user.pk).order_by('pk').first(),
+        authors=list(
+            User.objects.exclude(pk=user.pk).order_by(
+                '-recipes_count', 'pk'
+            ).values_list('pk', flat=True)[:MAX_SIZE + 1]
+        ),
+        recipes=list(
+            Recipe.objects.exclude(author=user).order_by(
+                '-favorites_count', 'pk'
+            ).values_list('pk', flat=True)[:MAX_SIZE + 1]
+        ),
+        own_recipe=Recipe.objects.filter(author=user).order_by('pk').first(),
+        tags=list(
+            Tag.objects.annotate(count=Count('recipes')).order_by(
+                '-count', 'pk'
+            ).values_list('slug', flat=True)[:2]
+        ),
+        ingredients=list(
+            Ingredient.objects.order_by('pk').values_list(
+                'pk', flat=True
+            )[:MAX_SIZE]
+        ),
+        tag_ids=list(
+            Tag.objects.order_by('pk').values_list('pk', flat=True)[:MAX_SIZE]
+        ),
+    )
+    dataset.resize(size)
+    return dataset
+
+
+def get_clients(dataset):
+    """
+    Клиенты для запросов от имени dataset.user и анонимных запросов
+    """
+    token, _ = Token.objects.get_or_create(user=dataset.user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return {True: client, False: APIClient()}
+
+
+def _recipe_payload(dataset, name):
+    return {
+        'name': name,
+        'text': 'Смешать все ингредиенты и запечь до готовности',
+        'cooking_time': 30,
+        'image': IMAGE,
+        'tags': dataset.tag_ids,
+        'ingredients': [
+            {'id': pk, 'amount': 10 * number}
+            for number, pk in enumerate(dataset.ingredients, 1)
+        ],
+    }
+
+
+def _get(name, path, auth=True):
+    def scenario(dataset):
+        yield Request(name, 'get', path, auth=auth)
+    return scenario
+
+
+def _recipe_lists(dataset):
+    """
+    Список рецептов со всеми сочетаниями фильтров
+    """
+    filters = {
+        'is_favorited': 'is_favorited=1',
+        'is_in_shopping_cart': 'is_in_shopping_cart=1',
+        'author': f'author={dataset.favorite_author.pk}',
+        'tags': '&'.join(f'tags={slug}' for slug in dataset.tags),
+    }
+    scenarios = {}
+    for size in range(len(filters) + 1):
+        for names in combinations(filters, size):
+            query = '&'.join(
+                [f'limit={dataset.size}'] + [filters[name] for name in names]
+            )
+            name = 'recipe list' + ''.join(f' {name}' for name in names)
+            scenarios[name] = _get(name, f'/api/recipes/?{query}')
+    for ordering in ('popular', 'trending'):
+        name = f'recipe list ordering={ordering}'
+        scenarios[name] = _get(
+            name, f'/api/recipes/?limit={dataset.size}&ordering={ordering}'
+        )
+    have = ','.join(str(pk) for pk in dataset.ingredients)
+    scenarios['recipe list have'] = _get(
+        'recipe list have',
+        f'/api/recipes/?limit={dataset.size}&have={have}'
+    )
+    scenarios['recipe list anonymous'] = _get(
+        'recipe list anonymous', f'/api/recipes/?limit={dataset.size}',
+        auth=False
+    )
+    return scenarios
+
+
+def recipe_create(dataset):
+    response = yield Request(
+        'recipe create', 'post', '/api/recipes/',
+        _recipe_payload(dataset, 'Рецепт для замера'), 201
+    )
+    yield Request(
+        'recipe delete', 'delete', f'/api/recipes/{response.data["id"]}/',
+        status=204
+    )
+
+
+def recipe_update(dataset):
+    yield Request(
+        'recipe update', 'patch', f'/api/recipes/{dataset.own_recipe.pk}/',
+        _recipe_payload(dataset, dataset.own_recipe.name)
+    )
+
+
+def _toggle(name, path):
+    def scenario(dataset):
+        url = path.format(dataset=dataset)
+        yield Request(f'{name} add', 'post', url, status=201)
+        yield Request(f'{name} remove', 'delete', url, status=204)
+    return scenario
+
+
+def _bulk_toggle(name, path, ids):
+    def scenario(dataset):
+        data = {'ids': ids(dataset)}
+        yield Request(f'{name} add', 'post', path, data)
+        yield Request(f'{name} remove', 'delete', path, data)
+    return scenario
+
+
+def token(dataset):
+    response = yield Request(
+        'token login', 'post', '/api/auth/token/login/',
+        {'email': dataset.other.email, 'password': PASSWORD}, auth=False
+    )
+    yield Request(
+        'token logout', 'post', '/api/auth/token/logout/',
+        status=204, auth=response.data['auth_token']
+    )
+
+
+def user_create(dataset):
+    number = User.objects.count()
+    yield Request('user create', 'post', '/api/users/', {
+        'email': f'benchmark{number}@example.com',
+        'username': f'benchmark{number}',
+        'first_name': 'Имя',
+        'last_name': 'Фамилия',
+        'password': PASSWORD,
+    }, 201, auth=False)
+
+
+def get_scenarios(dataset):
+    """
+    Возвращает словарь {имя: сценарий} для всех маршрутов API
+    """
+    recipe = dataset.recipe.pk
+    scenarios = _recipe_lists(dataset)
+    scenarios.update({
+        'recipe detail': _get(
+            'recipe detail', f'/api/recipes/{recipe}/'
+        ),
+        'recipe similar': _get(
+            'recipe similar', f'/api/recipes/{recipe}/similar/'
+        ),
+        'recipe feed': _get(
+            'recipe feed', f'/api/recipes/feed/?limit={dataset.size}'
+        ),
+        'recipe create': recipe_create,
+        'recipe update': recipe_update,
+        'favorite': _toggle(
+            'favorite', '/api/recipes/{dataset.recipe.pk}/favorite/'
+        ),
+        'shopping cart': _toggle(
+            'shopping cart', '/api/recipes/{dataset.recipe.pk}/shopping_cart/'
+        ),
+        'favorite bulk': _bulk_toggle(
+            'favorite bulk', '/api/recipes/favorite/',
+            lambda dataset: [dataset.recipe.pk]
+        ),
+        'shopping cart bulk': _bulk_toggle(
+            'shopping cart bulk', '/api/recipes/shopping_cart/',
+            lambda dataset: [dataset.recipe.pk]
+        ),
+        'download shopping cart': _get(
+            'download shopping cart', '/api/recipes/download_shopping_cart/'
+        ),
+        'tag list': _get('tag list', '/api/tags/', auth=False),
+        'tag detail': _get(
+            'tag detail',
+            f'/api/tags/{Tag.objects.get(slug=dataset.tags[0]).pk}/',
+            auth=False
+        ),
+        'ingredient search': _get(
+            'ingredient search',
+            '/api/ingredients/?name=' + quote('Ингредиент 1'),
+            auth=False
+        ),
+        'ingredient detail': _get(
+            'ingredient detail',
+            f'/api/ingredients/{dataset.ingredients[0]}/', auth=False
+        ),
+        'user list': _get(
+            'user list', f'/api/users/?limit={dataset.size}'
+        ),
+        'user detail': _get(
+            'user detail', f'/api/users/{dataset.author.pk}/'
+        ),
+        'user me': _get('user me', '/api/users/me/'),
+        'user create': user_create,
+        'subscriptions': _get(
+            'subscriptions', '/api/users/subscriptions/'
+            f'?limit={dataset.size}&recipes_limit={dataset.size}'
+        ),
+        'subscribe': _toggle(
+            'subscribe', '/api/users/{dataset.author.pk}/subscribe/'
+        ),
+        'subscribe bulk': _bulk_toggle(
+            'subscribe bulk', '/api/users/subscribe/',
+            lambda dataset: [dataset.author.pk]
+        ),
+        'token': token,
+    })
+    return scenarios
+
+
+def run_scenario(scenario, dataset, clients, on_request):
+    """
+    Выполняет один проход сценария
+
+    Для каждого запроса вызывается on_request(request, call), где call -
+    функция без аргументов, которая выполняет запрос и возвращает ответ.
+    Так вызывающий код измеряет только сам запрос. Если код ответа не
+    совпадает с ожидаемым, выбрасывается AssertionError.
+    """
+    steps = scenario(dataset)
+    response = None
+    while True:
+        try:
+            request = steps.send(response)
+        except StopIteration:
+            return
+        if isinstance(request.auth, str):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {request.auth}')
+        else:
+            client = clients[request.auth]
+        method = getattr(client, request.method)
+        kwargs = {'format': 'json'} if request.data is not None else {}
+
+        def call():
+            return method(request.path, request.data, **kwargs)
+
+        response = on_request(request, call)
+        if response.status_code != request.status:
+            raise AssertionError(
+                f'{request.name}: {request.method.upper()} {request.path} '
+                f'returned {response.status_code}, expected {request.status}: '
+                f'{response.content[:200]!r}'
+            )
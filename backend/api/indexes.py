@@ -0,0 +1,38 @@
+"""
+Индексы моделей
+
+CoveringIndex - покрывающий индекс: кроме ключевых полей fields хранит
+значения полей covering, поэтому запросы, которым нужны только эти
+поля, читают индекс без обращения к таблице. На PostgreSQL поля
+covering добавляются в INCLUDE (не входят в ключ и не влияют на
+порядок), на остальных базах - в конец ключа индекса. Стандартный
+Index(include=...) на базах без INCLUDE создает индекс только по fields
+и выводит предупреждение models.W040.
+"""
+
+from django.db import models
+
+
+class CoveringIndex(models.Index):
+
+    def __init__(self, *args, covering=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.covering = tuple(covering)
+
+    def deconstruct(self):
+        path, args, kwargs = super().deconstruct()
+        kwargs['covering'] = self.covering
+        return path, args, kwargs
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.features.supports_covering_indexes:
+            index = models.Index(
+                fields=self.fields, include=self.covering, name=self.name,
+                db_tablespace=self.db_tablespace
+            )
+        else:
+            index = models.Index(
+                fields=[*self.fields, *self.covering], name=self.name,
+                db_tablespace=self.db_tablespace
+            )
+        return index.create_sql(model, schema_editor, using, **kwargs)
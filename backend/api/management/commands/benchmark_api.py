@@ -0,0 +1,240 @@
+"""
+Модуль замера задержек маршрутов API
+
+Команда создает тестовую базу (как manage.py test), заполняет ее
+командой generate_fake_data с фиксированным seed и выполняет сценарии
+api.benchmark через тестовый клиент Django. Для каждого маршрута
+вычисляются медиана (p50) и 95-й процентиль (p95) задержки в
+миллисекундах и пропускная способность при последовательных запросах.
+
+Результаты сравниваются с сохраненными в файле --baseline. Маршрут
+считается замедлившимся, если его p50 или p95 больше значения из файла
+более чем на --margin (доля) и на --min-delta миллисекунд. Задержки
+маршрутов в несколько миллисекунд шумят, поэтому сценарии замедлившихся
+маршрутов выполняются еще до --retries раз, и сравнивается медиана
+прогонов (столбец runs - количество прогонов). При замедлении команда
+завершается с ошибкой. С параметром --save все сценарии выполняются
+1 + --retries раз, и в файл --baseline записывается медиана прогонов.
+
+Замеры зависят от машины и версии Python: файл с результатами нужно
+сохранять на той же машине и с тем же Python (образ backend - 3.10), где
+выполняется сравнение, и перезаписывать после изменений, влияющих на
+производительность.
+
+Использование:
+    python manage.py benchmark_api --save
+    python manage.py benchmark_api --margin 0.3
+    python manage.py benchmark_api --route "recipe list" --repeat 100
+
+"""
+
+import json
+import platform
+import time
+from pathlib import Path
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import (
+    create_dataset, get_clients, get_scenarios, run_scenario, test_database
+)
+
+BASELINE = settings.BASE_DIR / 'benchmarks' / 'api_baseline.json'
+
+
+class Command(BaseCommand):
+    help = 'Measure API route latency and compare it with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=str(BASELINE))
+        parser.add_argument(
+            '--save', action='store_true',
+            help='Write results to the baseline file',
+        )
+        parser.add_argument(
+            '--margin', type=float, default=0.25,
+            help='Allowed relative slowdown of p50 and p95',
+        )
+        parser.add_argument(
+            '--min-delta', type=float, default=2.0,
+            help='Allowed absolute slowdown in milliseconds',
+        )
+        parser.add_argument(
+            '--retries', type=int, default=2,
+            help='Re-measure slower routes (all routes with --save) and '
+                 'use run medians',
+        )
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--size', type=int, default=6,
+            help='Page size and number of related rows of the user',
+        )
+        parser.add_argument(
+            '--route', action='append', default=[],
+            help='Run only scenarios whose name contains this text',
+        )
+
+    def measure(self, dataset, clients, scenarios, options):
+        """
+        Выполняет сценарии scenarios
+
+        Возвращает {маршрут: {'p50', 'p95', 'rps'}} и {маршрут: имя
+        сценария, который выполняет запрос маршрута}.
+        """
+        timings = {}
+        sources = {}
+
+        def on_request(request, call):
+            started = time.perf_counter()
+            response = call()
+            timings.setdefault(request.name, []).append(
+                time.perf_counter() - started
+            )
+            sources[request.name] = name
+            return response
+
+        def skip(request, call):
+            return call()
+
+        for name, scenario in scenarios.items():
+            try:
+                for _ in range(options['warmup']):
+                    run_scenario(scenario, dataset, clients, skip)
+                for _ in range(options['repeat']):
+                    run_scenario(scenario, dataset, clients, on_request)
+            except AssertionError as error:
+                raise CommandError(error)
+        results = {}
+        for route, values in timings.items():
+            values = np.array(values) * 1000
+            results[route] = {
+                'p50': round(float(np.percentile(values, 50)), 3),
+                'p95': round(float(np.percentile(values, 95)), 3),
+                'rps': round(float(len(values) / values.sum() * 1000), 1),
+            }
+        return results, sources
+
+    @staticmethod
+    def is_slower(result, base, options):
+        return base is not None and any(
+            result[key] > base[key] * (1 + options['margin'])
+            and result[key] - base[key] > options['min_delta']
+            for key in ('p50', 'p95')
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            baseline = None
+        routes = (baseline or {}).get('routes', {})
+        with test_database():
+            dataset = create_dataset(
+                options['users'], options['recipes'], options['seed'],
+                options['size']
+            )
+            clients = get_clients(dataset)
+            scenarios = {
+                name: scenario
+                for name, scenario in get_scenarios(dataset).items()
+                if not options['route'] or any(
+                    part in name for part in options['route']
+                )
+            }
+            results, sources = self.measure(
+                dataset, clients, scenarios, options
+            )
+            runs = {route: [result] for route, result in results.items()}
+            # задержки коротких маршрутов шумят: замедлившиеся маршруты
+            # замеряются повторно и сравниваются по медиане прогонов, для
+            # файла --save медиана прогонов считается по всем маршрутам
+            for _ in range(options['retries']):
+                names = set(scenarios) if options['save'] else {
+                    sources[route] for route, result in results.items()
+                    if self.is_slower(result, routes.get(route), options)
+                }
+                if not names:
+                    break
+                again, _ = self.measure(
+                    dataset, clients,
+                    {name: scenarios[name] for name in names}, options
+                )
+                for route, result in again.items():
+                    runs[route].append(result)
+                    results[route] = {
+                        key: round(float(np.median(
+                            [run[key] for run in runs[route]]
+                        )), 3 if key != 'rps' else 1)
+                        for key in ('p50', 'p95', 'rps')
+                    }
+        meta = {
+            'users': options['users'],
+            'recipes': options['recipes'],
+            'seed': options['seed'],
+            'size': options['size'],
+            'repeat': options['repeat'],
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+        }
+        regressions = []
+        self.stdout.write(
+            f'{"route":<56} {"p50 ms":>8} {"p95 ms":>8} {"req/s":>8} '
+            f'{"base p95":>9} {"change":>7} {"runs":>4}'
+        )
+        for name, result in results.items():
+            line = (
+                f'{name:<56} {result["p50"]:>8.2f} {result["p95"]:>8.2f} '
+                f'{result["rps"]:>8.1f}'
+            )
+            base = routes.get(name)
+            if base is not None:
+                change = result['p95'] / base['p95'] - 1 if base['p95'] else 0
+                line += (
+                    f' {base["p95"]:>9.2f} {change:>+7.0%}'
+                    f' {len(runs[name]):>4}'
+                )
+                if self.is_slower(result, base, options):
+                    regressions.append(name)
+                    line = self.style.ERROR(line)
+            self.stdout.write(line)
+        if baseline is not None and baseline.get('meta', {}) != meta:
+            self.stdout.write(self.style.WARNING(
+                f'Baseline was measured with different parameters: '
+                f'{baseline.get("meta")}'
+            ))
+        if options['save']:
+            if options['route'] and baseline is not None:
+                results = {**baseline.get('routes', {}), **results}
+            path = Path(options['baseline'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(
+                    {'meta': meta, 'routes': results}, file,
+                    indent=2, ensure_ascii=False
+                )
+                file.write('\n')
+            self.stdout.write(self.style.SUCCESS(
+                f'Saved baseline to {options["baseline"]}'
+            ))
+        elif regressions:
+            raise CommandError(
+                f'{len(regressions)} routes slowed down by more than '
+                f'{options["margin"]:.0%}: {", ".join(regressions)}'
+            )
+        elif baseline is None:
+            self.stdout.write(self.style.WARNING(
+                f'No baseline at {options["baseline"]}, run with --save'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('No regressions'))
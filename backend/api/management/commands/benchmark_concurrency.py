@@ -0,0 +1,372 @@
+"""
+Модуль сравнения обслуживания конкурентных запросов под WSGI и ASGI
+
+Команда создает тестовую базу (как benchmark_api), проверяет, что
+ответы горячих маршрутов чтения под ASGI (backend.asgi, асинхронные
+представления api.async_views) совпадают с ответами под WSGI
+(backend.wsgi), и измеряет пропускную способность и задержки обоих
+режимов при --concurrency одновременных клиентах.
+
+Серверы не запускаются, обработчики вызываются в процессе команды:
+    wsgi - WSGIHandler, --workers синхронных воркеров (как воркеры
+    gunicorn) обслуживают клиентов из потоков; воркер занят, пока
+    клиент получает ответ
+    asgi - ASGIHandler backend.asgi в одном цикле событий, клиенты -
+    задачи asyncio
+Медленный клиент моделируется задержкой --client-delay-ms при получении
+ответа, задержка сети до базы - задержкой --query-delay-ms каждого
+запроса к базе. Воркеры WSGI здесь - потоки одного процесса, поэтому
+сравнение показывает выигрыш от ожидания ввода-вывода без занятого
+воркера, а не от нескольких процессов.
+
+Использование:
+    python manage.py benchmark_concurrency
+    python manage.py benchmark_concurrency --concurrency 1 16 64 \\
+        --client-delay-ms 50 --query-delay-ms 2 --route "recipe list"
+
+"""
+
+import asyncio
+import io
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from rest_framework.authtoken.models import Token
+
+from api.benchmark import create_dataset, test_database
+from recipes.models import Ingredient
+
+# заголовки ответа, которые должны совпадать в обоих режимах
+HEADERS = ('content-type', 'allow', 'vary', 'www-authenticate')
+
+
+def get_routes(dataset, token):
+    """
+    Возвращает (маршруты замера, дополнительные случаи проверки ответов):
+    словари {имя: (адрес, заголовок Authorization или None)}
+    """
+    size = dataset.size
+    auth = f'Token {token}'
+    tags = '&'.join(f'tags={slug}' for slug in dataset.tags)
+    name = Ingredient.objects.order_by('pk').values_list(
+        'name', flat=True
+    ).first()
+    routes = {
+        'recipe list': (f'/api/recipes/?limit={size}', auth),
+        'recipe list tags': (f'/api/recipes/?limit={size}&{tags}', auth),
+        'recipe list anonymous': (f'/api/recipes/?limit={size}', None),
+        'recipe detail': (f'/api/recipes/{dataset.recipe.pk}/', auth),
+        'tags': ('/api/tags/', None),
+        'ingredient search': (
+            f'/api/ingredients/?name={quote(name[:2])}', None
+        ),
+        'subscriptions': (
+            f'/api/users/subscriptions/?limit={size}&recipes_limit=3', auth
+        ),
+    }
+    cases = {
+        'recipe list favorited': (
+            f'/api/recipes/?limit={size}&is_favorited=1', auth
+        ),
+        'recipe list ordering': (
+            f'/api/recipes/?limit={size}&ordering=popular', auth
+        ),
+        'recipe list have': (
+            f'/api/recipes/?limit={size}&have='
+            + ','.join(str(pk) for pk in dataset.ingredients), auth
+        ),
+        'recipe list bad page': ('/api/recipes/?page=100000', auth),
+        'recipe list bad tag': ('/api/recipes/?tags=no-such-tag', auth),
+        'recipe missing': ('/api/recipes/0/', auth),
+        'tag detail': ('/api/tags/1/', None),
+        'ingredient detail': (
+            f'/api/ingredients/{dataset.ingredients[0]}/', None
+        ),
+        'invalid token': ('/api/recipes/', 'Token invalid'),
+        'subscriptions anonymous': ('/api/users/subscriptions/', None),
+    }
+    return routes, cases
+
+
+def wsgi_call(handler, path, authorization):
+    """
+    Возвращает (код ответа, заголовки, тело)
+    """
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if authorization is not None:
+        environ['HTTP_AUTHORIZATION'] = authorization
+    started = {}
+
+    def start_response(status, headers):
+        started['status'] = int(status.split()[0])
+        started['headers'] = {
+            name.lower(): value for name, value in headers
+        }
+
+    response = handler(environ, start_response)
+    try:
+        body = b''.join(response)
+    finally:
+        response.close()
+    return started['status'], started['headers'], body
+
+
+async def asgi_call(application, path, authorization, delay=0):
+    """
+    Возвращает (код ответа, заголовки, тело); delay - задержка клиента
+    при получении ответа в секундах
+    """
+    path, _, query = path.partition('?')
+    headers = [(b'host', b'testserver')]
+    if authorization is not None:
+        headers.append((b'authorization', authorization.encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': headers,
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    requested = asyncio.Event()
+    result = {'body': []}
+
+    async def receive():
+        if requested.is_set():
+            # клиент не отключается до конца ответа
+            await asyncio.Event().wait()
+        requested.set()
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+            result['headers'] = {
+                name.decode().lower(): value.decode()
+                for name, value in message['headers']
+            }
+        elif message['type'] == 'http.response.body':
+            result['body'].append(message.get('body', b''))
+            if delay and not message.get('more_body', False):
+                await asyncio.sleep(delay)
+
+    await application(scope, receive, send)
+    return result['status'], result['headers'], b''.join(result['body'])
+
+
+def summarize(latencies, elapsed):
+    values = np.array(latencies) * 1000
+    return {
+        'rps': len(values) / elapsed,
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare WSGI and ASGI serving of hot read routes under load'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8, 32],
+            help='Numbers of simultaneous clients',
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests per route and concurrency level',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of WSGI sync workers',
+        )
+        parser.add_argument('--client-delay-ms', type=float, default=20)
+        parser.add_argument('--query-delay-ms', type=float, default=1)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--size', type=int, default=6,
+            help='Page size and number of related rows of the user',
+        )
+        parser.add_argument(
+            '--route', action='append', default=[],
+            help='Measure only routes whose name contains this text',
+        )
+
+    def check_parity(self, wsgi, application, routes):
+        """
+        Сравнивает ответы обоих режимов, возвращает имена расхождений
+        """
+        mismatches = []
+        for name, (path, authorization) in routes.items():
+            expected = wsgi_call(wsgi, path, authorization)
+            actual = asyncio.run(asgi_call(application, path, authorization))
+            responses = []
+            for status, headers, body in (expected, actual):
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    pass
+                responses.append((
+                    status, body,
+                    {key: headers.get(key) for key in HEADERS}
+                ))
+            if responses[0] != responses[1]:
+                mismatches.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: {path}\n    wsgi {responses[0]}\n'
+                    f'    asgi {responses[1]}'
+                ))
+            elif expected[0] != 200:
+                self.stdout.write(f'{name}: {expected[0]}')
+        return mismatches
+
+    def run_wsgi(self, handler, path, authorization, options, concurrency):
+        workers = threading.Semaphore(options['workers'])
+        delay = options['client_delay_ms'] / 1000
+        count = options['requests']
+        latencies = []
+
+        def client(number):
+            for _ in range(number, count, concurrency):
+                started = time.perf_counter()
+                with workers:
+                    status, _, _ = wsgi_call(handler, path, authorization)
+                    # синхронный воркер занят, пока клиент читает ответ
+                    time.sleep(delay)
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    raise CommandError(f'{path}: wsgi status {status}')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            for future in [
+                executor.submit(client, number)
+                for number in range(concurrency)
+            ]:
+                future.result()
+        return summarize(latencies, time.perf_counter() - started)
+
+    def run_asgi(self, application, path, authorization, options,
+                 concurrency):
+        delay = options['client_delay_ms'] / 1000
+        count = options['requests']
+        latencies = []
+
+        async def client(number):
+            for _ in range(number, count, concurrency):
+                started = time.perf_counter()
+                status, _, _ = await asgi_call(
+                    application, path, authorization, delay
+                )
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    raise CommandError(f'{path}: asgi status {status}')
+
+        async def run():
+            await asyncio.gather(
+                *(client(number) for number in range(concurrency))
+            )
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        return summarize(latencies, time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        # backend.asgi выполняет django.setup, импорт - после него
+        from backend.asgi import application
+
+        with test_database():
+            dataset = create_dataset(
+                options['users'], options['recipes'], options['seed'],
+                options['size']
+            )
+            token, _ = Token.objects.get_or_create(user=dataset.user)
+            routes, cases = get_routes(dataset, token.key)
+            if options['route']:
+                routes = {
+                    name: route for name, route in routes.items()
+                    if any(part in name for part in options['route'])
+                }
+            wsgi = WSGIHandler()
+            mismatches = self.check_parity(
+                wsgi, application, {**routes, **cases}
+            )
+            if mismatches:
+                raise CommandError(
+                    f'{len(mismatches)} routes respond differently under '
+                    f'ASGI: {", ".join(mismatches)}'
+                )
+            self.stdout.write(self.style.SUCCESS(
+                'ASGI responses match WSGI responses'
+            ))
+            query_delay = options['query_delay_ms'] / 1000
+
+            def slow_query(execute, sql, params, many, context):
+                time.sleep(query_delay)
+                return execute(sql, params, many, context)
+
+            def add_delay(sender, connection, **kwargs):
+                connection.execute_wrappers.append(slow_query)
+
+            if query_delay:
+                connection_created.connect(add_delay)
+            try:
+                self.measure(wsgi, application, routes, options)
+            finally:
+                connection_created.disconnect(add_delay)
+
+    def measure(self, wsgi, application, routes, options):
+        self.stdout.write(
+            f'{"route":<24} {"mode":<5} {"clients":>7} {"req/s":>8} '
+            f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}'
+        )
+        for name, (path, authorization) in routes.items():
+            for concurrency in options['concurrency']:
+                for mode, result in (
+                    ('wsgi', self.run_wsgi(
+                        wsgi, path, authorization, options, concurrency
+                    )),
+                    ('asgi', self.run_asgi(
+                        application, path, authorization, options,
+                        concurrency
+                    )),
+                ):
+                    self.stdout.write(
+                        f'{name:<24} {mode:<5} {concurrency:>7} '
+                        f'{result["rps"]:>8.1f} {result["p50"]:>8.2f} '
+                        f'{result["p95"]:>8.2f} {result["p99"]:>8.2f}'
+                    )
@@ -0,0 +1,116 @@
+"""
+Модуль проверки бюджетов SQL запросов API
+
+Команда создает тестовую базу, заполняет ее командой generate_fake_data
+и выполняет сценарии api.benchmark при двух размерах данных (--small и
+--large): размер страницы, количество ингредиентов и тегов нового
+рецепта, рецептов в избранном и списке покупок и подписок пользователя. Для
+каждого запроса считаются SQL запросы (api.query_budgets.QueryCounter).
+
+Команда завершается с ошибкой, если количество запросов больше бюджета
+представления (атрибут query_budgets) или растет с размером данных.
+Для каждого маршрута сценарии выполняются дважды, учитывается второй
+проход, чтобы не считать запросы заполнения кешей.
+
+Использование:
+    python manage.py check_query_budgets
+    python manage.py check_query_budgets --route "recipe list" --verbose
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import (
+    create_dataset, get_clients, get_scenarios, run_scenario, test_database
+)
+from api.query_budgets import QueryCounter, get_budget
+
+
+class Command(BaseCommand):
+    help = 'Check API query counts against view query budgets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--small', type=int, default=2)
+        parser.add_argument('--large', type=int, default=20)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--route', action='append', default=[],
+            help='Check only scenarios whose name contains this text',
+        )
+        parser.add_argument(
+            '--verbose', action='store_true',
+            help='Print SQL of all checked routes',
+        )
+
+    def count(self, dataset, options):
+        """
+        Возвращает {маршрут: (метод, путь, количество, текст запросов)}
+        """
+        clients = get_clients(dataset)
+        counts = {}
+
+        def on_request(request, call):
+            with QueryCounter() as counter:
+                response = call()
+            counts[request.name] = (
+                request.method, request.path, counter.count, counter.sql
+            )
+            return response
+
+        def skip(request, call):
+            return call()
+
+        for name, scenario in get_scenarios(dataset).items():
+            if options['route'] and not any(
+                part in name for part in options['route']
+            ):
+                continue
+            try:
+                run_scenario(scenario, dataset, clients, skip)
+                run_scenario(scenario, dataset, clients, on_request)
+            except AssertionError as error:
+                raise CommandError(error)
+        return counts
+
+    def handle(self, *args, **options):
+        small, large = options['small'], options['large']
+        with test_database():
+            dataset = create_dataset(
+                options['users'], options['recipes'], options['seed'], small
+            )
+            small_counts = self.count(dataset, options)
+            dataset.resize(large)
+            large_counts = self.count(dataset, options)
+        failures = []
+        self.stdout.write(
+            f'{"route":<56} {"view":<40} {small:>5} {large:>5} {"budget":>6}'
+        )
+        for name, (method, path, count, sql) in large_counts.items():
+            _, _, small_count, small_sql = small_counts[name]
+            view, action, budget = get_budget(path, method)
+            line = (
+                f'{name:<56} {f"{view}.{action}":<40} {small_count:>5} '
+                f'{count:>5} {budget if budget is not None else "-":>6}'
+            )
+            errors = []
+            if count > small_count:
+                errors.append(
+                    f'{count - small_count} more queries at size {large}'
+                )
+            if budget is not None and max(count, small_count) > budget:
+                errors.append(f'over budget {budget}')
+            if errors:
+                failures.append(f'{name}: {", ".join(errors)}')
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+            if options['verbose']:
+                for query in sql:
+                    self.stdout.write(f'    {query}')
+        if failures:
+            raise CommandError(
+                f'{len(failures)} routes failed the query budget check:\n'
+                + '\n'.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS('All routes within budgets'))
@@ -0,0 +1,220 @@
+"""
+Модуль проверки планов горячих SQL запросов API
+
+Команда создает тестовую базу, заполняет ее командой generate_fake_data,
+собирает статистику планировщика (ANALYZE) и выполняет сценарии
+api.benchmark для горячих маршрутов: список рецептов со всеми
+фильтрами, скачивание списка покупок, подписки, добавление и удаление
+избранного, списка покупок и подписок. Для каждого выполненного SELECT
+запроса получается план: EXPLAIN QUERY PLAN на SQLite, EXPLAIN (FORMAT
+JSON) на PostgreSQL. Как в check_query_budgets, сценарии выполняются
+дважды и проверяются запросы второго прохода: загрузка индекса
+ингредиентов процесса (recipes.pantry) не относится к обработке запроса.
+Перед вторым проходом кеш Django очищается, чтобы проверялась агрегация
+списка покупок, а не его копия в кеше.
+
+Команда завершается с ошибкой, если план читает таблицу из WATCHED
+целиком: SCAN на SQLite (в том числе полный просмотр индекса), Seq Scan
+на PostgreSQL. Для таблиц из WATCHED, прочитанных по индексу, в отчете
+выводится использованный индекс.
+
+Использование:
+    python manage.py check_query_plans
+    python manage.py check_query_plans --route "download" --verbose
+
+"""
+
+import json
+import re
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import (
+    create_dataset, get_clients, get_scenarios, run_scenario, test_database
+)
+from recipes.models import Favorite, IngredientAmount, ShoppingList
+from recipes.tasks import in_background
+from users.models import Subscribe
+
+# таблицы, которые не должны читаться целиком
+WATCHED = {
+    model._meta.db_table
+    for model in (IngredientAmount, Favorite, ShoppingList, Subscribe)
+}
+# начала имен горячих сценариев
+HOT_ROUTES = (
+    'recipe list', 'download shopping cart', 'subscriptions', 'favorite',
+    'shopping cart', 'subscribe',
+)
+# псевдонимы таблиц в запросах Django: "recipes_favorite" U0
+ALIAS = re.compile(r'"(\w+)"\s+(?:AS\s+)?"?([A-Z]\d+)"?(?=[\s,)]|$)')
+SQLITE_ACCESS = re.compile(r'^(SCAN|SEARCH) (\S+)(?: USING (.*))?')
+
+
+def get_tables(sql):
+    """
+    {имя или псевдоним: таблица} для таблиц запроса
+    """
+    tables = {name: name for name in re.findall(r'"(\w+)"', sql)}
+    tables.update({alias: name for name, alias in ALIAS.findall(sql)})
+    return tables
+
+
+def explain_sqlite(cursor, sql, params):
+    """
+    Возвращает (текст плана, [(таблица, полный просмотр, способ)])
+    """
+    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+    rows = cursor.fetchall()
+    tables = get_tables(sql)
+    accesses = []
+    for _, _, _, detail in rows:
+        match = SQLITE_ACCESS.match(detail)
+        if match:
+            kind, name, using = match.groups()
+            accesses.append(
+                (tables.get(name, name), kind == 'SCAN', using or '')
+            )
+    return '\n'.join(row[3] for row in rows), accesses
+
+
+def explain_postgresql(cursor, sql, params):
+    """
+    Возвращает (текст плана, [(таблица, полный просмотр, способ)])
+    """
+    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    accesses = []
+
+    def walk(node):
+        table = node.get('Relation Name')
+        if table is not None:
+            accesses.append((
+                table, node['Node Type'] == 'Seq Scan',
+                node.get('Index Name', node['Node Type'])
+            ))
+        for child in node.get('Plans', ()):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return json.dumps(plan, indent=2), accesses
+
+
+EXPLAIN = {'sqlite': explain_sqlite, 'postgresql': explain_postgresql}
+
+
+class Command(BaseCommand):
+    help = 'Check that hot API queries do not scan watched tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--size', type=int, default=20,
+            help='Page size and number of related rows of the user',
+        )
+        parser.add_argument(
+            '--route', action='append', default=[],
+            help='Check only scenarios whose name contains this text',
+        )
+        parser.add_argument(
+            '--verbose', action='store_true',
+            help='Print plans of all checked queries',
+        )
+
+    def capture(self, dataset, options):
+        """
+        Возвращает {маршрут: {текст запроса: параметры}}
+        """
+        clients = get_clients(dataset)
+        queries = defaultdict(dict)
+
+        def on_request(request, call):
+            def wrapper(execute, sql, params, many, context):
+                if not in_background() and not many and (
+                    sql.lstrip().upper().startswith('SELECT')
+                ):
+                    queries[request.name].setdefault(sql, params)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(wrapper):
+                return call()
+
+        def skip(request, call):
+            return call()
+
+        for name, scenario in get_scenarios(dataset).items():
+            if options['route']:
+                if not any(part in name for part in options['route']):
+                    continue
+            elif not name.startswith(HOT_ROUTES):
+                continue
+            try:
+                run_scenario(scenario, dataset, clients, skip)
+                cache.clear()
+                run_scenario(scenario, dataset, clients, on_request)
+            except AssertionError as error:
+                raise CommandError(error)
+        return queries
+
+    def handle(self, *args, **options):
+        explain = EXPLAIN.get(connection.vendor)
+        if explain is None:
+            raise CommandError(
+                f'Query plans are not supported on {connection.vendor}'
+            )
+        failures = []
+        with test_database():
+            dataset = create_dataset(
+                options['users'], options['recipes'], options['seed'],
+                options['size']
+            )
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            queries = self.capture(dataset, options)
+            with connection.cursor() as cursor:
+                for name, statements in queries.items():
+                    indexes = set()
+                    scans = []
+                    for sql, params in statements.items():
+                        plan, accesses = explain(cursor, sql, params)
+                        full = [
+                            table for table, is_full, _ in accesses
+                            if table in WATCHED and is_full
+                        ]
+                        indexes.update(
+                            f'{table} ({using})'
+                            for table, is_full, using in accesses
+                            if table in WATCHED and not is_full
+                        )
+                        if full:
+                            scans.append((full, sql, plan))
+                        elif options['verbose']:
+                            self.stdout.write(f'    {sql}\n{plan}\n')
+                    line = (
+                        f'{name:<40} {len(statements):>3} queries  '
+                        f'{", ".join(sorted(indexes)) or "-"}'
+                    )
+                    if scans:
+                        failures.append(name)
+                        line = self.style.ERROR(line)
+                    self.stdout.write(line)
+                    for full, sql, plan in scans:
+                        self.stdout.write(self.style.ERROR(
+                            f'    full scan of {", ".join(full)}: {sql}'
+                        ))
+                        self.stdout.write(f'{plan}\n')
+        if failures:
+            raise CommandError(
+                f'{len(failures)} routes scan watched tables: '
+                f'{", ".join(failures)}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'No full scans of watched tables'
+        ))
@@ -0,0 +1,45 @@
+"""
+Модуль копирования основной базы SQLite в файлы реплик
+
+Для локальной проверки чтения из реплик (api.replicas) без настоящей
+репликации: основная база и реплики - файлы SQLite, команда копирует
+основную базу в каждую реплику средствами sqlite3 (backup). Между
+запусками команды реплики отстают от основной базы, как реплики
+PostgreSQL при задержке репликации.
+
+Использование:
+    DB_NAME=primary.sqlite3 DB_REPLICAS=replica.sqlite3 \\
+        python manage.py sync_sqlite_replicas
+
+"""
+
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary database into the replica files'
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Replicas are copied only on SQLite')
+        if not settings.REPLICA_DATABASES:
+            raise CommandError('No replicas in DB_REPLICAS')
+        primary.ensure_connection()
+        for alias in settings.REPLICA_DATABASES:
+            connections[alias].close()
+            name = connections[alias].settings_dict['NAME']
+            target = sqlite3.connect(name)
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f'{alias}: {name}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Copied the primary database into '
+            f'{len(settings.REPLICA_DATABASES)} replicas'
+        ))
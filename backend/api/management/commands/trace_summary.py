@@ -0,0 +1,70 @@
+"""
+Модуль сводки по файлу трассировки api.tracing
+
+Для каждого маршрута выводятся количество трассированных запросов,
+среднее время запроса и для каждого этапа (authentication, pagination,
+<Сериализатор>.data, render, sql, ...) среднее время на запрос и доля
+во времени запроса. Этапы вложены друг в друга (запросы sql выполняются
+внутри pagination и сериализаторов), поэтому сумма долей может быть
+больше 100%.
+
+Использование:
+    python manage.py trace_summary
+    python manage.py trace_summary --file /tmp/trace.json --endpoint recipes
+
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.tracing import read_events
+
+
+class Command(BaseCommand):
+    help = 'Summarize per-endpoint phase timings from a trace file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=settings.TRACING_FILE)
+        parser.add_argument(
+            '--endpoint', action='append', default=[],
+            help='Show only endpoints whose name contains this text',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            events = read_events(options['file'])
+        except FileNotFoundError:
+            raise CommandError(f'No trace file at {options["file"]}')
+        requests = defaultdict(list)
+        phases = defaultdict(lambda: defaultdict(list))
+        for event in events:
+            endpoint = event['args'].get('endpoint') or '-'
+            if options['endpoint'] and not any(
+                part in endpoint for part in options['endpoint']
+            ):
+                continue
+            if event['name'] == 'request':
+                requests[endpoint].append(event['dur'])
+            else:
+                phases[endpoint][event['name']].append(event['dur'])
+        for endpoint, durations in sorted(requests.items()):
+            count = len(durations)
+            total = sum(durations)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{endpoint}: {count} requests, '
+                f'{total / count / 1000:.2f} ms per request'
+            ))
+            self.stdout.write(
+                f'    {"phase":<40} {"calls":>7} {"ms/request":>11} '
+                f'{"share":>7}'
+            )
+            for name, values in sorted(
+                phases[endpoint].items(), key=lambda item: -sum(item[1])
+            ):
+                self.stdout.write(
+                    f'    {name:<40} {len(values) / count:>7.1f} '
+                    f'{sum(values) / count / 1000:>11.2f} '
+                    f'{sum(values) / total:>7.1%}'
+                )
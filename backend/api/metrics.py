@@ -0,0 +1,377 @@
+"""
+Метрики процессов backend в формате Prometheus
+
+Каждый процесс (воркер gunicorn) пишет значения метрик в собственный
+файл METRICS_DIR/<pid>.metrics, отображенный в память (mmap), поэтому
+запись не требует блокировок между процессами. Страница /metrics
+читает файлы всех процессов, складывает значения и выводит их в
+текстовом формате Prometheus. Файлы завершившихся процессов не
+удаляются: счетчики не уменьшаются при перезапуске воркеров.
+
+Формат файла: 8 байт - занятый размер, затем записи
+[длина ключа (4 байта)][ключ JSON][выравнивание до 8 байт][float64].
+Новая запись сначала записывается целиком, затем увеличивается
+занятый размер, поэтому читатель не видит недописанных записей.
+
+Метрики (METRICS):
+    http_request_duration_seconds - время обработки запроса
+    http_responses_total - ответы по коду статуса
+    db_queries_total, db_query_seconds_total - запросы к базе и их время
+    cache_requests_total - обращения к кешу (result: hit, miss)
+    serializer_seconds - время получения data сериализаторов проекта
+    (TimedSerializerMixin)
+
+Классы:
+    ValuesFile - значения метрик одного процесса
+    MetricsMiddleware - middleware, записывающая метрики запроса
+    TimedSerializerMixin - замер времени получения data сериализатора
+    TimedListSerializer - список с замером времени получения data
+
+Функции:
+    inc - увеличить счетчик
+    observe - добавить значение в гистограмму
+    collect - значения метрик всех процессов
+    render - текст для Prometheus
+    metrics_view - страница /metrics
+"""
+
+import ipaddress
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from rest_framework.serializers import ListSerializer
+
+from .middleware import AsyncCapableMiddleware, get_view
+from .tracing import span
+
+BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+# имя: (тип, описание, метки)
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', 'Request processing time',
+        ('view', 'action', 'method'),
+    ),
+    'http_responses_total': (
+        'counter', 'Responses by status code', ('view', 'action', 'status'),
+    ),
+    'db_queries_total': (
+        'counter', 'Database queries', ('view', 'action'),
+    ),
+    'db_query_seconds_total': (
+        'counter', 'Time spent in database queries', ('view', 'action'),
+    ),
+    'cache_requests_total': (
+        'counter', 'Cache lookups', ('cache', 'result'),
+    ),
+    'serializer_seconds': (
+        'histogram', 'Time to build serializer.data', ('serializer',),
+    ),
+}
+HEADER = struct.Struct('Q')
+KEY_LENGTH = struct.Struct('I')
+VALUE = struct.Struct('d')
+INITIAL_SIZE = 64 * 1024
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class ValuesFile:
+    """
+    Значения метрик одного процесса в файле, отображенном в память
+
+    Ключ значения - строка JSON [имя, [значения меток]].
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = max(os.fstat(self.fd).st_size, INITIAL_SIZE)
+        os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.used = HEADER.unpack_from(self.map)[0] or HEADER.size
+        for key, _, offset in read_entries(self.map, self.used):
+            self.offsets[key] = offset
+
+    def add(self, key, amount):
+        with self.lock:
+            offset = self.offsets.get(key)
+            if offset is None:
+                offset = self.append(key)
+            value = VALUE.unpack_from(self.map, offset)[0]
+            VALUE.pack_into(self.map, offset, value + amount)
+
+    def append(self, key):
+        encoded = key.encode()
+        length = KEY_LENGTH.size + len(encoded)
+        length += -length % 8
+        size = length + VALUE.size
+        if self.used + size > len(self.map):
+            new_size = len(self.map) * 2
+            while self.used + size > new_size:
+                new_size *= 2
+            self.map.close()
+            os.ftruncate(self.fd, new_size)
+            self.map = mmap.mmap(self.fd, new_size)
+        position = self.used
+        KEY_LENGTH.pack_into(self.map, position, len(encoded))
+        self.map[
+            position + KEY_LENGTH.size:position + KEY_LENGTH.size
+            + len(encoded)
+        ] = encoded
+        VALUE.pack_into(self.map, position + length, 0.0)
+        self.used += size
+        HEADER.pack_into(self.map, 0, self.used)
+        self.offsets[key] = position + length
+        return position + length
+
+
+def read_entries(data, used):
+    """
+    Записи файла значений: (ключ, значение, смещение значения)
+    """
+    position = HEADER.size
+    while position < used:
+        length = KEY_LENGTH.unpack_from(data, position)[0]
+        start = position + KEY_LENGTH.size
+        key = bytes(data[start:start + length]).decode()
+        offset = position + KEY_LENGTH.size + length
+        offset += -offset % 8
+        yield key, VALUE.unpack_from(data, offset)[0], offset
+        position = offset + VALUE.size
+
+
+_values = None
+_values_pid = None
+
+
+def get_values():
+    """
+    Файл значений текущего процесса (создается заново после fork)
+    """
+    global _values, _values_pid
+    if _values_pid != os.getpid():
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        _values = ValuesFile(directory / f'{os.getpid()}.metrics')
+        _values_pid = os.getpid()
+    return _values
+
+
+def get_key(name, suffix, labels):
+    return json.dumps(
+        [name + suffix, [str(value) for value in labels]],
+        ensure_ascii=False
+    )
+
+
+def inc(name, *labels, amount=1):
+    """
+    Увеличивает счетчик name с метками labels (в порядке METRICS)
+    """
+    get_values().add(get_key(name, '', labels), amount)
+
+
+def observe(name, value, *labels):
+    """
+    Добавляет значение value в гистограмму name
+
+    В файле хранятся количества значений по интервалам между границами
+    BUCKETS, накопленные суммы вычисляются при выводе.
+    """
+    values = get_values()
+    for bucket in BUCKETS:
+        if value <= bucket:
+            values.add(get_key(name, '_bucket', (*labels, bucket)), 1)
+            break
+    values.add(get_key(name, '_sum', labels), value)
+    values.add(get_key(name, '_count', labels), 1)
+
+
+def collect():
+    """
+    Значения метрик всех процессов: {(имя, метки): значение}
+    """
+    totals = defaultdict(float)
+    for path in Path(settings.METRICS_DIR).glob('*.metrics'):
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            continue
+        if len(data) < HEADER.size:
+            continue
+        used = min(HEADER.unpack_from(data)[0], len(data))
+        for key, value, _ in read_entries(data, used):
+            name, labels = json.loads(key)
+            totals[name, tuple(labels)] += value
+    return totals
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        f'{name}="{escape(value)}"' for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+def escape(value):
+    return (
+        str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')
+    )
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def render():
+    """
+    Текст метрик всех процессов в формате Prometheus
+    """
+    totals = collect()
+    lines = []
+    for name, (kind, description, label_names) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (key, labels), value in sorted(totals.items()):
+                if key == name:
+                    lines.append(
+                        f'{name}{format_labels(label_names, labels)} '
+                        f'{format_value(value)}'
+                    )
+            continue
+        buckets = defaultdict(dict)
+        for (key, labels), value in totals.items():
+            if key == f'{name}_bucket':
+                buckets[labels[:-1]][float(labels[-1])] = value
+        for (key, labels), count in sorted(totals.items()):
+            if key != f'{name}_count':
+                continue
+            cumulative = 0
+            for bucket in BUCKETS:
+                cumulative += buckets[labels].get(bucket, 0)
+                lines.append(
+                    f'{name}_bucket'
+                    f'{format_labels((*label_names, "le"), (*labels, bucket))}'
+                    f' {format_value(cumulative)}'
+                )
+            label_text = format_labels(label_names, labels)
+            lines.append(
+                f'{name}_bucket'
+                f'{format_labels((*label_names, "le"), (*labels, "+Inf"))}'
+                f' {format_value(count)}'
+            )
+            lines.append(
+                f'{name}_sum{label_text} '
+                f'{format_value(totals[f"{name}_sum", labels])}'
+            )
+            lines.append(f'{name}_count{label_text} {format_value(count)}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Метрики для Prometheus, доступны с адресов METRICS_ALLOWED_IPS
+    """
+    address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', '::'))
+    if not any(
+        address in ipaddress.ip_network(network)
+        for network in settings.METRICS_ALLOWED_IPS
+    ):
+        raise PermissionDenied
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """
+    Записывает время обработки, код ответа и запросы к базе
+
+    Количество и время запросов к базе берутся из статистики
+    api.middleware.SQLStatsMiddleware (request.sql_stats), поэтому
+    middleware должна стоять перед ней.
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        return self.record(request, response, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        return self.record(request, response, started)
+
+    def record(self, request, response, started):
+        duration = time.perf_counter() - started
+        view, action = get_view(request)
+        observe(
+            'http_request_duration_seconds', duration,
+            view, action, request.method
+        )
+        inc('http_responses_total', view, action, response.status_code)
+        stats = getattr(request, 'sql_stats', None)
+        if stats is not None:
+            inc('db_queries_total', view, action, amount=stats.count)
+            inc(
+                'db_query_seconds_total', view, action,
+                amount=stats.duration
+            )
+        return response
+
+
+_serializing = threading.local()
+
+
+class TimedSerializerMixin:
+    """
+    Замер времени получения data сериализатора
+
+    Учитывается только внешний вызов: данные вложенных сериализаторов,
+    полученные внутри него, входят в его время. Для трассируемых
+    запросов добавляется интервал <Сериализатор>.data (api.tracing).
+    Списки (many=True) замеряются, если Meta.list_serializer_class
+    сериализатора - TimedListSerializer или его подкласс.
+    """
+
+    @property
+    def data(self):
+        if getattr(_serializing, 'active', False):
+            return super().data
+        name = type(getattr(self, 'child', self)).__name__
+        _serializing.active = True
+        started = time.perf_counter()
+        try:
+            with span(f'{name}.data', 'serializer'):
+                return super().data
+        finally:
+            _serializing.active = False
+            observe(
+                'serializer_seconds', time.perf_counter() - started, name
+            )
+
+
+class TimedListSerializer(TimedSerializerMixin, ListSerializer):
+    """
+    Список с замером времени получения data
+    """
@@ -0,0 +1,247 @@
+"""
+Middleware статистики SQL запросов
+
+SQLStatsMiddleware подключает к соединениям с базой обертку
+connection.execute_wrapper на время обработки запроса и собирает
+количество запросов, суммарное время в базе и самый медленный запрос.
+Статистика не зависит от DEBUG и не хранит текст всех запросов.
+
+Результат:
+    - заголовок ответа Server-Timing, например
+      db;dur=12.5;desc="8 queries", app;dur=40.1
+    - строка лога api.sql в формате JSON (уровень DEBUG, выводится при
+      SQL_LOG_LEVEL=DEBUG)
+    - предупреждение в лог api.sql о каждом запросе дольше
+      SQL_SLOW_QUERY_MS миллисекунд
+    - предупреждение о повторяющемся запросе (N+1): один и тот же текст
+      запроса выполнен SQL_N_PLUS_ONE_THRESHOLD и более раз. В
+      предупреждении указывается место вызова: метод сериализатора
+      (например RecipeGetSerializer.get_is_favorited) или первая строка
+      кода проекта в стеке вызовов
+
+Запросы фоновых задач (recipes.tasks) не учитываются. Статистика
+сохраняется в атрибуте request.sql_stats для api.metrics.
+
+Классы:
+    AsyncCapableMiddleware - основа middleware для WSGI и ASGI
+    SQLStats - статистика запросов одного HTTP запроса
+    SQLStatsMiddleware - middleware
+
+Функции:
+    get_view - имя представления и действие обработчика запроса
+"""
+
+import json
+import logging
+import re
+import sys
+import time
+
+from asgiref.sync import (
+    iscoroutinefunction, markcoroutinefunction, sync_to_async
+)
+from django.conf import settings
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+from recipes.tasks import in_background
+
+logger = logging.getLogger('api.sql')
+
+# списки параметров IN (%s, %s, ...) разной длины - один вид запроса
+PLACEHOLDERS = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+# установленные пакеты, если виртуальное окружение внутри проекта
+LIBRARY_PATHS = tuple(path for path in sys.path if 'site-packages' in path)
+
+
+def get_shape(sql):
+    """
+    Текст запроса без различий в длине списков параметров
+    """
+    return PLACEHOLDERS.sub('(%s...)', sql)
+
+
+def get_origin():
+    """
+    Место вызова запроса
+
+    Возвращает 'Класс.метод' первого сериализатора в стеке вызовов, иначе
+    'файл:строка функция' первого кадра кода проекта.
+    """
+    frame = sys._getframe(2)
+    project = None
+    while frame is not None:
+        owner = frame.f_locals.get('self')
+        if isinstance(owner, BaseSerializer):
+            return f'{type(owner).__name__}.{frame.f_code.co_name}'
+        filename = frame.f_code.co_filename
+        if (
+            project is None and filename.startswith(str(settings.BASE_DIR))
+            and not filename.startswith(LIBRARY_PATHS)
+            and filename != __file__
+        ):
+            project = (
+                f'{filename[len(str(settings.BASE_DIR)) + 1:]}:'
+                f'{frame.f_lineno} {frame.f_code.co_name}'
+            )
+        frame = frame.f_back
+    return project
+
+
+def get_view(request):
+    """
+    (имя представления, действие) обработчика запроса
+
+    Действие вьюсета - имя метода (list, retrieve, ...), для остальных
+    представлений - HTTP метод в нижнем регистре. Для запроса без
+    маршрута возвращает пустые строки.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '', ''
+    action = request.method.lower()
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        action = actions.get(action, action)
+    return match.view_name, action
+
+
+class AsyncCapableMiddleware:
+    """
+    Основа middleware, работающей без переключения потоков под WSGI и ASGI
+
+    Если следующий обработчик асинхронный (ASGI), объект помечается как
+    корутина и __call__ возвращает корутину __acall__, иначе запрос
+    обрабатывается синхронно. Подклассы начинают __call__ с проверки
+    is_async.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class SQLStats:
+    """
+    Статистика запросов одного HTTP запроса
+
+    Объект - обертка для connection.execute_wrapper и контекстный
+    менеджер, подключающий ее ко всем соединениям текущего потока.
+    Атрибуты:
+        count - количество запросов
+        duration - суммарное время запросов (секунды)
+        slowest - (время, текст) самого медленного запроса
+        repeated - {текст запроса: (количество, место вызова)} для
+        запросов, повторенных не менее SQL_N_PLUS_ONE_THRESHOLD раз
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = (0.0, None)
+        self.shapes = {}
+        self.repeated = {}
+        self.slow_threshold = settings.SQL_SLOW_QUERY_MS / 1000
+        self.repeat_threshold = settings.SQL_N_PLUS_ONE_THRESHOLD
+
+    def __call__(self, execute, sql, params, many, context):
+        if in_background():
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if duration > self.slowest[0]:
+                self.slowest = (duration, sql)
+            if duration >= self.slow_threshold:
+                logger.warning(
+                    'Slow query %.1f ms at %s: %s',
+                    duration * 1000, get_origin(), sql
+                )
+            shape = get_shape(sql)
+            repeats = self.shapes.get(shape, 0) + 1
+            self.shapes[shape] = repeats
+            if repeats == self.repeat_threshold:
+                self.repeated[shape] = (repeats, get_origin())
+            elif repeats > self.repeat_threshold:
+                self.repeated[shape] = (repeats, self.repeated[shape][1])
+
+    def __enter__(self):
+        # обертка подключается ко всем соединениям текущего потока
+        self._wrapped = []
+        for connection in connections.all():
+            wrapper = connection.execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrapped.append(wrapper)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._wrapped:
+            self._wrapped.pop().__exit__(*exc_info)
+
+
+class SQLStatsMiddleware(AsyncCapableMiddleware):
+    """
+    Собирает статистику SQL запросов каждого HTTP запроса
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with SQLStats() as stats:
+            request.sql_stats = stats
+            response = self.get_response(request)
+        return self.report(request, response, stats, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats = SQLStats()
+        # соединения с базой принадлежат потоку, а запросы ORM под ASGI
+        # выполняются в потоке запроса (sync_to_async), поэтому обертка
+        # подключается в нем
+        await sync_to_async(stats.__enter__)()
+        request.sql_stats = stats
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stats.__exit__)(None, None, None)
+        return self.report(request, response, stats, started)
+
+    def report(self, request, response, stats, started):
+        """
+        Заголовок Server-Timing и записи лога по статистике запроса
+        """
+        total = time.perf_counter() - started
+        response['Server-Timing'] = (
+            f'db;dur={stats.duration * 1000:.1f};'
+            f'desc="{stats.count} queries", app;dur={total * 1000:.1f}'
+        )
+        for shape, (repeats, origin) in stats.repeated.items():
+            logger.warning(
+                'Query repeated %d times in %s %s at %s: %s',
+                repeats, request.method, request.path, origin, shape
+            )
+        if not logger.isEnabledFor(logging.DEBUG):
+            return response
+        match = getattr(request, 'resolver_match', None)
+        logger.debug(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 1),
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 1),
+            'slowest_ms': round(stats.slowest[0] * 1000, 1),
+            'slowest_sql': stats.slowest[1],
+            'repeated': len(stats.repeated),
+        }, ensure_ascii=False))
+        return response
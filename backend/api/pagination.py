@@ -1,4 +1,6 @@
 from django.conf import settings
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 
 
@@ -8,3 +10,31 @@ class CustomPageNumberPagination(PageNumberPagination):
     """
     page_size = settings.PAGE_SIZE
     page_size_query_param = 'limit'
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset для асинхронных представлений (api.async_views)
+
+        Количество объектов и объекты страницы загружаются асинхронным
+        ORM, страница и ошибки те же, что у paginate_queryset.
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count - cached_property, поэтому значение, полученное
+        # асинхронно, подставляется вместо запроса COUNT в потоке
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            ))
+        # срез запроса в странице не выполнен, объекты загружаются здесь
+        self.page.object_list = [obj async for obj in self.page.object_list]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return self.page.object_list
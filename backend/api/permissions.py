@@ -17,7 +17,8 @@ class IsAuthorOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.author == request.user
+        # сравнение id не загружает автора объекта
+        return obj.author_id == request.user.pk
 
 
 class IsAuthor(permissions.BasePermission):
@@ -0,0 +1,280 @@
+"""
+Профилирование отдельных запросов к API
+
+Сотрудник (is_staff) включает профилирование запроса параметром
+?profile=1 или заголовком X-Profile: 1. Пользователь определяется по
+сессии или аутентификацией REST Framework (токен), для остальных
+пользователей параметр ничего не меняет. Значение sample включает только
+сэмплирующий сборщик без cProfile - так замедление запроса меньше, но
+файла pstats нет.
+
+Во время запроса работают два сборщика:
+    - cProfile - файл pstats (открывается pstats, snakeviz, ...)
+    - Sampler - поток, который каждые PROFILING_SAMPLE_INTERVAL_MS
+      миллисекунд снимает стек потока запроса. Результат - текстовый файл
+      свернутых стеков (collapsed stacks) для flamegraph.pl и speedscope
+
+Профили хранятся в каталоге PROFILING_DIR как кольцевой буфер: после
+записи нового профиля удаляются самые старые сверх
+PROFILING_MAX_PROFILES. Файлы профиля: <имя>.json (описание запроса),
+<имя>.prof и <имя>.txt. Имя профиля возвращается в заголовке ответа
+X-Profile-Id. Список профилей доступен в админке (api.admin).
+
+Под ASGI профилируется поток цикла событий: асинхронные представления и
+middleware. Код, выполняемый в потоках sync_to_async (запросы ORM,
+синхронные представления), в профиль не попадает. Снимки стека во время
+обработки других запросов отбрасываются, cProfile их учитывает.
+
+Классы:
+    Sampler - сэмплирующий сборщик стеков
+    Profile - профилирование одного запроса
+    ProfilingMiddleware - middleware
+
+Функции:
+    list_profiles - описания сохраненных профилей, новые первыми
+    get_profile_file - путь к файлу профиля
+"""
+
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .middleware import AsyncCapableMiddleware
+
+PARAMETER = 'profile'
+HEADER = 'HTTP_X_PROFILE'
+# расширения файлов профиля
+FILES = {'pstats': '.prof', 'collapsed': '.txt'}
+NAME = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+
+
+class Sampler(threading.Thread):
+    """
+    Сэмплирующий сборщик стеков потока
+
+    Стек снимается через sys._current_frames от кадра root (не включая
+    его) до текущего кадра потока, снимки без кадра root (поток выполняет
+    другой код) не учитываются. Атрибут stacks - Counter {свернутый стек:
+    количество снимков}, кадры в стеке разделены ';'.
+    """
+
+    def __init__(self, thread_id, root, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self._labels = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame is not self.root:
+                code = frame.f_code
+                label = self._labels.get(code)
+                if label is None:
+                    label = self._labels[code] = (
+                        f'{code.co_name} ({short_path(code.co_filename)}:'
+                        f'{code.co_firstlineno})'
+                    )
+                stack.append(label)
+                frame = frame.f_back
+            if frame is not None and stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def short_path(filename):
+    """
+    Путь файла относительно проекта или каталога пакетов
+    """
+    prefixes = (str(settings.BASE_DIR), *sorted(sys.path, key=len)[::-1])
+    for prefix in prefixes:
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def is_requested(request):
+    """
+    Режим профилирования из запроса: None, 'full' или 'sample'
+    """
+    value = request.GET.get(PARAMETER, request.META.get(HEADER))
+    if value in (None, '', '0', 'false'):
+        return None
+    return 'sample' if value == 'sample' else 'full'
+
+
+def get_staff_user(request):
+    """
+    Автор запроса, если он сотрудник, иначе None
+
+    Если пользователя нет в сессии, запрос аутентифицируется классами
+    REST Framework (токен).
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        drf_request = Request(request, authenticators=[
+            authenticator()
+            for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ])
+        try:
+            user = drf_request.user
+        except APIException:
+            return None
+    return user if user.is_staff else None
+
+
+def get_directory():
+    """
+    Каталог профилей
+    """
+    return Path(settings.PROFILING_DIR)
+
+
+def get_profile_file(name, kind):
+    """
+    Путь к файлу профиля вида kind (ключ FILES) или None
+    """
+    if not NAME.match(name) or kind not in FILES:
+        return None
+    path = get_directory() / f'{name}{FILES[kind]}'
+    return path if path.exists() else None
+
+
+def list_profiles():
+    """
+    Описания сохраненных профилей, новые первыми
+    """
+    profiles = []
+    for path in sorted(get_directory().glob('*.json'), reverse=True):
+        try:
+            with open(path, encoding='utf-8') as file:
+                profiles.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def save_profile(meta, profiler, stacks):
+    """
+    Записывает файлы профиля и удаляет самые старые профили
+    """
+    directory = get_directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = meta['name']
+    if profiler is not None:
+        profiler.dump_stats(directory / f'{name}.prof')
+    with open(directory / f'{name}.txt', 'w', encoding='utf-8') as file:
+        for stack, count in stacks.most_common():
+            file.write(f'{stack} {count}\n')
+    # описание пишется последним: профиль без него не выводится в списке
+    with open(directory / f'{name}.json', 'w', encoding='utf-8') as file:
+        json.dump(meta, file, ensure_ascii=False)
+    profiles = sorted(directory.glob('*.json'))
+    for path in profiles[:-settings.PROFILING_MAX_PROFILES]:
+        for extension in ('.json', *FILES.values()):
+            path.with_suffix(extension).unlink(missing_ok=True)
+
+
+class Profile:
+    """
+    Профилирование одного запроса
+
+    Сборщики запускаются при создании объекта в потоке, который
+    обрабатывает запрос; корнем стеков Sampler становится кадр, из
+    которого создан объект.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.created = datetime.now()
+        self.name = (
+            f'{self.created:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}'
+        )
+        self.sampler = Sampler(
+            threading.get_ident(), sys._getframe(1),
+            settings.PROFILING_SAMPLE_INTERVAL_MS / 1000
+        )
+        self.profiler = cProfile.Profile() if mode == 'full' else None
+        self.started = time.perf_counter()
+        self.sampler.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.sampler.stop()
+        self.duration = time.perf_counter() - self.started
+
+    def save(self, request, user, response):
+        """
+        Сохраняет профиль и добавляет его имя в заголовок ответа
+        """
+        save_profile({
+            'name': self.name,
+            'created': self.created.isoformat(timespec='seconds'),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': str(user),
+            'status': response.status_code,
+            'duration_ms': round(self.duration * 1000, 1),
+            'samples': sum(self.sampler.stacks.values()),
+            'mode': self.mode,
+        }, self.profiler, self.sampler.stacks)
+        response['X-Profile-Id'] = self.name
+        return response
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """
+    Профилирует запросы сотрудников с параметром profile
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        mode = is_requested(request)
+        user = get_staff_user(request) if mode is not None else None
+        if user is None:
+            return self.get_response(request)
+        profile = Profile(mode)
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.stop()
+        return profile.save(request, user, response)
+
+    async def __acall__(self, request):
+        mode = is_requested(request)
+        user = None
+        if mode is not None:
+            user = await sync_to_async(get_staff_user)(request)
+        if user is None:
+            return await self.get_response(request)
+        profile = Profile(mode)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.stop()
+        return profile.save(request, user, response)
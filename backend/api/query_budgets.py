@@ -0,0 +1,76 @@
+"""
+Бюджеты SQL запросов обработчиков API
+
+Бюджет объявляется в классе представления атрибутом query_budgets -
+словарем {действие: наибольшее количество запросов}. Действие вьюсета -
+имя метода (list, retrieve, create, favorite, ...), действие APIView -
+HTTP метод в нижнем регистре (get, post, ...).
+
+Количество запросов не должно зависеть от размера страницы и количества
+связанных строк, поэтому проверка выполняет запросы сценариев
+api.benchmark при двух размерах данных и сравнивает количество запросов.
+Запросы фоновых задач (recipes.tasks) не учитываются: на PostgreSQL они
+выполняются не в потоке запроса. Не учитывается и BEGIN: на SQLite Django
+выполняет его отдельным запросом, на PostgreSQL транзакцию открывает
+драйвер, поэтому количество запросов одинаково для обеих баз.
+
+Классы:
+    QueryCounter - счетчик запросов к базе в текущем потоке
+
+Функции:
+    get_budget - бюджет обработчика запроса
+"""
+
+from urllib.parse import urlsplit
+
+from django.db import connections
+from django.urls import resolve
+
+from recipes.tasks import in_background
+
+
+class QueryCounter:
+    """
+    Контекстный менеджер, считающий запросы ко всем базам
+
+    Запросы подключаются через connection.execute_wrapper, поэтому
+    DEBUG не нужен. Атрибут count - количество запросов, sql - их текст.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sql = []
+        self._wrapped = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not in_background() and sql != 'BEGIN':
+            self.count += 1
+            self.sql.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        for connection in connections.all():
+            wrapper = connection.execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrapped.append(wrapper)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._wrapped:
+            self._wrapped.pop().__exit__(*exc_info)
+
+
+def get_budget(path, method):
+    """
+    Возвращает (представление, действие, бюджет) для запроса
+
+    Бюджет - None, если представление его не объявляет.
+    """
+    match = resolve(urlsplit(path).path)
+    view = match.func.cls
+    action = method.lower()
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        action = actions.get(action, action)
+    budget = getattr(view, 'query_budgets', {}).get(action)
+    return view.__name__, action, budget
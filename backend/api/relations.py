@@ -0,0 +1,359 @@
+"""
+Связи пользователя с объектами
+
+Связи - избранное (Favorite), список покупок (ShoppingList) и подписки
+(Subscribe). Каждая связь - модель с полем user, полем объекта (recipe или
+author) и уникальным ограничением на эту пару.
+
+Объекты Relation:
+    favorite_relation - избранное
+    shopping_cart_relation - список покупок
+    subscribe_relation - подписки
+
+Добавление связи - один запрос INSERT ... ON CONFLICT DO NOTHING, удаление -
+один запрос DELETE. Результат запроса (0 или 1 строка) определяет ответ, без
+предварительных проверок существования и гонки между ними и записью.
+
+Пакетные методы возвращают количество изменённых связей и список результатов
+вида {'id': id, 'status': статус} в порядке id из запроса. Изменённые связи
+определяются результатом самой записи (RETURNING или количество строк),
+поэтому параллельные запросы с теми же id не меняют счетчики дважды.
+
+Статусы:
+    created - связь добавлена
+    exists - связь уже была
+    deleted - связь удалена
+    absent - связи не было
+    not_found - объект не найден или недоступен
+
+После каждого изменения отправляется сигнал relations_changed с
+аргументами:
+    sender - модель связи
+    user - пользователь
+    ids - список id объектов
+    created - True при добавлении, False при удалении
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.db.models.constants import OnConflict
+from django.dispatch import Signal
+from django.http import Http404
+
+from recipes.models import Favorite, ShoppingList
+from users.models import Subscribe
+
+CREATED = 'created'
+EXISTS = 'exists'
+DELETED = 'deleted'
+ABSENT = 'absent'
+NOT_FOUND = 'not_found'
+
+relations_changed = Signal()
+
+
+class Relation:
+    """
+    Связь пользователя с объектом
+
+    Параметры:
+        model - модель связи
+        field - имя поля объекта в модели связи
+    """
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.target_model = model._meta.get_field(field).related_model
+
+    def _changed(self, user, ids, created):
+        relations_changed.send(
+            sender=self.model, user=user, ids=ids, created=created
+        )
+
+    def _atomic(self):
+        # запись связей и обновление счетчиков по сигналу relations_changed
+        # фиксируются вместе: параллельный запрос видит связь только вместе
+        # с измененным счетчиком
+        return transaction.atomic(using=router.db_for_write(self.model))
+
+    def clean_pk(self, pk):
+        """
+        Приводит id объекта из url к типу первичного ключа
+
+        Некорректный id означает несуществующий объект - Http404
+        """
+        try:
+            return self.target_model._meta.pk.to_python(pk)
+        except ValidationError:
+            raise Http404
+
+    def get_target_or_404(self, pk):
+        """
+        Возвращает объект связи или вызывает Http404
+        """
+        try:
+            return self.target_model.objects.get(pk=self.clean_pk(pk))
+        except self.target_model.DoesNotExist:
+            raise Http404
+
+    def add(self, user, pk):
+        """
+        Добавляет связь пользователя с объектом
+
+        Выполняет один запрос:
+            INSERT INTO <связь> (...) SELECT ... FROM <объект> WHERE id = pk
+            ON CONFLICT DO NOTHING
+
+        Возвращает 1, если связь добавлена, и 0, если связь уже была или
+        объекта не существует.
+        """
+        pk = self.clean_pk(pk)
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        opts = self.model._meta
+        target_opts = self.target_model._meta
+        obj = self.model(user=user, **{f'{self.field}_id': pk})
+        fields = [
+            field for field in opts.local_concrete_fields
+            if not field.primary_key
+        ]
+        params = [
+            field.get_db_prep_save(field.pre_save(obj, True), connection)
+            for field in fields
+        ]
+        qn = connection.ops.quote_name
+        sql = '{insert} {table} ({columns}) SELECT {values} FROM {target} ' \
+            'WHERE {target_pk} = %s {suffix}'.format(
+                insert=connection.ops.insert_statement(
+                    on_conflict=OnConflict.IGNORE
+                ),
+                table=qn(opts.db_table),
+                columns=', '.join(qn(field.column) for field in fields),
+                values=', '.join(['%s'] * len(fields)),
+                target=qn(target_opts.db_table),
+                target_pk=qn(target_opts.pk.column),
+                suffix=connection.ops.on_conflict_suffix_sql(
+                    fields, OnConflict.IGNORE, None, None
+                ),
+            )
+        with self._atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params + [pk])
+                added = cursor.rowcount
+            if added:
+                self._changed(user, [pk], True)
+        return added
+
+    def remove(self, user, pk):
+        """
+        Удаляет связь пользователя с объектом одним запросом DELETE
+
+        Возвращает 1, если связь удалена, и 0, если связи не было.
+        """
+        pk = self.clean_pk(pk)
+        with self._atomic():
+            deleted, _ = self.model.objects.filter(
+                user=user, **{f'{self.field}_id': pk}
+            ).delete()
+            if deleted:
+                self._changed(user, [pk], False)
+        return deleted
+
+    def clear(self, user):
+        """
+        Удаляет все связи пользователя
+
+        Если база поддерживает RETURNING, выполняется один запрос
+            DELETE FROM <связь> WHERE user_id = %s RETURNING <объект>
+        иначе id объектов выбираются заранее и связи удаляются по одной
+        (_write). В сигнал relations_changed передаются id связей,
+        удаленных этим запросом.
+
+        Возвращает количество удаленных связей.
+        """
+        connection = connections[router.db_for_write(self.model)]
+        with self._atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                opts = self.model._meta
+                qn = connection.ops.quote_name
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'DELETE FROM {table} WHERE {user} = %s '
+                        'RETURNING {column}'.format(
+                            table=qn(opts.db_table),
+                            user=qn(opts.get_field('user').column),
+                            column=qn(opts.get_field(self.field).column),
+                        ),
+                        [user.pk]
+                    )
+                    deleted = {pk for pk, in cursor.fetchall()}
+            else:
+                deleted = self._write(
+                    user,
+                    list(self.model.objects.filter(user=user).values_list(
+                        self.field, flat=True
+                    )),
+                    delete=True
+                )
+            if deleted:
+                self._changed(user, sorted(deleted), False)
+        return len(deleted)
+
+    def _write(self, user, ids, delete=False):
+        """
+        Создает (или удаляет) связи пользователя с объектами из списка id
+
+        Возвращает множество id объектов, связи с которыми созданы (удалены)
+        этим запросом, а не параллельным: по ним отправляется сигнал
+        relations_changed и меняются счетчики. Если база поддерживает
+        RETURNING (PostgreSQL, SQLite 3.35+), выполняется один запрос
+        INSERT ... ON CONFLICT DO NOTHING RETURNING (DELETE ... RETURNING)
+        на пакет строк, иначе - запрос на каждую строку в транзакции, id
+        определяются по cursor.rowcount.
+        """
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        column = qn(opts.get_field(self.field).column)
+        if delete:
+            # поле user - для размера пакета: его значение тоже параметр
+            fields = [opts.get_field(self.field), opts.get_field('user')]
+            rows = [[pk] for pk in ids]
+
+            def get_sql(count):
+                return 'DELETE FROM {table} WHERE {user} = %s AND ' \
+                    '{column} IN ({values})'.format(
+                        table=qn(opts.db_table),
+                        user=qn(opts.get_field('user').column),
+                        column=column,
+                        values=', '.join(['%s'] * count),
+                    )
+
+            def get_params(chunk):
+                return [user.pk] + [pk for pk, in chunk]
+        else:
+            fields = [
+                field for field in opts.local_concrete_fields
+                if not field.primary_key
+            ]
+            rows = []
+            for pk in ids:
+                obj = self.model(user=user, **{f'{self.field}_id': pk})
+                rows.append([
+                    field.get_db_prep_save(
+                        field.pre_save(obj, True), connection
+                    )
+                    for field in fields
+                ])
+
+            def get_sql(count):
+                return '{insert} {table} ({columns}) {values} {suffix}'.format(
+                    insert=connection.ops.insert_statement(
+                        on_conflict=OnConflict.IGNORE
+                    ),
+                    table=qn(opts.db_table),
+                    columns=', '.join(qn(field.column) for field in fields),
+                    values=connection.ops.bulk_insert_sql(
+                        fields, [['%s'] * len(fields)] * count
+                    ),
+                    suffix=connection.ops.on_conflict_suffix_sql(
+                        fields, OnConflict.IGNORE, None, None
+                    ),
+                )
+
+            def get_params(chunk):
+                return [value for row in chunk for value in row]
+
+        changed = set()
+        with connection.cursor() as cursor:
+            # RETURNING в INSERT и DELETE поддерживают одни и те же версии
+            if connection.features.can_return_rows_from_bulk_insert:
+                step = connection.ops.bulk_batch_size(fields, rows) or 1
+                for start in range(0, len(rows), step):
+                    chunk = rows[start:start + step]
+                    cursor.execute(
+                        f'{get_sql(len(chunk))} RETURNING {column}',
+                        get_params(chunk)
+                    )
+                    changed.update(pk for pk, in cursor.fetchall())
+            else:
+                with transaction.atomic(using=using, savepoint=False):
+                    for pk, row in zip(ids, rows):
+                        cursor.execute(get_sql(1), get_params([row]))
+                        if cursor.rowcount:
+                            changed.add(pk)
+        return changed
+
+    def bulk_add(self, user, ids, targets=None):
+        """
+        Добавляет связи пользователя с объектами из списка id
+
+        Параметры:
+            user - пользователь
+            ids - список id объектов
+            targets - queryset объектов, с которыми можно создать связь,
+            по умолчанию все объекты
+
+        Созданные связи определяются результатом самой записи (_write),
+        поэтому параллельный запрос с теми же id не приводит к ошибке и
+        не учитывает связь созданной второй раз.
+        """
+        if targets is None:
+            targets = self.target_model.objects.all()
+        ids = list(dict.fromkeys(ids))
+        found = set(targets.filter(pk__in=ids).values_list('pk', flat=True))
+        with self._atomic():
+            created = self._write(user, [pk for pk in ids if pk in found])
+            if created:
+                self._changed(user, sorted(created), True)
+        results = []
+        for pk in ids:
+            if pk not in found:
+                result = NOT_FOUND
+            elif pk in created:
+                result = CREATED
+            else:
+                result = EXISTS
+            results.append({'id': pk, 'status': result})
+        return len(created), results
+
+    def bulk_remove(self, user, ids, targets=None):
+        """
+        Удаляет связи пользователя с объектами из списка id
+
+        Параметры такие же, как у bulk_add.
+
+        Удаленные связи определяются результатом самого удаления (_write).
+        Объекты ищутся только для тех id, связей с которыми не было, чтобы
+        отличить absent от not_found.
+        """
+        if targets is None:
+            targets = self.target_model.objects.all()
+        ids = list(dict.fromkeys(ids))
+        with self._atomic():
+            deleted = self._write(user, ids, delete=True)
+            if deleted:
+                self._changed(user, sorted(deleted), False)
+        missing = set(ids) - deleted
+        found = set()
+        if missing:
+            found = set(
+                targets.filter(pk__in=missing).values_list('pk', flat=True)
+            )
+        results = []
+        for pk in ids:
+            if pk in deleted:
+                result = DELETED
+            elif pk in found:
+                result = ABSENT
+            else:
+                result = NOT_FOUND
+            results.append({'id': pk, 'status': result})
+        return len(deleted), results
+
+
+favorite_relation = Relation(Favorite, 'recipe')
+shopping_cart_relation = Relation(ShoppingList, 'recipe')
+subscribe_relation = Relation(Subscribe, 'author')
@@ -0,0 +1,204 @@
+"""
+Чтение из реплик базы данных
+
+Базы REPLICA_DATABASES (настройка DB_REPLICAS) - реплики основной базы
+default. ReplicaMiddleware выбирает для запроса с безопасным методом
+(GET, HEAD, OPTIONS) одну реплику, и ReplicaRouter направляет в нее
+чтения ORM этого запроса. Запись всегда идет в основную базу.
+
+Чтобы пользователь видел свои изменения несмотря на отставание реплик,
+после запроса с записью (небезопасный метод или запись в базу во время
+обработки) чтения пользователя REPLICA_PIN_SECONDS секунд идут в
+основную базу. Признак хранится в cookie REPLICA_PIN_COOKIE и, для
+запросов с заголовком Authorization (токен), в кеше Django. Кеш должен
+быть общим для процессов, иначе признак видит только один воркер.
+
+В основную базу также идут чтения вне запросов (команды, фоновые
+задачи), внутри транзакции и после записи в том же запросе.
+
+Классы:
+    ReplicaRouter - маршрутизатор баз данных (DATABASE_ROUTERS)
+    ReplicaMiddleware - выбор базы для чтений запроса
+
+Функции:
+    is_pinned - должны ли чтения запроса идти в основную базу
+"""
+
+import hashlib
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from recipes.tasks import in_background
+from .middleware import AsyncCapableMiddleware
+
+REPLICA_PIN_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReadState:
+    """
+    База для чтений текущего запроса
+
+    replica - псевдоним реплики или None (основная база), wrote - была
+    ли запись в базу во время запроса.
+    """
+
+    def __init__(self, replica):
+        self.replica = replica
+        self.wrote = False
+
+
+# ContextVar, а не threading.local: значение переходит из асинхронного
+# кода в синхронный (sync_to_async) при обработке через ASGI
+_state = ContextVar('replica_read_state', default=None)
+
+
+class ReplicaRouter:
+    """
+    Чтения запроса - в выбранную реплику, запись - в основную базу
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is None or state.replica is None or in_background()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # после записи запрос читает из основной базы
+            state.wrote = True
+            state.replica = None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схема реплик повторяет основную базу
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
+
+
+def get_pin_key(request):
+    """
+    Ключ кеша признака для запроса с токеном или None
+    """
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    digest = hashlib.sha256(authorization.encode()).hexdigest()
+    return f'replica_pin:{digest}'
+
+
+def has_pin_cookie(request):
+    try:
+        return float(request.COOKIES[REPLICA_PIN_COOKIE]) > time.time()
+    except (KeyError, ValueError):
+        return False
+
+
+def is_pinned(request):
+    """
+    Должны ли чтения запроса идти в основную базу
+    """
+    if has_pin_cookie(request):
+        return True
+    key = get_pin_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+async def ais_pinned(request):
+    """
+    is_pinned для асинхронного режима middleware
+    """
+    if has_pin_cookie(request):
+        return True
+    key = get_pin_key(request)
+    return key is not None and await cache.aget(key) is not None
+
+
+def set_pin_cookie(response):
+    seconds = settings.REPLICA_PIN_SECONDS
+    response.set_cookie(
+        REPLICA_PIN_COOKIE, f'{time.time() + seconds:.3f}',
+        max_age=seconds, httponly=True, samesite='Lax'
+    )
+
+
+def pin(request, response):
+    """
+    Направляет чтения пользователя в основную базу на
+    REPLICA_PIN_SECONDS секунд
+    """
+    set_pin_cookie(response)
+    key = get_pin_key(request)
+    if key is not None:
+        cache.set(key, 1, settings.REPLICA_PIN_SECONDS)
+
+
+async def apin(request, response):
+    """
+    pin для асинхронного режима middleware
+    """
+    set_pin_cookie(response)
+    key = get_pin_key(request)
+    if key is not None:
+        await cache.aset(key, 1, settings.REPLICA_PIN_SECONDS)
+
+
+class ReplicaMiddleware(AsyncCapableMiddleware):
+    """
+    Выбирает базу для чтений запроса и запоминает запись пользователя
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        replicas = settings.REPLICA_DATABASES
+        if not replicas:
+            return self.get_response(request)
+        safe = request.method in SAFE_METHODS
+        replica = None
+        if safe and not is_pinned(request):
+            replica = random.choice(replicas)
+        state = ReadState(replica)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if not safe or state.wrote:
+            pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        replicas = settings.REPLICA_DATABASES
+        if not replicas:
+            return await self.get_response(request)
+        safe = request.method in SAFE_METHODS
+        replica = None
+        if safe and not await ais_pinned(request):
+            replica = random.choice(replicas)
+        state = ReadState(replica)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        if not safe or state.wrote:
+            await apin(request, response)
+        return response
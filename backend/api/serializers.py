@@ -0,0 +1,23 @@
+"""
+Общие сериализаторы API
+
+Сериализаторы:
+    IdListSerializer - список id объектов для пакетных операций
+"""
+
+from django.conf import settings
+from rest_framework import serializers
+
+
+class IdListSerializer(serializers.Serializer):
+    """
+    Сериализатор для списка id объектов
+
+    Поля:
+        ids - список id объектов, не пустой и не длиннее BULK_MAX_IDS
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS,
+    )
@@ -0,0 +1,17 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    // при выборе объекта в AutocompleteFilter открыть список с фильтром
+    $(function() {
+        $('.autocomplete-filter').each(function(i, element) {
+            $(element).find('select').on('change', function() {
+                const params = new URLSearchParams(element.dataset.queryString);
+                if (this.value) {
+                    params.set(element.dataset.parameterName, this.value);
+                }
+                window.location.search = params.toString();
+            });
+        });
+    });
+}
@@ -0,0 +1,296 @@
+"""
+Тесты приложения api
+
+Команды замеров создают данные командой generate_fake_data и выполняют
+сценарии api.benchmark; из тестов они используют тестовую базу
+manage.py test. TransactionTestCase нужен, чтобы фоновые задачи
+(recipes.tasks) выполнялись после фиксации транзакций, как в командах.
+
+Классы:
+    BenchmarkApiCommandTest - сценарии всех маршрутов benchmark_api
+    CheckQueryPlansCommandTest - планы горячих запросов check_query_plans
+    CheckQueryBudgetsCommandTest - количество запросов маршрутов в пределах
+    бюджетов представлений check_query_budgets
+    RelationsTest - пакетные операции со связями и очистка списка покупок
+    ReplicaRoutingTest - чтения из реплики и основной базы после записи
+"""
+
+import io
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .replicas import REPLICA_PIN_COOKIE
+
+from recipes.models import Favorite, Recipe, ShoppingList, Tag
+from recipes.pantry import pantry_index
+from users.models import Subscribe
+
+User = get_user_model()
+
+
+class BenchmarkApiCommandTest(TransactionTestCase):
+    """
+    Сценарии benchmark_api выполняются без ошибок
+
+    Задержки зависят от машины, поэтому результаты не сравниваются с
+    benchmarks/api_baseline.json, а сохраняются во временный файл.
+    """
+
+    def test_benchmark_api(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = Path(directory) / 'baseline.json'
+            call_command(
+                'benchmark_api', users=50, recipes=300, repeat=2, warmup=1,
+                baseline=str(baseline), save=True, stdout=io.StringIO()
+            )
+            with open(baseline, encoding='utf-8') as file:
+                routes = json.load(file)['routes']
+        for name in ('recipe list', 'recipe create', 'subscriptions'):
+            self.assertIn(name, routes)
+
+
+class CheckQueryPlansCommandTest(TransactionTestCase):
+    """
+    Горячие запросы не читают таблицы WATCHED целиком
+
+    Данных меньше, чем по умолчанию у команды, но достаточно, чтобы
+    планировщик выбирал индексы по статистике ANALYZE.
+    """
+
+    def test_check_query_plans(self):
+        stdout = io.StringIO()
+        call_command(
+            'check_query_plans', users=200, recipes=2000, size=6,
+            stdout=stdout
+        )
+        self.assertIn('No full scans of watched tables', stdout.getvalue())
+
+
+class CheckQueryBudgetsCommandTest(TransactionTestCase):
+    """
+    Количество SQL запросов маршрутов не превышает бюджетов представлений
+    (query_budgets) и не растет с размером данных
+
+    Данные - по умолчанию команды: на меньших данных страницы списка с
+    несколькими фильтрами бывают пустыми, и запросов связанных объектов на
+    них нет.
+    """
+
+    def setUp(self):
+        # индекс процесса мог остаться от данных предыдущих тестов
+        pantry_index.reset()
+
+    def test_check_query_budgets(self):
+        stdout = io.StringIO()
+        call_command('check_query_budgets', stdout=stdout)
+        self.assertIn('All routes within budgets', stdout.getvalue())
+
+
+class RelationsTest(TestCase):
+    """
+    Пакетные операции возвращают результат для каждого id в порядке
+    запроса и меняют счетчики только для измененных связей; очистка
+    списка покупок удаляет все связи пользователя
+    """
+    missing = 10 ** 9
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author, cls.other = User.objects.bulk_create(
+            User(username=name, email=f'{name}@example.com',
+                 first_name=name, last_name=name)
+            for name in ('user', 'author', 'other')
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipe_images/recipe.png'
+            )
+            for number in range(3)
+        ]
+        cls.ids = [recipe.pk for recipe in cls.recipes]
+
+    def setUp(self):
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def bulk(self, method, url, ids):
+        response = getattr(self.client, method)(
+            url, {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (result['id'], result['status'])
+            for result in response.data['results']
+        ]
+
+    def assertCounts(self, field, counts):
+        self.assertEqual(
+            list(Recipe.objects.filter(pk__in=self.ids).order_by(
+                'pk'
+            ).values_list(field, flat=True)),
+            counts
+        )
+
+    def test_favorite_bulk(self):
+        url = '/api/recipes/favorite/'
+        first, second, third = self.ids
+        self.assertEqual(self.bulk('post', url, [first]), [
+            (first, 'created'),
+        ])
+        self.assertEqual(
+            self.bulk('post', url, [second, first, self.missing, second]),
+            [(second, 'created'), (first, 'exists'),
+             (self.missing, 'not_found')]
+        )
+        self.assertCounts('favorites_count', [1, 1, 0])
+        self.assertEqual(
+            self.bulk('delete', url, [third, first, self.missing]),
+            [(third, 'absent'), (first, 'deleted'),
+             (self.missing, 'not_found')]
+        )
+        self.assertCounts('favorites_count', [0, 1, 0])
+        self.assertEqual(
+            list(Favorite.objects.filter(user=self.user).values_list(
+                'recipe_id', flat=True
+            )),
+            [second]
+        )
+
+    def test_subscribe_bulk(self):
+        url = '/api/users/subscribe/'
+        ids = [self.author.pk, self.user.pk, self.other.pk]
+        self.assertEqual(self.bulk('post', url, ids), [
+            (self.author.pk, 'created'), (self.user.pk, 'not_found'),
+            (self.other.pk, 'created'),
+        ])
+        self.assertEqual(self.bulk('delete', url, ids), [
+            (self.author.pk, 'deleted'), (self.user.pk, 'not_found'),
+            (self.other.pk, 'deleted'),
+        ])
+        self.assertFalse(Subscribe.objects.filter(user=self.user).exists())
+        self.assertEqual(
+            list(User.objects.filter(pk__in=ids).values_list(
+                'followers_count', flat=True
+            )),
+            [0, 0, 0]
+        )
+
+    def test_shopping_cart_clear(self):
+        url = '/api/recipes/shopping_cart/'
+        # без RETURNING связи удаляются по одной
+        for returning in (True, False):
+            with self.subTest(returning=returning):
+                self.bulk('post', url, self.ids[:2])
+                self.assertCounts('shopping_cart_count', [1, 1, 0])
+                version = User.objects.get(
+                    pk=self.user.pk
+                ).shopping_cart_version
+                with mock.patch.object(
+                    type(connection.features),
+                    'can_return_rows_from_bulk_insert', returning
+                ):
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.client.delete(url)
+                self.assertEqual(response.status_code, 200)
+                deletes = [
+                    query['sql'] for query in queries
+                    if query['sql'].startswith('DELETE')
+                    and ShoppingList._meta.db_table in query['sql']
+                ]
+                self.assertEqual(len(deletes), 1 if returning else 2)
+                self.assertEqual(response.data, {'deleted': 2})
+                self.assertFalse(
+                    ShoppingList.objects.filter(user=self.user).exists()
+                )
+                self.assertCounts('shopping_cart_count', [0, 0, 0])
+                self.assertGreater(
+                    User.objects.get(pk=self.user.pk).shopping_cart_version,
+                    version
+                )
+        self.assertEqual(self.client.delete(url).data, {'deleted': 0})
+
+
+@override_settings(REPLICA_DATABASES=['replica1'])
+class ReplicaRoutingTest(TransactionTestCase):
+    """
+    Маршрутизация чтений на двух файлах SQLite
+
+    Реплика - копия тестовой базы (VACUUM INTO), сделанная до создания
+    тега «Обед», поэтому по списку тегов видно, из какой базы он прочитан.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user, self.author = User.objects.bulk_create(
+            User(username=name, email=f'{name}@example.com',
+                 first_name=name, last_name=name)
+            for name in ('user', 'author')
+        )
+        self.token = Token.objects.create(user=self.user)
+        Tag.objects.create(name='Завтрак', color='#000000', slug='breakfast')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'replica.sqlite3')
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM INTO %s', [path])
+        connections.settings['replica1'] = {
+            **connection.settings_dict, 'NAME': path
+        }
+        self.addCleanup(self.remove_replica)
+        Tag.objects.create(name='Обед', color='#ffffff', slug='lunch')
+
+    def remove_replica(self):
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.settings['replica1']
+
+    def client_for(self, token=None):
+        client = APIClient()
+        if token is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def tag_names(self, client):
+        response = client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        return [tag['name'] for tag in response.data]
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.tag_names(self.client_for()), ['Завтрак'])
+        self.assertEqual(
+            self.tag_names(self.client_for(self.token)), ['Завтрак']
+        )
+
+    def test_write_pins_reads_to_primary(self):
+        client = self.client_for(self.token)
+        response = client.post(
+            '/api/users/subscribe/', {'ids': [self.author.pk]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        # запись - в основную базу
+        self.assertTrue(
+            Subscribe.objects.filter(author=self.author).exists()
+        )
+        self.assertIn(REPLICA_PIN_COOKIE, response.cookies)
+        # по cookie и по токену (другой клиент того же пользователя)
+        self.assertEqual(self.tag_names(client), ['Завтрак', 'Обед'])
+        self.assertEqual(
+            self.tag_names(self.client_for(self.token)),
+            ['Завтрак', 'Обед']
+        )
+        self.assertEqual(self.tag_names(self.client_for()), ['Завтрак'])
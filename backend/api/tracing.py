@@ -0,0 +1,260 @@
+"""
+Трассировка этапов обработки запросов к API
+
+Доля TRACING_SAMPLE_RATE запросов (от 0 до 1) трассируется: время
+этапов обработки записывается как интервалы (span) и после ответа
+добавляется в файл TRACING_FILE в формате Chrome Trace Event (JSON
+массив событий "X"). Файл открывается в chrome://tracing, Perfetto и
+speedscope, сводка по этапам выводится командой trace_summary. Файлы
+больше TRACING_MAX_MB мегабайт переименовываются в <файл>.1.
+
+Этапы:
+    request - весь запрос (TracingMiddleware)
+    authentication, permissions, object permissions, filter_queryset,
+    pagination, render - методы представлений DRF (TracingViewMixin)
+    <Сериализатор>.data - получение data сериализатора проекта
+    (api.metrics.TimedSerializerMixin)
+    sql - запросы к базе
+
+У каждого события в args записан endpoint - имя маршрута и действие,
+например api:recipes-list.list.
+
+Классы:
+    TracingViewMixin - интервалы этапов представлений DRF
+    TracingMiddleware - выбор трассируемых запросов и запись событий
+
+Функции:
+    span - контекстный менеджер интервала
+    is_active - трассируется ли текущий запрос
+    read_events - события из файла трассировки
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from recipes.tasks import in_background
+from .middleware import AsyncCapableMiddleware, get_view
+
+# интервалы трассируемого запроса; ContextVar, а не threading.local:
+# под ASGI запрос выполняется и в цикле событий, и в потоке sync_to_async
+_spans = ContextVar('trace_spans', default=None)
+# наибольшая длина текста SQL запроса в событии
+SQL_LENGTH = 300
+
+
+def is_active():
+    """
+    Трассируется ли запрос текущего потока
+    """
+    return _spans.get() is not None
+
+
+@contextmanager
+def span(name, category='drf', **args):
+    """
+    Интервал name трассируемого запроса, args - данные события
+    """
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+    start = time.time_ns()
+    started = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        spans.append((
+            name, category, start, time.perf_counter_ns() - started, args
+        ))
+
+
+def trace_query(execute, sql, params, many, context):
+    """
+    Обертка connection.execute_wrapper: интервал sql на каждый запрос
+    """
+    if in_background():
+        return execute(sql, params, many, context)
+    with span('sql', 'db', sql=sql[:SQL_LENGTH]):
+        return execute(sql, params, many, context)
+
+
+class TracingViewMixin:
+    """
+    Интервалы этапов обработки запроса в представлениях DRF
+
+    Подмешивается первым базовым классом представления.
+    """
+
+    def perform_authentication(self, request):
+        with span('authentication'):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with span('permissions'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with span('object permissions'):
+            super().check_object_permissions(request, obj)
+
+    def filter_queryset(self, queryset):
+        with span('filter_queryset'):
+            return super().filter_queryset(queryset)
+
+    def paginate_queryset(self, queryset):
+        with span('pagination'):
+            return super().paginate_queryset(queryset)
+
+    def perform_content_negotiation(self, request, force=False):
+        renderer, media_type = super().perform_content_negotiation(
+            request, force
+        )
+        if is_active():
+            # рендерер создается для каждого запроса, поэтому обертка
+            # на экземпляре не влияет на другие запросы
+            render = renderer.render
+
+            def traced_render(*args, **kwargs):
+                with span('render', renderer=type(renderer).__name__):
+                    return render(*args, **kwargs)
+
+            renderer.render = traced_render
+        return renderer, media_type
+
+
+def write_events(events):
+    """
+    Добавляет события в файл трассировки
+
+    Файл - JSON массив без закрывающей скобки (формат Trace Event это
+    допускает), поэтому события дописываются одной записью O_APPEND из
+    нескольких процессов.
+    """
+    path = settings.TRACING_FILE
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        if os.path.getsize(path) > settings.TRACING_MAX_MB * 1024 * 1024:
+            os.replace(path, f'{path}.1')
+    except FileNotFoundError:
+        pass
+    try:
+        fd = os.open(
+            path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL,
+            0o644
+        )
+        os.write(fd, b'[\n')
+    except FileExistsError:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+    try:
+        os.write(fd, ''.join(
+            json.dumps(event, ensure_ascii=False) + ',\n' for event in events
+        ).encode())
+    finally:
+        os.close(fd)
+
+
+def read_events(path):
+    """
+    События из файла трассировки (в том числе без закрывающей скобки)
+    """
+    with open(path, encoding='utf-8') as file:
+        text = file.read().strip()
+    if not text:
+        return []
+    if not text.endswith(']'):
+        text = text.rstrip(',') + ']'
+    return json.loads(text)
+
+
+def attach_query_tracing():
+    """
+    Подключает trace_query ко всем соединениям текущего потока
+
+    Возвращает список подключенных оберток для detach_query_tracing.
+    """
+    wrapped = []
+    for connection in connections.all():
+        wrapper = connection.execute_wrapper(trace_query)
+        wrapper.__enter__()
+        wrapped.append(wrapper)
+    return wrapped
+
+
+def detach_query_tracing(wrapped):
+    while wrapped:
+        wrapped.pop().__exit__(None, None, None)
+
+
+class TracingMiddleware(AsyncCapableMiddleware):
+    """
+    Трассирует долю TRACING_SAMPLE_RATE запросов
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= settings.TRACING_SAMPLE_RATE:
+            return self.get_response(request)
+        spans = []
+        token = _spans.set(spans)
+        try:
+            with span('request', method=request.method, path=request.path):
+                wrapped = attach_query_tracing()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    detach_query_tracing(wrapped)
+        finally:
+            _spans.reset(token)
+        return self.write(request, response, spans)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.TRACING_SAMPLE_RATE:
+            return await self.get_response(request)
+        spans = []
+        token = _spans.set(spans)
+        try:
+            with span('request', method=request.method, path=request.path):
+                # запросы ORM выполняются в потоке запроса (как в
+                # api.middleware.SQLStatsMiddleware)
+                wrapped = await sync_to_async(attach_query_tracing)()
+                try:
+                    response = await self.get_response(request)
+                finally:
+                    await sync_to_async(detach_query_tracing)(wrapped)
+        finally:
+            _spans.reset(token)
+        return self.write(request, response, spans)
+
+    def write(self, request, response, spans):
+        """
+        Записывает интервалы запроса в файл трассировки
+        """
+        # интервал request добавляется последним
+        spans[-1][4]['status'] = response.status_code
+        view, action = get_view(request)
+        endpoint = f'{view}.{action}' if view else ''
+        pid, tid = os.getpid(), threading.get_ident()
+        write_events([
+            {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start / 1000,
+                'dur': duration / 1000,
+                'pid': pid,
+                'tid': tid,
+                'args': {**args, 'endpoint': endpoint},
+            }
+            for name, category, start, duration, args in spans
+        ])
+        return response
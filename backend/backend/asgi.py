@@ -3,14 +3,36 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Под ASGI запросы обслуживаются маршрутами backend.asgi_urls: горячие
+маршруты чтения API - асинхронными представлениями api.async_views,
+остальные - теми же представлениями, что под WSGI (backend.wsgi).
+
+Запуск:
+    uvicorn backend.asgi:application --workers 4
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+
+class AsyncRoutesASGIHandler(ASGIHandler):
+    """
+    ASGIHandler с маршрутами backend.asgi_urls
+    """
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = 'backend.asgi_urls'
+        return request, error_response
+
+
+django.setup(set_prefix=False)
+application = AsyncRoutesASGIHandler()
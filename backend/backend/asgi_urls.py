@@ -0,0 +1,17 @@
+"""
+Корневые маршруты для ASGI (backend.asgi)
+
+Те же маршруты, что backend.urls, но api/ обслуживается api.async_urls.
+"""
+
+from django.urls import include, path
+
+from backend.urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('api/', include('api.async_urls')),
+    *(
+        pattern for pattern in wsgi_urlpatterns
+        if str(pattern.pattern) != 'api/'
+    ),
+]
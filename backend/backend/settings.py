@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +52,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.middleware.SQLStatsMiddleware',
+    'api.tracing.TracingMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -107,6 +113,28 @@ else:
         }
     }
 
+# Реплики основной базы для чтения (api.replicas): DB_REPLICAS - список
+# через запятую адресов host[:port] реплик, для SQLite - путей к файлам.
+# Реплики получают псевдонимы replica1, replica2, ..., в тестах вместо
+# них используется тестовая основная база. После записи чтения
+# пользователя REPLICA_PIN_SECONDS секунд идут в основную базу
+REPLICA_DATABASES = []
+for number, address in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), 1
+):
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        replica = {'NAME': address}
+    else:
+        host, _, port = address.partition(':')
+        replica = {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'], **replica, 'TEST': {'MIRROR': 'default'}
+    }
+    REPLICA_DATABASES.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -160,6 +188,123 @@ EMPTY_VALUE_DISPLAY = '-пусто-'
 
 PAGE_SIZE = 5
 
+# Время хранения в кеше текста списка покупок (ключ включает версию корзины)
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Максимальное количество id в одном пакетном запросе
+BULK_MAX_IDS = 100
+
+# Фоновые задачи: выполнять в пуле потоков (True) или сразу после фиксации
+# транзакции в потоке запроса (False). SQLite допускает только одну
+# пишущую транзакцию, и запись из фонового потока прерывает запись в потоке
+# запроса ошибкой "database is locked", поэтому с SQLite задачи выполняются
+# в потоке запроса
+BACKGROUND_TASKS_ASYNC = (
+    DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3'
+)
+BACKGROUND_TASKS_WORKERS = 2
+
+# Лента подписок: авторы с большим количеством подписчиков не раскладываются
+# в ленты, их рецепты добавляются при чтении ленты
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+# Количество последних рецептов автора, добавляемых в ленту при подписке
+FEED_BACKFILL_SIZE = 50
+
+# Популярность рецептов: период полураспада вклада добавления в избранное и
+# в список покупок (в днях) для ordering=popular и ordering=trending
+POPULARITY_HALF_LIFE_DAYS = 30
+POPULARITY_TRENDING_HALF_LIFE_DAYS = 2
+# ordering=trending показывает рецепты, добавленные за последние дни
+POPULARITY_TRENDING_DAYS = 7
+POPULARITY_FAVORITE_WEIGHT = 1.0
+POPULARITY_SHOPPING_CART_WEIGHT = 0.5
+# Через сколько дней значения популярности пересчитываются к новой точке
+# отсчета, чтобы не росли неограниченно
+POPULARITY_REBASE_DAYS = 30
+# Минимальный интервал между фоновыми обновлениями популярности (секунды)
+POPULARITY_REFRESH_INTERVAL = 60 * 5
+# Сколько секунд обновления популярности проверяют пропущенные id
+# добавлений: добавление из транзакции, зафиксированной позже, не учитывается
+POPULARITY_GAP_TIMEOUT = 60 * 60
+
+# Похожие рецепты: количество похожих у каждого рецепта, количество строк
+# матрицы сходства, вычисляемых за один шаг, и количество рецептов очереди
+# пересчета, обрабатываемых в одной транзакции
+SIMILAR_RECIPES_COUNT = 10
+SIMILAR_RECIPES_BATCH_SIZE = 1000
+SIMILAR_RECIPES_QUEUE_BATCH_SIZE = 200
+
+# Поиск по имеющимся ингредиентам: через сколько секунд индекс в памяти
+# процесса перестраивается полностью (учитывает изменения других процессов)
+PANTRY_INDEX_TTL = 60 * 5
+
+# Поиск почти одинаковых рецептов: размер сигнатуры MinHash и количество
+# полос LSH (рецепты с оценкой сходства около 0.6 становятся кандидатами
+# с вероятностью около 99%)
+DUPLICATE_MINHASH_SIZE = 128
+DUPLICATE_BANDS = 32
+# Минимальная оценка сходства, количество выводимых дубликатов и
+# максимальное количество проверяемых кандидатов
+DUPLICATE_THRESHOLD = 0.6
+DUPLICATE_COUNT = 5
+DUPLICATE_MAX_CANDIDATES = 100
+
+# Статистика SQL запросов (api.middleware.SQLStatsMiddleware): запросы
+# дольше SQL_SLOW_QUERY_MS миллисекунд записываются в лог, запрос,
+# повторенный SQL_N_PLUS_ONE_THRESHOLD раз за HTTP запрос, считается N+1
+SQL_SLOW_QUERY_MS = int(os.getenv('SQL_SLOW_QUERY_MS', 100))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', 5))
+
+# Профилирование запросов сотрудников (api.profiling): профили хранятся
+# в PROFILING_DIR, сохраняются PROFILING_MAX_PROFILES последних профилей
+PROFILING_DIR = os.getenv(
+    'PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'backend_profiles')
+)
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', 100))
+PROFILING_SAMPLE_INTERVAL_MS = float(
+    os.getenv('PROFILING_SAMPLE_INTERVAL_MS', 1)
+)
+
+# Метрики Prometheus (api.metrics): файлы значений воркеров хранятся в
+# METRICS_DIR, страница /metrics доступна с адресов METRICS_ALLOWED_IPS
+# (по умолчанию только с локального: в docker-compose контейнеры и хост
+# находятся в частных сетях, а порт backend опубликован, поэтому сеть
+# Prometheus нужно указать явно)
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'backend_metrics')
+)
+METRICS_ALLOWED_IPS = os.getenv(
+    'METRICS_ALLOWED_IPS', '127.0.0.0/8,::1/128'
+).split(',')
+
+# Трассировка этапов запросов (api.tracing): доля трассируемых
+# запросов от 0 до 1, файл событий и его наибольший размер
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', 0))
+TRACING_FILE = os.getenv(
+    'TRACING_FILE', os.path.join(tempfile.gettempdir(), 'backend_trace.json')
+)
+TRACING_MAX_MB = int(os.getenv('TRACING_MAX_MB', 100))
+
+# Лог статистики SQL запросов (api.middleware): на уровне WARNING
+# выводятся медленные запросы и N+1, на уровне DEBUG - строка статистики
+# каждого запроса
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.sql': {
+            'handlers': ['console'],
+            'level': os.getenv('SQL_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 # Параметры REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
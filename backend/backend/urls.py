@@ -3,8 +3,12 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from api.metrics import metrics_view
+
 urlpatterns = [
+    path('metrics', metrics_view),
     path('api/', include('api.urls')),
+    path('admin/profiles/', include('api.admin_profiles')),
     path('admin/', admin.site.urls),
 ]
 
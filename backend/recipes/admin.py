@@ -1,5 +1,11 @@
 from django.contrib import admin
 from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils.text import Truncator, smart_split, unescape_string_literal
+from api.admin import RelationAdmin
+from api.admin_filters import (
+    AdminFiltersMixin, autocomplete_filter, input_filter
+)
 from .models import (
     Recipe,
     Ingredient,
@@ -8,6 +14,8 @@ from .models import (
     Favorite,
     ShoppingList,
 )
+from .duplicates import find_duplicates, update_signature
+from .services import bump_shopping_cart_version, recount_recipe_counters
 
 
 class IngredientInline(admin.TabularInline):
@@ -17,14 +25,15 @@ class IngredientInline(admin.TabularInline):
     model = IngredientAmount
     min_num = 1
     extra = 0
+    autocomplete_fields = ('ingredient',)
 
 
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(AdminFiltersMixin, admin.ModelAdmin):
     list_display = (
         'id',
         'author',
         'name',
-        'text',
+        'text_preview',
         'image',
         'ingredients_custom',
         'tags_custom',
@@ -32,7 +41,14 @@ class RecipeAdmin(admin.ModelAdmin):
         'cooking_time',
         'pub_date',
     )
-    list_filter = ('author', 'name', 'tags', 'pub_date')
+    list_filter = (
+        autocomplete_filter('author', 'Автор'),
+        input_filter('name__istartswith', 'Название'),
+        'tags',
+    )
+    date_hierarchy = 'pub_date'
+    autocomplete_fields = ('author',)
+    show_full_result_count = False
     search_fields = (
         'name',
         'text',
@@ -42,6 +58,46 @@ class RecipeAdmin(admin.ModelAdmin):
     empty_value_display = settings.EMPTY_VALUE_DISPLAY
     ordering = ('-pub_date',)
     inlines = [IngredientInline]
+    readonly_fields = ('possible_duplicates',)
+    # длина текста рецепта в списке
+    text_preview_length = 100
+
+    def get_queryset(self, request):
+        """
+        Автор, ингредиенты и теги рецептов загружаются вместе со списком,
+        а не отдельными запросами для каждой строки
+        """
+        return super().get_queryset(request).select_related(
+            'author'
+        ).prefetch_related('ingredients', 'tags')
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск по названию, тексту, ингредиентам и тегам
+
+        Ингредиенты и теги проверяются подзапросами EXISTS, поэтому
+        рецепты в результате не повторяются и DISTINCT не нужен. Как и в
+        стандартном поиске, каждое слово запроса должно найтись хотя бы в
+        одном из полей.
+        """
+        for bit in smart_split(search_term):
+            if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+                bit = unescape_string_literal(bit)
+            queryset = queryset.filter(
+                Q(name__icontains=bit)
+                | Q(text__icontains=bit)
+                | Exists(IngredientAmount.objects.filter(
+                    recipe=OuterRef('pk'), ingredient__name__icontains=bit
+                ))
+                | Exists(Recipe.tags.through.objects.filter(
+                    recipe=OuterRef('pk'), tag__name__icontains=bit
+                ))
+            )
+        return queryset, False
+
+    def text_preview(self, obj):
+        return Truncator(obj.text).chars(self.text_preview_length)
+    text_preview.short_description = 'Текст'
 
     def ingredients_custom(self, obj):
         return ", ".join([str(p) for p in obj.ingredients.all()])
@@ -53,8 +109,21 @@ class RecipeAdmin(admin.ModelAdmin):
 
     # количество добавлений рецепта в избранное
     def favorites_count(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+        return obj.favorites_count
     favorites_count.short_description = 'Количество добавлений в избранное'
+    favorites_count.admin_order_field = 'favorites_count'
+
+    # почти одинаковые рецепты по сигнатуре MinHash
+    def possible_duplicates(self, obj):
+        return ', '.join(
+            f'{recipe.name} (id {recipe.id}, {recipe.similarity:.0%})'
+            for recipe in find_duplicates(obj)
+        )
+    possible_duplicates.short_description = 'Возможные дубликаты'
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_signature(form.instance)
 
 
 # Ингридиенты
@@ -64,7 +133,10 @@ class IngredientAdmin(admin.ModelAdmin):
         'name',
         'measurement_unit',
     )
-    list_filter = ('name', 'measurement_unit')
+    list_filter = (
+        input_filter('name__istartswith', 'Название'),
+        'measurement_unit',
+    )
     search_fields = ('name', 'measurement_unit')
     empty_value_display = settings.EMPTY_VALUE_DISPLAY
     ordering = ('-id',)
@@ -86,41 +158,65 @@ class TagAdmin(admin.ModelAdmin):
 
 
 # Ингридиенты в рецепте
-class IngredientAmountAdmin(admin.ModelAdmin):
+class IngredientAmountAdmin(AdminFiltersMixin, admin.ModelAdmin):
     list_display = (
         'id',
         'recipe',
         'ingredient',
         'amount',
     )
-    list_filter = ('recipe', 'ingredient', 'amount')
+    list_filter = (
+        autocomplete_filter('recipe', 'Рецепт'),
+        autocomplete_filter('ingredient', 'Ингредиент'),
+    )
     search_fields = ('recipe__name', 'ingredient__name', 'amount')
+    list_select_related = ('recipe', 'ingredient')
+    autocomplete_fields = ('recipe', 'ingredient')
+    show_full_result_count = False
     empty_value_display = settings.EMPTY_VALUE_DISPLAY
     ordering = ('recipe', '-id')
 
 
 # Избранное
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(AdminFiltersMixin, RelationAdmin):
     list_display = (
         'id',
         'user',
         'recipe',
     )
-    list_filter = ('user', 'recipe')
+    list_filter = (
+        autocomplete_filter('user', 'Пользователь'),
+        autocomplete_filter('recipe', 'Рецепт'),
+    )
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+    date_hierarchy = 'created'
+    show_full_result_count = False
     search_fields = ('user__username', 'recipe__name')
     empty_value_display = settings.EMPTY_VALUE_DISPLAY
     ordering = ('-id',)
     list_display_links = ('id', 'user', 'recipe')
+    relation_field = 'recipe'
+
+    def relations_changed(self, user_ids, target_ids):
+        recount_recipe_counters(pk__in=target_ids)
 
 
 # Списко покупок
-class ShoppingListAdmin(admin.ModelAdmin):
+class ShoppingListAdmin(AdminFiltersMixin, RelationAdmin):
     list_display = (
         'id',
         'user',
         'recipe',
     )
-    list_filter = ('user', 'recipe')
+    list_filter = (
+        autocomplete_filter('user', 'Пользователь'),
+        autocomplete_filter('recipe', 'Рецепт'),
+    )
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+    date_hierarchy = 'created'
+    show_full_result_count = False
     search_fields = (
         'user__username',
         'recipe__name',
@@ -128,6 +224,12 @@ class ShoppingListAdmin(admin.ModelAdmin):
     empty_value_display = settings.EMPTY_VALUE_DISPLAY
     ordering = ('-id',)
     list_display_links = ('id', 'user', 'recipe')
+    relation_field = 'recipe'
+
+    # изменение корзины через админку должно сбрасывать кеш списка покупок
+    def relations_changed(self, user_ids, target_ids):
+        bump_shopping_cart_version(pk__in=user_ids)
+        recount_recipe_counters(pk__in=target_ids)
 
 
 admin.site.register(Recipe, RecipeAdmin)
@@ -0,0 +1,104 @@
+"""
+Пакетная запись строк в таблицы в обход создания объектов моделей
+
+Используется командами загрузки данных, где накладные расходы
+bulk_create на создание объекта и подготовку каждого значения больше
+времени самой записи.
+
+Функции:
+    insert_rows - запись запросами INSERT на много строк
+    copy_rows - запись командой COPY (только PostgreSQL)
+    write_rows - COPY, если она доступна и запрошена, иначе INSERT
+"""
+
+import csv
+import io
+
+from django.db import connections
+from django.db.models.constants import OnConflict
+
+
+def _fields(model, columns):
+    return [model._meta.get_field(name) for name in columns]
+
+
+def insert_rows(model, columns, rows, using, ignore_conflicts=False):
+    """
+    Записывает строки rows в таблицу модели
+
+    Параметры:
+        model - модель
+        columns - имена полей модели (attname, например recipe_id)
+        rows - список кортежей значений, уже приведенных к виду базы
+        (даты - connection.ops.adapt_datetimefield_value)
+        using - псевдоним базы
+        ignore_conflicts - пропускать строки, нарушающие ограничения
+        уникальности (ON CONFLICT DO NOTHING)
+
+    Строки записываются запросами на столько строк, сколько допускает
+    ограничение базы на количество параметров запроса.
+    """
+    if not rows:
+        return
+    connection = connections[using]
+    fields = _fields(model, columns)
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+    qn = connection.ops.quote_name
+    step = connection.ops.bulk_batch_size(fields, rows) or len(rows)
+    placeholders = ['%s'] * len(fields)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), step):
+            chunk = rows[start:start + step]
+            cursor.execute(
+                '{insert} {table} ({columns}) {values} {suffix}'.format(
+                    insert=connection.ops.insert_statement(
+                        on_conflict=on_conflict
+                    ),
+                    table=qn(model._meta.db_table),
+                    columns=', '.join(qn(field.column) for field in fields),
+                    values=connection.ops.bulk_insert_sql(
+                        fields, [placeholders] * len(chunk)
+                    ),
+                    suffix=connection.ops.on_conflict_suffix_sql(
+                        fields, on_conflict, None, None
+                    ) or '',
+                ),
+                [value for row in chunk for value in row]
+            )
+
+
+def copy_rows(model, columns, rows, using):
+    """
+    Записывает строки командой COPY ... FROM STDIN (PostgreSQL)
+
+    COPY не поддерживает ON CONFLICT, строки не должны нарушать
+    ограничения уникальности.
+    """
+    if not rows:
+        return
+    connection = connections[using]
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)'.format(
+                table=qn(model._meta.db_table),
+                columns=', '.join(
+                    qn(field.column) for field in _fields(model, columns)
+                ),
+            ),
+            buffer
+        )
+
+
+def write_rows(model, columns, rows, using, copy=False):
+    """
+    Записывает строки командой COPY, если copy=True и база - PostgreSQL,
+    иначе запросами INSERT
+    """
+    if copy and connections[using].vendor == 'postgresql':
+        copy_rows(model, columns, rows, using)
+    else:
+        insert_rows(model, columns, rows, using)
@@ -0,0 +1,187 @@
+"""
+Поиск почти одинаковых рецептов
+
+Рецепт представлен множеством признаков: id ингредиентов и тройки подряд
+идущих слов текста (в нижнем регистре, без знаков препинания). Сигнатура
+MinHash - минимумы DUPLICATE_MINHASH_SIZE хеш-функций по признакам; доля
+совпадающих значений двух сигнатур оценивает коэффициент Жаккара множеств.
+
+Сигнатура делится на DUPLICATE_BANDS полос, хеш каждой полосы (вместе с
+номером полосы) хранится в таблице RecipeBucket. Рецепты с хотя бы одной
+общей корзиной - кандидаты; сходство кандидатов проверяется по сигнатурам.
+При записи рецепта в запросе выполняется один запрос: выбор не более
+DUPLICATE_MAX_CANDIDATES кандидатов вместе с их сигнатурами. Сигнатура и
+корзины рецепта заменяются фоновой задачей после фиксации транзакции.
+
+Функции:
+    get_minhash - сигнатура по id ингредиентов и тексту
+    update_signature - сохранить сигнатуру рецепта и найти дубликаты
+    find_duplicates - дубликаты рецепта по сохраненной сигнатуре
+    backfill_signatures - сохранить сигнатуры рецептов пакетами
+"""
+
+import hashlib
+import re
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import IngredientAmount, RecipeBucket, RecipeSignature
+from .tasks import run_in_background
+
+# хеш-функции (a * x + b) mod p, p - простое число Мерсенна 2^31 - 1
+PRIME = (1 << 31) - 1
+_random = np.random.default_rng(20230201)
+COEFFICIENTS = _random.integers(
+    1, PRIME, size=(2, settings.DUPLICATE_MINHASH_SIZE), dtype=np.uint64
+)
+SHINGLE_SIZE = 3
+
+
+def _hash(value, size=4):
+    return int.from_bytes(
+        hashlib.blake2b(value, digest_size=size).digest(), 'little'
+    )
+
+
+def _shingles(ingredient_ids, text):
+    words = re.findall(r'\w+', text.lower())
+    shingles = {f'i:{pk}' for pk in ingredient_ids}
+    shingles.update(
+        't:' + ' '.join(words[start:start + SHINGLE_SIZE])
+        for start in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    )
+    return shingles
+
+
+def get_minhash(ingredient_ids, text):
+    """
+    Возвращает сигнатуру MinHash - массив uint32
+    """
+    values = np.array(
+        [_hash(shingle.encode()) % PRIME for shingle in
+         _shingles(ingredient_ids, text)],
+        dtype=np.uint64
+    )
+    hashes = (
+        COEFFICIENTS[0][:, None] * values[None, :] + COEFFICIENTS[1][:, None]
+    ) % PRIME
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+def _buckets(minhash):
+    bands = np.array_split(minhash, settings.DUPLICATE_BANDS)
+    # хеш 63 бита, чтобы поместиться в BigIntegerField
+    return [
+        _hash(bytes([number]) + band.tobytes(), 8) >> 1
+        for number, band in enumerate(bands)
+    ]
+
+
+def _candidates(recipe_id, minhash):
+    """
+    Похожие рецепты из кандидатов с общими корзинами
+
+    Возвращает список рецептов (id и name) с атрибутом similarity,
+    от более похожих к менее похожим.
+    """
+    candidates = RecipeBucket.objects.filter(
+        bucket__in=_buckets(minhash)
+    ).exclude(recipe_id=recipe_id).values('recipe_id').distinct()[
+        :settings.DUPLICATE_MAX_CANDIDATES
+    ]
+    duplicates = []
+    for signature in RecipeSignature.objects.filter(
+        recipe__in=candidates
+    ).select_related('recipe').only('minhash', 'recipe__name'):
+        similarity = float(np.mean(
+            np.frombuffer(signature.minhash, dtype=np.uint32) == minhash
+        ))
+        if similarity >= settings.DUPLICATE_THRESHOLD:
+            signature.recipe.similarity = similarity
+            duplicates.append(signature.recipe)
+    duplicates.sort(key=lambda recipe: recipe.similarity, reverse=True)
+    return duplicates[:settings.DUPLICATE_COUNT]
+
+
+def _save(recipe_id, minhash):
+    with transaction.atomic():
+        RecipeSignature.objects.update_or_create(
+            recipe_id=recipe_id, defaults={'minhash': minhash.tobytes()}
+        )
+        RecipeBucket.objects.filter(recipe_id=recipe_id).delete()
+        RecipeBucket.objects.bulk_create(
+            RecipeBucket(recipe_id=recipe_id, bucket=bucket)
+            for bucket in _buckets(minhash)
+        )
+
+
+def update_signature(recipe, ingredient_ids=None):
+    """
+    Возвращает похожие рецепты и сохраняет сигнатуру рецепта в фоне
+
+    Параметры:
+        recipe - рецепт
+        ingredient_ids - id ингредиентов рецепта, по умолчанию
+        загружаются из базы
+    """
+    if ingredient_ids is None:
+        ingredient_ids = IngredientAmount.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient_id', flat=True)
+    minhash = get_minhash(ingredient_ids, recipe.text)
+    run_in_background(_save, recipe.pk, minhash)
+    return _candidates(recipe.pk, minhash)
+
+
+def find_duplicates(recipe):
+    """
+    Возвращает похожие рецепты по сохраненной сигнатуре рецепта
+    """
+    signature = RecipeSignature.objects.filter(recipe=recipe).first()
+    if signature is None:
+        return []
+    return _candidates(
+        recipe.pk, np.frombuffer(signature.minhash, dtype=np.uint32)
+    )
+
+
+def backfill_signatures(queryset, batch_size=1000):
+    """
+    Сохраняет сигнатуры рецептов queryset пакетами по batch_size
+
+    Возвращает количество обработанных рецептов.
+    """
+    processed = 0
+    last_id = 0
+    while True:
+        recipes = list(
+            queryset.filter(pk__gt=last_id).order_by('pk').only('text')[
+                :batch_size
+            ]
+        )
+        if not recipes:
+            return processed
+        ingredients = {}
+        for recipe_id, ingredient_id in IngredientAmount.objects.filter(
+            recipe__in=recipes
+        ).values_list('recipe_id', 'ingredient_id'):
+            ingredients.setdefault(recipe_id, []).append(ingredient_id)
+        signatures, buckets = [], []
+        for recipe in recipes:
+            minhash = get_minhash(ingredients.get(recipe.pk, []), recipe.text)
+            signatures.append(RecipeSignature(
+                recipe_id=recipe.pk, minhash=minhash.tobytes()
+            ))
+            buckets.extend(
+                RecipeBucket(recipe_id=recipe.pk, bucket=bucket)
+                for bucket in _buckets(minhash)
+            )
+        with transaction.atomic():
+            RecipeSignature.objects.filter(recipe__in=recipes).delete()
+            RecipeBucket.objects.filter(recipe__in=recipes).delete()
+            RecipeSignature.objects.bulk_create(signatures)
+            RecipeBucket.objects.bulk_create(buckets)
+        processed += len(recipes)
+        last_id = recipes[-1].pk
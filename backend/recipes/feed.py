@@ -0,0 +1,266 @@
+"""
+Лента рецептов авторов, на которых подписан пользователь
+
+Лента хранится в таблице FeedEntry. При публикации рецепта он раскладывается
+в ленты всех подписчиков автора (fan-out on write), при подписке в ленту
+добавляются последние FEED_BACKFILL_SIZE рецептов автора, при отписке
+рецепты автора удаляются из ленты.
+
+Рецепты записываются в ленты одним запросом INSERT ... SELECT, подписчики
+выбираются из Subscribe в момент записи. Поэтому фоновая задача, ожидавшая
+выполнения, не добавит в ленту рецепты автора, от которого пользователь
+уже отписался. Если база поддерживает блокировку строк, строки подписок
+блокируются FOR SHARE: отписка ждет окончания записи и удаляет уже
+добавленные рецепты.
+
+Авторы, у которых больше FEED_FANOUT_MAX_FOLLOWERS подписчиков, в ленты не
+раскладываются: их рецепты выбираются при чтении и объединяются с лентой
+(fan-out on read). Когда подписчиков автора снова становится
+FEED_FANOUT_MAX_FOLLOWERS, его последние рецепты добавляются в ленты всех
+подписчиков.
+
+Страницы ленты выбираются по ключу (pub_date, id рецепта) - курсору
+последнего рецепта предыдущей страницы, без OFFSET.
+
+Функции:
+    fan_out_recipe - разложить рецепт в ленты подписчиков автора
+    backfill_feed - добавить в ленту пользователя последние рецепты авторов
+    backfill_followers - добавить последние рецепты авторов в ленты всех их
+    подписчиков
+    remove_from_feed - удалить из ленты пользователя рецепты авторов
+    rebuild_feed - пересобрать ленту пользователя по подпискам
+    get_feed_page - id рецептов страницы ленты и курсор следующей страницы
+    encode_cursor, decode_cursor - преобразование курсора в строку и обратно
+"""
+
+import base64
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.constants import OnConflict
+from django.utils.dateparse import parse_datetime
+
+from users.models import Subscribe
+from .models import FeedEntry, Recipe
+from .services import get_latest_recipes
+
+User = get_user_model()
+
+
+def _is_fanned_out(followers_count):
+    return followers_count <= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def _add_entries(recipe_ids, author_ids, user_id=None):
+    """
+    Добавляет рецепты recipe_ids в ленты подписчиков их авторов из
+    author_ids (или только в ленту пользователя user_id) одним запросом:
+
+        INSERT INTO <лента> (...) SELECT ... FROM <рецепт>
+        JOIN (SELECT ... FROM <подписка> WHERE ... FOR SHARE) ...
+        ON CONFLICT DO NOTHING
+    """
+    if not recipe_ids or not author_ids:
+        return
+    using = router.db_for_write(FeedEntry)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+
+    def column(model, name):
+        return qn(model._meta.get_field(name).column)
+
+    fields = [
+        FeedEntry._meta.get_field(name)
+        for name in ('user', 'recipe', 'author', 'pub_date')
+    ]
+    subscription = '{author} IN ({ids})'.format(
+        author=column(Subscribe, 'author'),
+        ids=', '.join(['%s'] * len(author_ids)),
+    )
+    params = list(author_ids)
+    if user_id is not None:
+        subscription += ' AND {user} = %s'.format(
+            user=column(Subscribe, 'user')
+        )
+        params.append(user_id)
+    sql = (
+        '{insert} {table} ({columns}) '
+        'SELECT s.{user}, r.{pk}, r.{author}, r.{pub_date} FROM {recipe} r '
+        'INNER JOIN (SELECT {user}, {subscribe_author} FROM {subscribe} '
+        'WHERE {subscription}{lock}) s ON s.{subscribe_author} = r.{author} '
+        'WHERE r.{pk} IN ({ids}) {suffix}'
+    ).format(
+        insert=connection.ops.insert_statement(on_conflict=OnConflict.IGNORE),
+        table=qn(FeedEntry._meta.db_table),
+        columns=', '.join(qn(field.column) for field in fields),
+        user=column(Subscribe, 'user'),
+        subscribe_author=column(Subscribe, 'author'),
+        pk=qn(Recipe._meta.pk.column),
+        author=column(Recipe, 'author'),
+        pub_date=column(Recipe, 'pub_date'),
+        recipe=qn(Recipe._meta.db_table),
+        subscribe=qn(Subscribe._meta.db_table),
+        subscription=subscription,
+        lock=(
+            ' FOR SHARE' if connection.features.has_select_for_update
+            else ''
+        ),
+        ids=', '.join(['%s'] * len(recipe_ids)),
+        suffix=connection.ops.on_conflict_suffix_sql(
+            fields, OnConflict.IGNORE, None, None
+        ),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + list(recipe_ids))
+
+
+def _latest_recipe_ids(author_ids):
+    if not author_ids:
+        return []
+    latest_recipes = get_latest_recipes(
+        list(author_ids), settings.FEED_BACKFILL_SIZE
+    )
+    return [
+        recipe.pk for recipes in latest_recipes.values() for recipe in recipes
+    ]
+
+
+def fan_out_recipe(recipe_id):
+    """
+    Добавляет рецепт в ленты всех подписчиков автора
+    """
+    recipe = Recipe.objects.select_related('author').only(
+        'author__followers_count'
+    ).filter(pk=recipe_id).first()
+    if recipe is None or not _is_fanned_out(recipe.author.followers_count):
+        return
+    _add_entries([recipe.pk], [recipe.author_id])
+
+
+def backfill_feed(user_id, author_ids):
+    """
+    Добавляет в ленту пользователя последние FEED_BACKFILL_SIZE рецептов
+    каждого из авторов
+    """
+    author_ids = list(User.objects.filter(
+        pk__in=author_ids,
+        followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).values_list('pk', flat=True))
+    _add_entries(_latest_recipe_ids(author_ids), author_ids, user_id)
+
+
+def backfill_followers(author_ids):
+    """
+    Добавляет последние FEED_BACKFILL_SIZE рецептов каждого из авторов в
+    ленты всех их подписчиков
+
+    Вызывается, когда подписчиков авторов стало FEED_FANOUT_MAX_FOLLOWERS:
+    их рецепты больше не выбираются при чтении ленты, а раньше в ленты не
+    раскладывались.
+    """
+    author_ids = list(author_ids)
+    _add_entries(_latest_recipe_ids(author_ids), author_ids)
+
+
+def remove_from_feed(user_id, author_ids):
+    """
+    Удаляет из ленты пользователя рецепты авторов одним запросом DELETE
+    """
+    FeedEntry.objects.filter(
+        user_id=user_id, author_id__in=author_ids
+    ).delete()
+
+
+def rebuild_feed(user_id):
+    """
+    Пересобирает ленту пользователя по его подпискам
+    """
+    FeedEntry.objects.filter(user_id=user_id).delete()
+    author_ids = list(
+        Subscribe.objects.filter(user_id=user_id).values_list(
+            'author_id', flat=True
+        )
+    )
+    backfill_feed(user_id, author_ids)
+
+
+def encode_cursor(pub_date, recipe_id):
+    value = f'{pub_date.isoformat()}|{recipe_id}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Возвращает (pub_date, id рецепта) или None для некорректного курсора
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        pub_date, recipe_id = value.split('|')
+        pub_date = parse_datetime(pub_date)
+        recipe_id = int(recipe_id)
+    except (ValueError, UnicodeError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, recipe_id
+
+
+def _before(cursor, recipe_field):
+    if cursor is None:
+        return Q()
+    pub_date, recipe_id = cursor
+    return Q(pub_date__lt=pub_date) | Q(
+        pub_date=pub_date, **{f'{recipe_field}__lt': recipe_id}
+    )
+
+
+def get_feed_page(user, limit, cursor=None):
+    """
+    Возвращает id рецептов страницы ленты и курсор следующей страницы
+
+    Параметры:
+        user - пользователь
+        limit - количество рецептов на странице
+        cursor - (pub_date, id рецепта) последнего рецепта предыдущей
+        страницы или None для первой страницы
+
+    Лента и рецепты авторов, не разложенных в ленты, выбираются по индексам
+    отдельными запросами не более чем по limit + 1 строке и объединяются
+    слиянием отсортированных списков.
+    """
+    timeline = FeedEntry.objects.filter(
+        _before(cursor, 'recipe_id'), user=user
+    ).order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id'
+    )[:limit + 1]
+    sources = [list(timeline)]
+    popular_authors = list(
+        Subscribe.objects.filter(
+            user=user,
+            author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+        ).values_list('author_id', flat=True)
+    )
+    if popular_authors:
+        sources.append(list(
+            Recipe.objects.filter(
+                _before(cursor, 'pk'), author_id__in=popular_authors
+            ).order_by('-pub_date', '-pk').values_list(
+                'pub_date', 'pk'
+            )[:limit + 1]
+        ))
+    seen = set()
+    merged = (
+        item
+        for item in heapq.merge(*sources, reverse=True)
+        if not (item[1] in seen or seen.add(item[1]))
+    )
+    page = list(islice(merged, limit + 1))
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(*page[-1])
+    return [recipe_id for _, recipe_id in page], next_cursor
@@ -5,7 +5,8 @@
 
 Фильтры:
     - RecipeFilter: фильтр для рецептов
-    Доступна фильтрация по избранному, автору, списку покупок и тегам.
+    Доступна фильтрация по избранному, автору, списку покупок и тегам
+    и сортировка по популярности.
     - IngredientFilter: фильтр для ингредиентов
     Доступна фильтрация по названию ингредиента.
     Доступен поиск по названию ингредиента.
@@ -13,12 +14,18 @@
 
 
 """
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.utils import timezone
 from django_filters import (FilterSet, NumberFilter,
                             ModelChoiceFilter, ModelMultipleChoiceFilter,
-                            CharFilter,
+                            CharFilter, ChoiceFilter,
                             )
 from .models import Recipe, Ingredient, Tag
+from .popularity import schedule_refresh
 
 User = get_user_model()
 
@@ -44,6 +51,11 @@ class RecipeFilter(FilterSet):
         Array of strings
         Example: tags=lunch&tags=breakfast
         Показывать рецепты только с указанными тегами (по slug)
+    ordering
+        string
+        Enum: popular trending
+        popular - сортировать по популярности,
+        trending - популярные рецепты последних POPULARITY_TRENDING_DAYS дней
     """
 
     is_favorited = NumberFilter(method='filter_is_favorited')
@@ -59,6 +71,10 @@ class RecipeFilter(FilterSet):
         to_field_name='slug',
         queryset=Tag.objects.all()
     )
+    ordering = ChoiceFilter(
+        choices=(('popular', 'popular'), ('trending', 'trending')),
+        method='filter_ordering'
+    )
 
     def filter_is_favorited(self, queryset, name, value):
         if value == 1:
@@ -88,13 +104,33 @@ class RecipeFilter(FilterSet):
         """
         return queryset.filter(author__id=value)
 
+    def filter_ordering(self, queryset, name, value):
+        """
+        Сортировка по популярности из таблицы RecipePopularity
+
+        Таблица обновляется в фоне (popularity.schedule_refresh) или
+        командой refresh_popularity, поэтому порядок может отставать от
+        последних добавлений.
+        """
+        schedule_refresh()
+        if value == 'trending':
+            return queryset.filter(
+                popularity__last_event__gte=timezone.now() - timedelta(
+                    days=settings.POPULARITY_TRENDING_DAYS
+                )
+            ).order_by('-popularity__trending_score', '-pub_date')
+        return queryset.order_by(
+            F('popularity__score').desc(nulls_last=True), '-pub_date'
+        )
+
     class Meta:
         model = Recipe
         fields = (
             'is_favorited',
             'is_in_shopping_cart',
             'author',
-            'tags'
+            'tags',
+            'ordering'
         )
 
 
@@ -0,0 +1,42 @@
+"""
+Модуль заполнения сигнатур MinHash рецептов
+
+Сигнатуры новых и измененных рецептов сохраняются при записи, команда
+заполняет их для рецептов, созданных раньше (или в обход API), пакетами
+по --batch-size рецептов.
+
+Использование:
+    python manage.py backfill_recipe_signatures [--all] [--batch-size 1000]
+
+"""
+
+from django.core.management.base import BaseCommand
+
+from recipes.duplicates import backfill_signatures
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Compute MinHash signatures and LSH buckets for recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute signatures of all recipes, not only missing ones',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of recipes processed in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if not options['all']:
+            recipes = recipes.filter(signature__isnull=True)
+        processed = backfill_signatures(recipes, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Computed signatures of {processed} recipes'
+        ))
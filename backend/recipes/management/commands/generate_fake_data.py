@@ -0,0 +1,381 @@
+"""
+Модуль генерации тестовых данных для нагрузочного тестирования
+
+Создает пользователей, рецепты с ингредиентами и тегами, избранное,
+списки покупок и подписки. Распределения неравномерные, как в реальных
+данных: количество рецептов у авторов, популярность рецептов (избранное и
+списки покупок), частота ингредиентов и количество подписчиков подчиняются
+закону Ципфа.
+
+Данные полностью определяются параметром --seed. Все значения (включая
+счетчики favorites_count, recipes_count и т.д.) вычисляются заранее
+массивами NumPy и записываются пакетами функциями recipes.bulk: запросами
+INSERT на много строк или, с параметром --copy на PostgreSQL, командой
+COPY. Дата публикации рецептов задается явно, поэтому auto_now_add не
+используется.
+
+Производные данные (популярность, похожие рецепты, сигнатуры дубликатов,
+ленты подписок) на больших объемах считаются долго и заполняются только с
+параметром --derived.
+
+Использование:
+    python manage.py generate_fake_data --users 10000 --recipes 1000000
+    python manage.py generate_fake_data --seed 7 --copy --derived
+
+"""
+
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from recipes.bulk import insert_rows, write_rows
+from recipes.models import (
+    Favorite, Ingredient, IngredientAmount, Recipe, ShoppingList, Tag
+)
+from users.models import Subscribe
+
+User = get_user_model()
+
+IMAGE = 'recipe_images/fake.png'
+# PNG 1x1
+IMAGE_CONTENT = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010802000000'
+    '907753de0000000c49444154789c63f8ffff3f0005fe02fe0def46b800'
+    '00000049454e44ae426082'
+)
+WORDS = (
+    'нарезать смешать обжарить запечь варить добавить посолить поперчить '
+    'взбить остудить тесто соус бульон лук морковь чеснок масло мука '
+    'сахар яйца молоко сыр мясо рыба рис картофель зелень минут огонь '
+    'сковорода духовка кастрюля миска до готовности золотистого цвета'
+).split()
+NAMES = (
+    'Суп Салат Пирог Запеканка Каша Рагу Омлет Паста Плов Котлеты '
+    'Блины Соус Десерт Жаркое Гратен'
+).split()
+
+
+def zipf(rng, n, exponent):
+    """
+    Вероятности n элементов по закону Ципфа с показателем exponent,
+    ранги элементов перемешаны
+    """
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+
+def unique_pairs(first, second, size):
+    """
+    Уникальные пары (first[i], second[i]), отсортированные по first
+    """
+    keys = np.unique(first.astype(np.int64) * size + second)
+    return keys // size, keys % size
+
+
+class Command(BaseCommand):
+    help = 'Generate skewed fake data for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Minimal ingredient catalog size, missing ones are created',
+        )
+        parser.add_argument(
+            '--ingredients-per-recipe', type=float, default=7,
+            help='Average number of ingredients in a recipe',
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=None,
+            help='Number of favorites, by default 5 per recipe',
+        )
+        parser.add_argument(
+            '--cart', type=int, default=None,
+            help='Number of shopping cart entries, by default 3 per user',
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=None,
+            help='Number of subscriptions, by default 10 per user',
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--prefix', default=None,
+            help='Username prefix, by default fake<seed>_',
+        )
+        parser.add_argument('--password', default='password')
+        parser.add_argument('--batch-size', type=int, default=20000)
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Use COPY on PostgreSQL',
+        )
+        parser.add_argument(
+            '--derived', action='store_true',
+            help='Fill popularity, similar recipes, signatures and feeds',
+        )
+
+    def write(self, model, columns, rows, ignore_conflicts=False):
+        """
+        Записывает строки, которые возвращает генератор rows, пакетами
+        по batch_size в отдельных транзакциях
+        """
+        started = time.monotonic()
+        total = 0
+        while True:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == self.batch_size:
+                    break
+            if not batch:
+                break
+            with transaction.atomic(using=self.using):
+                if ignore_conflicts:
+                    insert_rows(
+                        model, columns, batch, self.using,
+                        ignore_conflicts=True
+                    )
+                else:
+                    write_rows(model, columns, batch, self.using, self.copy)
+            total += len(batch)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{model._meta.db_table}: {total} rows in {elapsed:.1f}s '
+            f'({total / max(elapsed, 1e-6):.0f} rows/s)'
+        )
+
+    def new_ids(self, model, last_id):
+        return np.array(
+            model.objects.using(self.using).filter(pk__gt=last_id).order_by(
+                'pk'
+            ).values_list('pk', flat=True),
+            dtype=np.int64
+        )
+
+    def last_id(self, model):
+        last = model.objects.using(self.using).order_by('-pk').first()
+        return last.pk if last else 0
+
+    def dates(self, rng, start, end):
+        """
+        Случайные моменты между start и end (массивы секунд от now)
+        """
+        return start + rng.random(len(start)) * (end - start)
+
+    def adapt(self, seconds):
+        return self.ops.adapt_datetimefield_value(
+            self.now + timedelta(seconds=float(seconds))
+        )
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        self.batch_size = options['batch_size']
+        self.copy = options['copy']
+        self.using = router.db_for_write(Recipe)
+        self.ops = connections[self.using].ops
+        self.now = timezone.now()
+        prefix = options['prefix'] or f'fake{options["seed"]}_'
+        if User.objects.using(self.using).filter(
+            username__startswith=prefix
+        ).exists():
+            raise CommandError(
+                f'Users with prefix {prefix} already exist, '
+                'use another --seed or --prefix'
+            )
+        n_users = options['users']
+        n_recipes = options['recipes']
+        if n_users < 2 or n_recipes < 1:
+            raise CommandError('Need at least 2 users and 1 recipe')
+        n_favorites = options['favorites']
+        if n_favorites is None:
+            n_favorites = 5 * n_recipes
+        n_cart = options['cart']
+        if n_cart is None:
+            n_cart = 3 * n_users
+        n_subscriptions = options['subscriptions']
+        if n_subscriptions is None:
+            n_subscriptions = 10 * n_users
+        started = time.monotonic()
+
+        if not default_storage.exists(IMAGE):
+            default_storage.save(IMAGE, ContentFile(IMAGE_CONTENT))
+
+        # справочники
+        self.write(Tag, ('name', 'color', 'slug'), (
+            (f'Тег {number}', f'#{number:06X}', f'tag-{number}')
+            for number in range(options['tags'])
+        ), ignore_conflicts=True)
+        tag_ids = np.array(
+            Tag.objects.using(self.using).order_by('pk').values_list(
+                'pk', flat=True
+            ),
+            dtype=np.int64
+        )
+        missing = options['ingredients'] - Ingredient.objects.using(
+            self.using
+        ).count()
+        self.write(Ingredient, ('name', 'measurement_unit'), (
+            (f'Ингредиент {number}', 'г') for number in range(max(missing, 0))
+        ), ignore_conflicts=True)
+        ingredient_ids = np.array(
+            Ingredient.objects.using(self.using).order_by('pk').values_list(
+                'pk', flat=True
+            ),
+            dtype=np.int64
+        )
+
+        # кто что создает: индексы пользователей и рецептов
+        recipe_author = rng.choice(
+            n_users, size=n_recipes, p=zipf(rng, n_users, 1.1)
+        )
+        subscriber = rng.integers(0, n_users, size=n_subscriptions)
+        followed = rng.choice(
+            n_users, size=n_subscriptions, p=zipf(rng, n_users, 1.2)
+        )
+        keep = subscriber != followed
+        subscriber, followed = unique_pairs(
+            subscriber[keep], followed[keep], n_users
+        )
+        recipe_weights = zipf(rng, n_recipes, 1.0)
+        user_weights = zipf(rng, n_users, 0.8)
+        favorite_user, favorite_recipe = unique_pairs(
+            rng.choice(n_users, size=n_favorites, p=user_weights),
+            rng.choice(n_recipes, size=n_favorites, p=recipe_weights),
+            n_recipes
+        )
+        cart_user, cart_recipe = unique_pairs(
+            rng.choice(n_users, size=n_cart, p=user_weights),
+            rng.choice(n_recipes, size=n_cart, p=recipe_weights),
+            n_recipes
+        )
+        # даты в секундах относительно текущего момента: пользователи
+        # зарегистрированы за последние 3 года, рецепты опубликованы после
+        # регистрации автора (по возрастанию id), избранное и покупки -
+        # после публикации рецепта
+        joined = -rng.random(n_users) * 3 * 365 * 24 * 3600
+        published = self.dates(rng, joined[recipe_author], np.zeros(n_recipes))
+        order = np.argsort(published, kind='stable')
+        recipe_author, published = recipe_author[order], published[order]
+
+        # пользователи
+        last_user = self.last_id(User)
+        password = make_password(options['password'])
+        recipes_count = np.bincount(recipe_author, minlength=n_users)
+        followers_count = np.bincount(followed, minlength=n_users)
+        self.write(User, (
+            'username', 'email', 'first_name', 'last_name', 'password',
+            'is_superuser', 'is_staff', 'is_active', 'date_joined',
+            'shopping_cart_version', 'recipes_count', 'followers_count',
+        ), (
+            (
+                f'{prefix}{number}', f'{prefix}{number}@example.com',
+                f'Имя{number}', f'Фамилия{number}', password,
+                False, False, True, self.adapt(joined[number]), 0,
+                int(recipes_count[number]), int(followers_count[number]),
+            )
+            for number in range(n_users)
+        ))
+        user_ids = self.new_ids(User, last_user)
+
+        # рецепты
+        last_recipe = self.last_id(Recipe)
+        favorites_count = np.bincount(favorite_recipe, minlength=n_recipes)
+        cart_count = np.bincount(cart_recipe, minlength=n_recipes)
+        names = rng.integers(0, len(NAMES), size=n_recipes)
+        cooking_time = rng.integers(5, 180, size=n_recipes)
+        text_words = rng.integers(0, len(WORDS), size=(n_recipes, 20))
+        self.write(Recipe, (
+            'author_id', 'name', 'image', 'text', 'cooking_time',
+            'pub_date', 'favorites_count', 'shopping_cart_count',
+        ), (
+            (
+                int(user_ids[recipe_author[number]]),
+                f'{NAMES[names[number]]} {number}', IMAGE,
+                ' '.join(WORDS[word] for word in text_words[number]),
+                int(cooking_time[number]), self.adapt(published[number]),
+                int(favorites_count[number]), int(cart_count[number]),
+            )
+            for number in range(n_recipes)
+        ))
+        recipe_ids = self.new_ids(Recipe, last_recipe)
+
+        # ингредиенты и теги рецептов
+        sizes = np.clip(
+            rng.poisson(options['ingredients_per_recipe'] - 1, n_recipes) + 1,
+            1, len(ingredient_ids)
+        )
+        amount_recipe, amount_ingredient = unique_pairs(
+            np.repeat(np.arange(n_recipes), sizes),
+            rng.choice(
+                len(ingredient_ids), size=int(sizes.sum()),
+                p=zipf(rng, len(ingredient_ids), 1.0)
+            ),
+            len(ingredient_ids)
+        )
+        amounts = rng.integers(1, 1000, size=len(amount_recipe))
+        self.write(
+            IngredientAmount, ('recipe_id', 'ingredient_id', 'amount'), (
+                (
+                    int(recipe_ids[amount_recipe[number]]),
+                    int(ingredient_ids[amount_ingredient[number]]),
+                    int(amounts[number]),
+                )
+                for number in range(len(amount_recipe))
+            )
+        )
+        if len(tag_ids):
+            tag_sizes = rng.integers(1, min(3, len(tag_ids)) + 1, n_recipes)
+            tag_recipe, tag_index = unique_pairs(
+                np.repeat(np.arange(n_recipes), tag_sizes),
+                rng.integers(0, len(tag_ids), size=int(tag_sizes.sum())),
+                len(tag_ids)
+            )
+            self.write(Recipe.tags.through, ('recipe_id', 'tag_id'), (
+                (int(recipe_ids[recipe]), int(tag_ids[tag]))
+                for recipe, tag in zip(tag_recipe, tag_index)
+            ))
+
+        # связи пользователей
+        for model, users, recipes in (
+            (Favorite, favorite_user, favorite_recipe),
+            (ShoppingList, cart_user, cart_recipe),
+        ):
+            created = self.dates(
+                rng, np.maximum(published[recipes], joined[users]),
+                np.zeros(len(recipes))
+            )
+            self.write(model, ('user_id', 'recipe_id', 'created'), (
+                (
+                    int(user_ids[users[number]]),
+                    int(recipe_ids[recipes[number]]),
+                    self.adapt(created[number]),
+                )
+                for number in range(len(users))
+            ))
+        self.write(Subscribe, ('user_id', 'author_id'), (
+            (int(user_ids[user]), int(user_ids[author]))
+            for user, author in zip(subscriber, followed)
+        ))
+
+        if options['derived']:
+            for command, arguments in (
+                ('refresh_popularity', ['--full']),
+                ('backfill_recipe_signatures', []),
+                ('refresh_similar_recipes', ['--full']),
+                ('rebuild_feeds', []),
+            ):
+                call_command(command, *arguments, stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {n_users} users and {n_recipes} recipes '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,190 @@
+"""
+Модуль потокового импорта ингредиентов из csv или json
+
+Формат csv файла (разделитель - запятая, строка заголовка
+name,measurement_unit необязательна):
+    Мука,кг
+    Сахар,кг
+
+Формат json файла - массив объектов:
+    [{"name": "Мука", "measurement_unit": "кг"}, ...]
+
+Файл читается по частям и не загружается в память целиком. Ингредиенты
+записываются пакетами по --batch-size строк, каждый пакет - в отдельной
+транзакции запросами INSERT ... ON CONFLICT DO NOTHING на много строк.
+Запросы собираются функцией recipes.bulk.insert_rows без создания
+объектов модели (как bulk_create(ignore_conflicts=True), но без его
+накладных расходов на каждую строку). Уже существующие ингредиенты (ограничение
+unique_ingredient) и повторы внутри файла пропускаются; других полей у
+ингредиента нет, поэтому обновлять при конфликте нечего. Строки без
+названия или единицы измерения и слишком длинные значения пропускаются
+и учитываются в отчете.
+
+Использование:
+    python manage.py import_ingredients data/ingredients.csv
+    python manage.py import_ingredients data/ingredients.json
+    cat ingredients.json | python manage.py import_ingredients - --format json
+
+"""
+
+import csv
+import io
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+
+from recipes.bulk import insert_rows
+from recipes.models import Ingredient
+
+CHUNK_SIZE = 64 * 1024
+HEADER = ['name', 'measurement_unit']
+
+
+def read_csv(file):
+    """
+    Возвращает пары (название, единица измерения) из csv файла
+    """
+    for number, row in enumerate(csv.reader(file)):
+        row = [value.strip() for value in row]
+        if number == 0 and row == HEADER or not any(row):
+            continue
+        yield tuple(row[:2]) if len(row) >= 2 else (None, None)
+
+
+def read_json(file):
+    """
+    Возвращает пары (название, единица измерения) из json массива
+
+    Массив разбирается по мере чтения файла частями по CHUNK_SIZE символов:
+    из буфера по очереди декодируются элементы массива.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    finished = False
+
+    def fill():
+        nonlocal buffer, position
+        chunk = file.read(CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        return bool(chunk)
+
+    while not finished:
+        while True:
+            # пропускаем пробелы, запятые и начало массива
+            while position < len(buffer) and (
+                buffer[position].isspace()
+                or buffer[position] == ',' and started
+            ):
+                position += 1
+            if position < len(buffer) or not fill():
+                break
+        if position >= len(buffer):
+            raise CommandError('Unexpected end of JSON input')
+        if not started:
+            if buffer[position] != '[':
+                raise CommandError('JSON input must be an array')
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            finished = True
+            continue
+        while True:
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+                break
+            except json.JSONDecodeError as error:
+                if not fill():
+                    raise CommandError(f'Invalid JSON: {error}')
+        if isinstance(item, dict):
+            yield item.get('name'), item.get('measurement_unit')
+        else:
+            yield None, None
+
+
+class Command(BaseCommand):
+    help = 'Import ingredients from a CSV or JSON file or stdin'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='File path, "-" reads from stdin',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help='Input format, by default detected from the file extension',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of rows inserted by one query',
+        )
+
+    def open(self, path):
+        if path == '-':
+            return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        try:
+            return open(path, encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(error)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or (
+            'json' if path.lower().endswith('.json') else 'csv'
+        )
+        batch_size = options['batch_size']
+        name_length = Ingredient._meta.get_field('name').max_length
+        unit_length = Ingredient._meta.get_field(
+            'measurement_unit'
+        ).max_length
+        using = router.db_for_write(Ingredient)
+        before = Ingredient.objects.using(using).count()
+        processed = skipped = 0
+        started = time.monotonic()
+        with self.open(path) as file:
+            rows = (read_json if input_format == 'json' else read_csv)(file)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                ingredients = []
+                for name, unit in batch:
+                    if not isinstance(name, str) or not isinstance(unit, str):
+                        skipped += 1
+                        continue
+                    name, unit = name.strip(), unit.strip()
+                    if (
+                        not name or not unit
+                        or len(name) > name_length or len(unit) > unit_length
+                    ):
+                        skipped += 1
+                        continue
+                    ingredients.append((name, unit))
+                if ingredients:
+                    with transaction.atomic(using=using):
+                        insert_rows(
+                            Ingredient, ('name', 'measurement_unit'),
+                            ingredients, using, ignore_conflicts=True
+                        )
+                processed += len(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Processed {processed} rows '
+                    f'({processed / elapsed:.0f} rows/s)'
+                )
+        imported = Ingredient.objects.using(using).count() - before
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} ingredients from {processed} rows '
+            f'in {elapsed:.1f}s, skipped {skipped} invalid rows'
+        ))
@@ -0,0 +1,41 @@
+"""
+Модуль пересборки лент подписок
+
+Лента каждого пользователя заполняется последними рецептами авторов, на
+которых он подписан (FEED_BACKFILL_SIZE рецептов каждого автора). Нужна
+после загрузки данных в обход приложения и для исправления расхождений.
+
+Использование:
+    python manage.py rebuild_feeds [--user 1 --user 2]
+
+"""
+
+from django.core.management.base import BaseCommand
+
+from recipes.feed import rebuild_feed
+from users.models import Subscribe
+
+
+class Command(BaseCommand):
+    help = 'Rebuild subscription feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='users',
+            help='Rebuild the feed of this user only (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        users = options['users']
+        if not users:
+            users = Subscribe.objects.order_by('user_id').values_list(
+                'user_id', flat=True
+            ).distinct().iterator()
+        rebuilt = 0
+        for user_id in users:
+            rebuild_feed(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} feeds'))
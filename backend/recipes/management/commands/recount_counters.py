@@ -0,0 +1,53 @@
+"""
+Модуль пересчета счетчиков рецептов и пользователей
+
+Счетчики:
+    Recipe.favorites_count - количество добавлений в избранное
+    Recipe.shopping_cart_count - количество добавлений в список покупок
+    CustomUser.recipes_count - количество рецептов
+    CustomUser.followers_count - количество подписчиков
+
+Счетчики обновляются при каждом изменении, команда нужна для исправления
+расхождений (например, после изменений в базе в обход приложения).
+Пересчет выполняется запросами UPDATE по диапазонам id.
+
+Использование:
+    python manage.py recount_counters [--batch-size 10000]
+
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from recipes.models import Recipe
+from recipes.services import recount_recipe_counters, recount_user_counters
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Recount denormalized recipe and user counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Number of ids updated by one query',
+        )
+
+    def recount(self, model, recount, batch_size):
+        last_id = model.objects.aggregate(last_id=Max('pk'))['last_id'] or 0
+        updated = 0
+        for start in range(0, last_id, batch_size):
+            updated += recount(pk__gt=start, pk__lte=start + batch_size)
+        return updated
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipes = self.recount(Recipe, recount_recipe_counters, batch_size)
+        users = self.recount(User, recount_user_counters, batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Recounted {recipes} recipes and {users} users'
+        ))
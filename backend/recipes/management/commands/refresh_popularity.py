@@ -0,0 +1,36 @@
+"""
+Модуль обновления популярности рецептов
+
+Учитывает добавления в избранное и в список покупок, появившиеся после
+предыдущего обновления. Команду можно запускать по расписанию (cron);
+кроме того, если фоновые задачи выполняются в пуле потоков
+(BACKGROUND_TASKS_ASYNC), обновление запускается в фоне при запросе
+списка рецептов с ordering=popular или ordering=trending. С SQLite
+задачи выполняются в потоке запроса, и команду нужно запускать по
+расписанию.
+
+Использование:
+    python manage.py refresh_popularity [--full]
+
+"""
+
+from django.core.management.base import BaseCommand
+
+from recipes.popularity import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = 'Refresh time-decayed recipe popularity scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute scores from all favorites and cart adds',
+        )
+
+    def handle(self, *args, **options):
+        updated = refresh_popularity(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated popularity of {updated} recipes'
+        ))
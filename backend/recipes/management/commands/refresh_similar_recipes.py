@@ -0,0 +1,34 @@
+"""
+Модуль пересчета похожих рецептов
+
+Без параметров пересчитывает похожие для рецептов из очереди
+SimilarRecipeQueue (рецептов с измененными ингредиентами), с параметром
+--full - для всех рецептов (заново вычисляет веса idf и нормы векторов).
+Если фоновые задачи выполняются в потоке запроса (SQLite), очередь
+обрабатывается только этой командой, ее нужно запускать периодически.
+
+Использование:
+    python manage.py refresh_similar_recipes [--full]
+
+"""
+
+from django.core.management.base import BaseCommand
+
+from recipes.similar import refresh_similar
+
+
+class Command(BaseCommand):
+    help = 'Recompute similar recipes from ingredient TF-IDF vectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute similar recipes for all recipes',
+        )
+
+    def handle(self, *args, **options):
+        refreshed = refresh_similar(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed similar recipes of {refreshed} recipes'
+        ))
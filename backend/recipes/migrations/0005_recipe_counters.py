@@ -0,0 +1,64 @@
+# Generated by Django 4.1.6 on 2026-10-19 10:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model("recipes", "Recipe")
+    Favorite = apps.get_model("recipes", "Favorite")
+    ShoppingList = apps.get_model("recipes", "ShoppingList")
+    CustomUser = apps.get_model("users", "CustomUser")
+    Subscribe = apps.get_model("users", "Subscribe")
+    Recipe.objects.update(
+        favorites_count=count(Favorite, "recipe"),
+        shopping_cart_count=count(ShoppingList, "recipe"),
+    )
+    CustomUser.objects.update(
+        recipes_count=count(Recipe, "author"),
+        followers_count=count(Subscribe, "author"),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0004_alter_ingredient_name_ingredient_unique_ingredient"),
+        ("users", "0003_customuser_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="favorites_count",
+            field=models.PositiveIntegerField(
+                db_index=True,
+                default=0,
+                editable=False,
+                verbose_name="Количество добавлений в избранное",
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="shopping_cart_count",
+            field=models.PositiveIntegerField(
+                default=0,
+                editable=False,
+                verbose_name="Количество добавлений в список покупок",
+            ),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
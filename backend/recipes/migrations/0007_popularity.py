@@ -0,0 +1,114 @@
+# Generated by Django 4.1.6 on 2026-10-19 10:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0006_feedentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PopularityCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "favorite_id",
+                    models.BigIntegerField(
+                        default=0,
+                        verbose_name="Последнее учтенное добавление в избранное",
+                    ),
+                ),
+                (
+                    "shopping_list_id",
+                    models.BigIntegerField(
+                        default=0,
+                        verbose_name="Последнее учтенное добавление в список покупок",
+                    ),
+                ),
+                (
+                    "epoch",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Точка отсчета"
+                    ),
+                ),
+                (
+                    "refreshed",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        verbose_name="Дата обновления",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Отметка обновления популярности",
+                "verbose_name_plural": "Отметки обновления популярности",
+            },
+        ),
+        migrations.CreateModel(
+            name="RecipePopularity",
+            fields=[
+                (
+                    "recipe",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="popularity",
+                        serialize=False,
+                        to="recipes.recipe",
+                        verbose_name="Рецепт",
+                    ),
+                ),
+                ("score", models.FloatField(default=0, verbose_name="Популярность")),
+                (
+                    "trending_score",
+                    models.FloatField(
+                        default=0, verbose_name="Популярность за последние дни"
+                    ),
+                ),
+                (
+                    "last_event",
+                    models.DateTimeField(verbose_name="Дата последнего добавления"),
+                ),
+            ],
+            options={
+                "verbose_name": "Популярность рецепта",
+                "verbose_name_plural": "Популярность рецептов",
+            },
+        ),
+        migrations.AddField(
+            model_name="favorite",
+            name="created",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="Дата добавления"
+            ),
+        ),
+        migrations.AddField(
+            model_name="shoppinglist",
+            name="created",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="Дата добавления"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipepopularity",
+            index=models.Index(fields=["-score"], name="popularity_score_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="recipepopularity",
+            index=models.Index(
+                fields=["-trending_score", "last_event"], name="popularity_trending_idx"
+            ),
+        ),
+    ]
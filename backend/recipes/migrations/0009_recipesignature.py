@@ -0,0 +1,65 @@
+# Generated by Django 4.1.6 on 2026-10-19 10:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0008_similarrecipe"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecipeSignature",
+            fields=[
+                (
+                    "recipe",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="signature",
+                        serialize=False,
+                        to="recipes.recipe",
+                        verbose_name="Рецепт",
+                    ),
+                ),
+                ("minhash", models.BinaryField(verbose_name="Сигнатура")),
+            ],
+            options={
+                "verbose_name": "Сигнатура рецепта",
+                "verbose_name_plural": "Сигнатуры рецептов",
+            },
+        ),
+        migrations.CreateModel(
+            name="RecipeBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "bucket",
+                    models.BigIntegerField(db_index=True, verbose_name="Корзина"),
+                ),
+                (
+                    "recipe",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="buckets",
+                        to="recipes.recipe",
+                        verbose_name="Рецепт",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Корзина LSH рецепта",
+                "verbose_name_plural": "Корзины LSH рецептов",
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.1.6 on 2026-10-19 11:41
+
+import api.indexes
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("recipes", "0009_recipesignature"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ingredientamount",
+            name="recipe",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="ingredient_amounts",
+                to="recipes.recipe",
+                verbose_name="Рецепт",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="recipe",
+            name="author",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="recipes",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="Автор рецепта",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ingredientamount",
+            index=api.indexes.CoveringIndex(
+                covering=("ingredient", "amount"),
+                fields=["recipe"],
+                name="ingredient_amount_recipe_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["author", "-pub_date", "-id"], name="recipe_author_pub_date_idx"
+            ),
+        ),
+    ]
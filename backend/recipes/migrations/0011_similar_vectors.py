@@ -0,0 +1,55 @@
+# Generated by Django 4.1.6 on 2026-10-19 12:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0010_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngredientWeight",
+            fields=[
+                (
+                    "ingredient",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="recipes.ingredient",
+                        verbose_name="Ингредиент",
+                    ),
+                ),
+                ("idf", models.FloatField(verbose_name="Вес")),
+            ],
+            options={
+                "verbose_name": "Вес ингредиента",
+                "verbose_name_plural": "Веса ингредиентов",
+            },
+        ),
+        migrations.CreateModel(
+            name="RecipeVector",
+            fields=[
+                (
+                    "recipe",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="vector",
+                        serialize=False,
+                        to="recipes.recipe",
+                        verbose_name="Рецепт",
+                    ),
+                ),
+                ("norm", models.FloatField(verbose_name="Норма")),
+            ],
+            options={
+                "verbose_name": "Вектор рецепта",
+                "verbose_name_plural": "Векторы рецептов",
+            },
+        ),
+    ]
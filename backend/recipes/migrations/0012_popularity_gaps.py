@@ -0,0 +1,26 @@
+# Generated by Django 4.1.6 on 2026-10-19 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0011_similar_vectors"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="popularitycheckpoint",
+            name="favorite_gaps",
+            field=models.JSONField(
+                default=list, verbose_name="Пропуски id добавлений в избранное"
+            ),
+        ),
+        migrations.AddField(
+            model_name="popularitycheckpoint",
+            name="shopping_list_gaps",
+            field=models.JSONField(
+                default=list, verbose_name="Пропуски id добавлений в список покупок"
+            ),
+        ),
+    ]
@@ -14,6 +14,8 @@
             из предустановленных)
             Время приготовления в минутах: cooking_time
         Все поля обязательны для заполнения.
+        Счетчики добавлений в избранное и в список покупок
+        (favorites_count, shopping_cart_count) обновляются автоматически.
 
     Ингредиент: Ingredient
         Модель, которая хранит данные об ингридиентах.
@@ -46,8 +48,69 @@
         Содержит следующие поля:
             Пользователь: user
             Рецепт: recipe (можно добавить несколько рецептов в избранное)
+            Дата добавления: created
         Связь с моделью Recipe осуществляется через модель Recipe.
 
+    Запись ленты подписок: FeedEntry:
+        Модель, которая хранит ленту рецептов авторов, на которых подписан
+        пользователь. Записи создаются при публикации рецепта для всех
+        подписчиков автора (fan-out on write).
+        Содержит следующие поля:
+            Пользователь: user
+            Рецепт: recipe
+            Автор рецепта: author
+            Дата публикации рецепта: pub_date
+
+    Популярность рецепта: RecipePopularity:
+        Модель, которая хранит рейтинг популярности рецепта - сумму
+        добавлений в избранное и в список покупок с весом, убывающим со
+        временем. Заполняется командой refresh_popularity.
+        Содержит следующие поля:
+            Рецепт: recipe
+            Популярность: score
+            Популярность за последние дни: trending_score
+            Дата последнего добавления: last_event
+
+    Отметка обновления популярности: PopularityCheckpoint:
+        Последние учтенные добавления в избранное и в список покупок.
+
+    Похожий рецепт: SimilarRecipe:
+        Модель, которая хранит ближайшие по набору ингредиентов рецепты.
+        Заполняется командой refresh_similar_recipes.
+        Содержит следующие поля:
+            Рецепт: recipe
+            Похожий рецепт: similar
+            Сходство: score
+
+    Очередь пересчета похожих рецептов: SimilarRecipeQueue:
+        Рецепты, ингредиенты которых изменились после расчета похожих.
+
+    Вес ингредиента: IngredientWeight:
+        Вес idf ингредиента в векторах TF-IDF для расчета похожих.
+        Содержит следующие поля:
+            Ингредиент: ingredient
+            Вес: idf
+
+    Вектор рецепта: RecipeVector:
+        Норма вектора TF-IDF ингредиентов рецепта с весами IngredientWeight.
+        Содержит следующие поля:
+            Рецепт: recipe
+            Норма: norm
+
+    Сигнатура рецепта: RecipeSignature:
+        Сигнатура MinHash ингредиентов и текста рецепта для поиска
+        почти одинаковых рецептов.
+        Содержит следующие поля:
+            Рецепт: recipe
+            Сигнатура: minhash
+
+    Корзина LSH рецепта: RecipeBucket:
+        Хеш одной полосы сигнатуры рецепта. Рецепты с общей корзиной -
+        кандидаты в дубликаты.
+        Содержит следующие поля:
+            Рецепт: recipe
+            Корзина: bucket
+
 
 """
 
@@ -56,6 +119,8 @@ from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.validators import RegexValidator
 from django.urls import reverse
+from django.utils import timezone
+from api.indexes import CoveringIndex
 
 User = get_user_model()
 
@@ -124,11 +189,13 @@ class IngredientAmount(models.Model):
         related_name='ingredient_amounts',
         verbose_name='Ингредиент'
     )
+    # индекс по рецепту - ingredient_amount_recipe_idx
     recipe = models.ForeignKey(
         'Recipe',
         on_delete=models.CASCADE,
         related_name='ingredient_amounts',
-        verbose_name='Рецепт'
+        verbose_name='Рецепт',
+        db_index=False
     )
     amount = models.PositiveIntegerField(
         verbose_name='Количество',
@@ -148,6 +215,15 @@ class IngredientAmount(models.Model):
                 name='unique_ingredient_amount'
             )
         ]
+        indexes = [
+            # ингредиенты рецептов страницы и агрегация списка покупок
+            # читают только индекс
+            CoveringIndex(
+                fields=['recipe'],
+                covering=['ingredient', 'amount'],
+                name='ingredient_amount_recipe_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.ingredient} - {self.amount}'
@@ -155,11 +231,13 @@ class IngredientAmount(models.Model):
 
 class Recipe(models.Model):
     """Рецепт"""
+    # индекс по автору - recipe_author_pub_date_idx
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
-        verbose_name='Автор рецепта'
+        verbose_name='Автор рецепта',
+        db_index=False
     )
     name = models.CharField(
         verbose_name='Название рецепта',
@@ -192,11 +270,30 @@ class Recipe(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в избранное',
+        default=0,
+        editable=False,
+        db_index=True
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в список покупок',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            # страница автора и последние рецепты авторов в подписках
+            # (get_latest_recipes) без сортировки
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -228,6 +325,10 @@ class Favorite(models.Model):
         related_name='favorites',
         verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        default=timezone.now
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -320,6 +421,10 @@ class ShoppingList(models.Model):
         verbose_name='Рецепт',
         help_text='Рецепт, который добавлен в корзину',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        default=timezone.now,
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -333,3 +438,312 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f'{self.user} - {self.recipe}'
+
+
+class FeedEntry(models.Model):
+    """
+        Запись ленты подписок
+
+        Лента пользователя заполняется при публикации рецепта автором, на
+        которого он подписан, и при подписке на автора. Авторы с большим
+        количеством подписчиков в ленту не раскладываются, их рецепты
+        добавляются к ленте при чтении.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор рецепта'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_entry_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_entry_user_author_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class RecipePopularity(models.Model):
+    """
+        Популярность рецепта
+
+        Каждое добавление в избранное или в список покупок в момент t
+        увеличивает score на weight * exp(λ * (t - epoch)), где epoch -
+        точка отсчета из PopularityCheckpoint, а λ = ln 2 / период
+        полураспада. Такая сумма пропорциональна сумме весов, убывающих
+        со временем, поэтому порядок рецептов по score совпадает с порядком
+        по популярности на текущий момент, а новые добавления учитываются
+        без пересчета старых. trending_score считается так же с коротким
+        периодом полураспада.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        verbose_name='Рецепт'
+    )
+    score = models.FloatField(
+        verbose_name='Популярность',
+        default=0
+    )
+    trending_score = models.FloatField(
+        verbose_name='Популярность за последние дни',
+        default=0
+    )
+    last_event = models.DateTimeField(
+        verbose_name='Дата последнего добавления',
+    )
+
+    class Meta:
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        indexes = [
+            models.Index(
+                fields=['-score'],
+                name='popularity_score_idx'
+            ),
+            models.Index(
+                fields=['-trending_score', 'last_event'],
+                name='popularity_trending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} - {self.score}'
+
+
+class PopularityCheckpoint(models.Model):
+    """
+        Отметка обновления популярности
+
+        Единственная запись с id последних учтенных добавлений в избранное
+        и в список покупок, еще не найденными id ниже них (пропусками
+        [первый id, последний id, время записи]) и точкой отсчета epoch
+        для RecipePopularity.
+    """
+    favorite_id = models.BigIntegerField(
+        verbose_name='Последнее учтенное добавление в избранное',
+        default=0
+    )
+    shopping_list_id = models.BigIntegerField(
+        verbose_name='Последнее учтенное добавление в список покупок',
+        default=0
+    )
+    favorite_gaps = models.JSONField(
+        verbose_name='Пропуски id добавлений в избранное',
+        default=list
+    )
+    shopping_list_gaps = models.JSONField(
+        verbose_name='Пропуски id добавлений в список покупок',
+        default=list
+    )
+    epoch = models.DateTimeField(
+        verbose_name='Точка отсчета',
+        default=timezone.now
+    )
+    refreshed = models.DateTimeField(
+        verbose_name='Дата обновления',
+        default=timezone.now
+    )
+
+    class Meta:
+        verbose_name = 'Отметка обновления популярности'
+        verbose_name_plural = 'Отметки обновления популярности'
+
+    def __str__(self):
+        return f'{self.refreshed}'
+
+
+class SimilarRecipe(models.Model):
+    """
+        Похожий рецепт
+
+        score - косинусное сходство векторов TF-IDF ингредиентов рецептов.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(
+        verbose_name='Сходство'
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'],
+                name='similar_recipe_score_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} - {self.similar_id}'
+
+
+class SimilarRecipeQueue(models.Model):
+    """
+        Очередь пересчета похожих рецептов
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        verbose_name='Рецепт'
+    )
+
+    class Meta:
+        verbose_name = 'Рецепт в очереди пересчета похожих'
+        verbose_name_plural = 'Очередь пересчета похожих рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id}'
+
+
+class IngredientWeight(models.Model):
+    """
+        Вес ингредиента в векторах рецептов для расчета похожих
+
+        idf = ln((1 + n) / (1 + df)) + 1, где n - количество рецептов, df -
+        количество рецептов с ингредиентом.
+    """
+    ingredient = models.OneToOneField(
+        Ingredient,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        verbose_name='Ингредиент'
+    )
+    idf = models.FloatField(
+        verbose_name='Вес'
+    )
+
+    class Meta:
+        verbose_name = 'Вес ингредиента'
+        verbose_name_plural = 'Веса ингредиентов'
+
+    def __str__(self):
+        return f'{self.ingredient_id}'
+
+
+class RecipeVector(models.Model):
+    """
+        Норма вектора TF-IDF ингредиентов рецепта
+
+        Нормированный вектор рецепта - веса IngredientWeight его
+        ингредиентов, деленные на norm.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='vector',
+        verbose_name='Рецепт'
+    )
+    norm = models.FloatField(
+        verbose_name='Норма'
+    )
+
+    class Meta:
+        verbose_name = 'Вектор рецепта'
+        verbose_name_plural = 'Векторы рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id}'
+
+
+class RecipeSignature(models.Model):
+    """
+        Сигнатура MinHash рецепта
+
+        minhash - значения хеш-функций, массив uint32 в байтах.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='signature',
+        verbose_name='Рецепт'
+    )
+    minhash = models.BinaryField(
+        verbose_name='Сигнатура'
+    )
+
+    class Meta:
+        verbose_name = 'Сигнатура рецепта'
+        verbose_name_plural = 'Сигнатуры рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id}'
+
+
+class RecipeBucket(models.Model):
+    """
+        Корзина LSH рецепта
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='buckets',
+        verbose_name='Рецепт'
+    )
+    bucket = models.BigIntegerField(
+        verbose_name='Корзина',
+        db_index=True
+    )
+
+    class Meta:
+        verbose_name = 'Корзина LSH рецепта'
+        verbose_name_plural = 'Корзины LSH рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id} - {self.bucket}'
@@ -0,0 +1,282 @@
+"""
+Поиск рецептов по имеющимся ингредиентам
+
+Обратный индекс хранится в памяти процесса: для каждого ингредиента -
+отсортированный массив id рецептов, в которых он есть, и для каждого
+рецепта - количество его ингредиентов (массив размеров по
+отсортированным id рецептов). Для списка имеющихся ингредиентов
+массивы объединяются, и количество совпадений и недостающих ингредиентов
+всех рецептов считается операциями над массивами NumPy без запросов к
+базе.
+
+Индекс строится фоновой задачей (recipes.tasks), запущенной первым
+поиском; пока он строится, поиск выполняется одним запросом к базе. Чтобы
+учесть изменения из других процессов, раз в PANTRY_INDEX_TTL секунд новый
+индекс строится так же, без блокировки индекса: до замены поиск
+использует прежний индекс. Если фоновые задачи выполняются в потоке
+запроса (SQLite), индекс строит запрос, запустивший построение, остальные
+запросы его не ждут.
+
+Изменения в текущем процессе приходят сигналами IngredientAmount: рецепт
+отмечается измененным после фиксации транзакции, и перед следующим
+поиском ингредиенты отмеченных рецептов загружаются одним запросом. Запрос
+выполняется без блокировки индекса, затем меняются только массивы
+затронутых ингредиентов и размеры отмеченных рецептов. Рецепты,
+отмеченные во время построения нового индекса, после замены загружаются
+повторно: их изменения могли не попасть в построенный индекс.
+
+Объекты:
+    pantry_index - индекс текущего процесса
+"""
+
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import IngredientAmount
+from .tasks import run_in_background
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+class PantryIndex:
+    """
+    Обратный индекс ингредиент -> рецепты
+
+    Методы:
+        search - рецепты, отсортированные по покрытию имеющимися
+        ингредиентами
+        invalidate - отметить рецепт измененным после фиксации транзакции
+        reset - сбросить индекс
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # изменения рецептов загружает и применяет один поток за раз, чтобы
+        # более старые данные не заменили более новые
+        self._refresh_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Сбрасывает индекс, следующий поиск строит его заново
+
+        Нужен, когда таблицы очищаются без сигналов (например, тестами
+        TransactionTestCase).
+        """
+        with self._lock:
+            self._built = None
+            self._dirty = set()
+            # новый индекс строится фоновой задачей, рецепты, отмеченные за
+            # время построения
+            self._rebuilding = False
+            self._rebuild_dirty = set()
+            self._postings = {}
+            self._recipes = {}
+            self._recipe_ids = EMPTY
+            self._sizes = EMPTY
+
+    def _load(self):
+        """
+        Загружает индекс из базы, возвращает (postings, recipes, recipe_ids,
+        sizes)
+        """
+        pairs = np.array(
+            IngredientAmount.objects.order_by(
+                'ingredient_id', 'recipe_id'
+            ).values_list('ingredient_id', 'recipe_id').distinct(),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        ingredient_ids, starts = np.unique(pairs[:, 0], return_index=True)
+        postings = dict(zip(
+            ingredient_ids.tolist(), np.split(pairs[:, 1], starts[1:])
+        ))
+        recipes = {}
+        for ingredient_id, recipe_id in pairs.tolist():
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        recipe_ids, sizes = np.unique(pairs[:, 1], return_counts=True)
+        return postings, recipes, recipe_ids, sizes.astype(np.int64)
+
+    def _rebuild(self):
+        """
+        Строит новый индекс без блокировки и заменяет им текущий
+        """
+        try:
+            postings, recipes, recipe_ids, sizes = self._load()
+            with self._lock:
+                self._postings = postings
+                self._recipes = recipes
+                self._recipe_ids = recipe_ids
+                self._sizes = sizes
+                self._built = time.monotonic()
+                self._dirty |= self._rebuild_dirty
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                self._rebuild_dirty = set()
+
+    def _start_rebuild(self):
+        """
+        Отмечает начало построения индекса, вызывается под блокировкой
+
+        Возвращает True, если индекс еще не построен или устарел и его
+        никто не строит: задача запускается после снятия блокировки.
+        """
+        if self._rebuilding or (
+            self._built is not None
+            and time.monotonic() - self._built <= settings.PANTRY_INDEX_TTL
+        ):
+            return False
+        self._rebuilding = True
+        return True
+
+    def _update_sizes(self, recipe_ids):
+        """
+        Обновляет размеры рецептов recipe_ids по self._recipes, вызывается
+        под блокировкой
+
+        Позиции рецептов находятся двоичным поиском в отсортированном
+        массиве id, рецепты без ингредиентов удаляются, новые вставляются на
+        свои места, остальные размеры не пересчитываются.
+        """
+        recipe_ids = np.array(sorted(recipe_ids), dtype=np.int64)
+        sizes = np.array(
+            [len(self._recipes.get(pk, ())) for pk in recipe_ids.tolist()],
+            dtype=np.int64
+        )
+        positions = np.searchsorted(self._recipe_ids, recipe_ids)
+        found = positions < len(self._recipe_ids)
+        found[found] = self._recipe_ids[positions[found]] == recipe_ids[found]
+        self._sizes[positions[found]] = sizes[found]
+        removed = positions[found & (sizes == 0)]
+        if len(removed):
+            self._recipe_ids = np.delete(self._recipe_ids, removed)
+            self._sizes = np.delete(self._sizes, removed)
+        added = ~found & (sizes > 0)
+        if added.any():
+            positions = np.searchsorted(self._recipe_ids, recipe_ids[added])
+            self._recipe_ids = np.insert(
+                self._recipe_ids, positions, recipe_ids[added]
+            )
+            self._sizes = np.insert(self._sizes, positions, sizes[added])
+
+    def _apply_dirty(self):
+        """
+        Загружает ингредиенты отмеченных рецептов и применяет их к индексу
+
+        Запрос к базе выполняется без блокировки индекса: поиск в других
+        потоках в это время использует индекс без этих изменений.
+        """
+        with self._refresh_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return
+            current = {}
+            for recipe_id, ingredient_id in IngredientAmount.objects.filter(
+                recipe__in=dirty
+            ).values_list('recipe_id', 'ingredient_id'):
+                current.setdefault(recipe_id, set()).add(ingredient_id)
+            with self._lock:
+                for recipe_id in dirty:
+                    self._apply_recipe(
+                        recipe_id, current.get(recipe_id, set())
+                    )
+                self._update_sizes(dirty)
+
+    def _apply_recipe(self, recipe_id, new):
+        """
+        Заменяет ингредиенты рецепта в массивах ингредиентов, вызывается
+        под блокировкой
+        """
+        old = self._recipes.pop(recipe_id, set())
+        if new:
+            self._recipes[recipe_id] = new
+        for ingredient_id in old - new:
+            postings = self._postings[ingredient_id]
+            postings = np.delete(
+                postings, np.searchsorted(postings, recipe_id)
+            )
+            if len(postings):
+                self._postings[ingredient_id] = postings
+            else:
+                del self._postings[ingredient_id]
+        for ingredient_id in new - old:
+            postings = self._postings.get(ingredient_id, EMPTY)
+            self._postings[ingredient_id] = np.insert(
+                postings, np.searchsorted(postings, recipe_id), recipe_id
+            )
+
+    def _search_database(self, ingredient_ids):
+        """
+        Поиск одним запросом к базе, пока индекс не построен
+        """
+        rows = np.array(
+            IngredientAmount.objects.filter(
+                recipe__in=IngredientAmount.objects.filter(
+                    ingredient__in=ingredient_ids
+                ).values('recipe_id')
+            ).order_by().values('recipe_id').annotate(
+                matched=Count(
+                    'ingredient_id', distinct=True,
+                    filter=Q(ingredient__in=ingredient_ids)
+                ),
+                size=Count('ingredient_id', distinct=True)
+            ).values_list('recipe_id', 'matched', 'size'),
+            dtype=np.int64
+        ).reshape(-1, 3)
+        return rows[:, 0], rows[:, 1], rows[:, 2]
+
+    def search(self, ingredient_ids):
+        """
+        Ищет рецепты, в которых есть хотя бы один из ингредиентов
+
+        Возвращает три массива одинаковой длины: id рецептов, количество
+        имеющихся и количество недостающих ингредиентов рецепта. Рецепты
+        отсортированы по убыванию количества имеющихся ингредиентов, затем
+        по возрастанию недостающих, затем от новых к старым.
+        """
+        ingredient_ids = set(ingredient_ids)
+        with self._lock:
+            rebuild = self._start_rebuild()
+        if rebuild:
+            run_in_background(self._rebuild)
+        if self._built is None:
+            recipe_ids, matched, sizes = self._search_database(ingredient_ids)
+        else:
+            self._apply_dirty()
+            with self._lock:
+                postings = [
+                    self._postings[pk] for pk in ingredient_ids
+                    if pk in self._postings
+                ]
+                if not postings:
+                    return EMPTY, EMPTY, EMPTY
+                recipe_ids, matched = np.unique(
+                    np.concatenate(postings), return_counts=True
+                )
+                sizes = self._sizes[
+                    np.searchsorted(self._recipe_ids, recipe_ids)
+                ]
+        missing = sizes - matched
+        order = np.lexsort((-recipe_ids, missing, -matched))
+        return recipe_ids[order], matched[order], missing[order]
+
+    def _mark_dirty(self, recipe_id):
+        with self._lock:
+            self._dirty.add(recipe_id)
+            if self._rebuilding:
+                self._rebuild_dirty.add(recipe_id)
+
+    def invalidate(self, recipe_id):
+        """
+        Отмечает рецепт измененным после фиксации текущей транзакции
+        """
+        transaction.on_commit(lambda: self._mark_dirty(recipe_id))
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,265 @@
+"""
+Популярность рецептов
+
+Популярность хранится в таблице RecipePopularity и обновляется
+инкрементально: при каждом обновлении учитываются только добавления в
+избранное и в список покупок с id больше, чем в PopularityCheckpoint.
+
+Id выдаются при записи, а видны после фиксации транзакции, поэтому
+добавление с меньшим id может появиться позже добавлений с большими id.
+Пропущенные id ниже последнего учтенного сохраняются в PopularityCheckpoint
+диапазонами и проверяются при следующих обновлениях, пока не пройдет
+POPULARITY_GAP_TIMEOUT секунд; найденные в пропуске добавления учитываются
+один раз и исключаются из диапазона. Пропуск записывается, только если
+следующее за ним добавление создано не раньше POPULARITY_GAP_TIMEOUT назад:
+более ранние пропуски - это удаленные добавления и откаченные транзакции.
+
+Вклад добавления в момент t равен weight * exp(λ * (t - epoch)). Сумма
+таких вкладов отличается от суммы весов, убывающих со временем
+(weight * exp(-λ * (now - t))), только общим множителем exp(λ * (now -
+epoch)), поэтому порядок рецептов по score верен без пересчета старых
+значений. Когда точка отсчета epoch устаревает на POPULARITY_REBASE_DAYS,
+все значения умножаются на exp(-λ * (now - epoch)) и epoch переносится на
+текущий момент, чтобы значения не росли неограниченно.
+
+Удаление из избранного и из списка покупок популярность не уменьшает:
+добавление уже учтено, а его вклад убывает со временем.
+
+Функции:
+    refresh_popularity - учесть новые добавления (или пересчитать все)
+    schedule_refresh - запустить обновление в фоне, если прошло больше
+    POPULARITY_REFRESH_INTERVAL с предыдущего запуска
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import (
+    Favorite, PopularityCheckpoint, RecipePopularity, ShoppingList
+)
+from .tasks import run_in_background
+
+REFRESH_SCHEDULED_CACHE_KEY = 'popularity_refresh_scheduled'
+
+# количество добавлений, выбираемых из базы одним запросом
+EVENTS_BATCH_SIZE = 10000
+# количество пропусков id, проверяемых одним запросом
+GAPS_BATCH_SIZE = 100
+
+
+def _decay_rate(half_life_days):
+    return math.log(2) / timedelta(days=half_life_days).total_seconds()
+
+
+class CheckpointChanged(Exception):
+    """Популярность обновлена параллельно другим процессом"""
+
+
+def _count(events, epoch, weight, rates, scores):
+    """
+    Добавляет в scores вклад добавлений events: (id, рецепт, дата)
+    """
+    for pk, recipe_id, created in events:
+        seconds = (created - epoch).total_seconds()
+        score, trending, last_event = scores.get(
+            recipe_id, (0.0, 0.0, created)
+        )
+        scores[recipe_id] = (
+            score + weight * math.exp(rates[0] * seconds),
+            trending + weight * math.exp(rates[1] * seconds),
+            max(last_event, created),
+        )
+
+
+def _find_gaps(last_id, events, since, seen):
+    """
+    Возвращает пропуски [первый id, последний id, seen] перед
+    добавлениями events с id больше last_id, созданными не раньше since
+    """
+    gaps = []
+    for pk, _, created in events:
+        if pk > last_id + 1 and created >= since:
+            gaps.append([last_id + 1, pk - 1, seen])
+        last_id = pk
+    return gaps
+
+
+def _recheck_gaps(model, gaps, expired, epoch, weight, rates, scores):
+    """
+    Добавляет в scores вклад добавлений model, появившихся в пропусках
+    gaps
+
+    Возвращает пропуски без найденных добавлений и пропусков, записанных
+    раньше expired.
+    """
+    found = []
+    for start in range(0, len(gaps), GAPS_BATCH_SIZE):
+        query = Q()
+        for first, last, _ in gaps[start:start + GAPS_BATCH_SIZE]:
+            query |= Q(pk__range=(first, last))
+        events = list(
+            model.objects.filter(query).order_by('pk').values_list(
+                'pk', 'recipe_id', 'created'
+            )
+        )
+        _count(events, epoch, weight, rates, scores)
+        found.extend(event[0] for event in events)
+    found.sort()
+    remaining = []
+    for first, last, seen in gaps:
+        if seen < expired:
+            continue
+        for pk in found[bisect_left(found, first):bisect_right(found, last)]:
+            if pk > first:
+                remaining.append([first, pk - 1, seen])
+            first = pk + 1
+        if first <= last:
+            remaining.append([first, last, seen])
+    return remaining
+
+
+def _collect(model, last_id, gaps, now, epoch, weight, rates, scores):
+    """
+    Добавляет в scores вклад добавлений model из пропусков gaps и с id
+    больше last_id
+
+    Возвращает id последнего учтенного добавления и новые пропуски.
+    """
+    seen = now.timestamp()
+    expired = now - timedelta(seconds=settings.POPULARITY_GAP_TIMEOUT)
+    gaps = _recheck_gaps(
+        model, gaps, expired.timestamp(), epoch, weight, rates, scores
+    )
+    while True:
+        events = list(
+            model.objects.filter(pk__gt=last_id).order_by('pk').values_list(
+                'pk', 'recipe_id', 'created'
+            )[:EVENTS_BATCH_SIZE]
+        )
+        _count(events, epoch, weight, rates, scores)
+        gaps.extend(_find_gaps(last_id, events, expired, seen))
+        if len(events) < EVENTS_BATCH_SIZE:
+            return (events[-1][0] if events else last_id), gaps
+        last_id = events[-1][0]
+
+
+def _rebase(checkpoint, now, rates):
+    """
+    Переносит точку отсчета на now, уменьшая все значения популярности
+    """
+    seconds = (now - checkpoint.epoch).total_seconds()
+    RecipePopularity.objects.update(
+        score=F('score') * math.exp(-rates[0] * seconds),
+        trending_score=F('trending_score') * math.exp(-rates[1] * seconds),
+    )
+    checkpoint.epoch = now
+
+
+def refresh_popularity(full=False):
+    """
+    Обновляет популярность рецептов
+
+    Параметры:
+        full - пересчитать популярность по всем добавлениям
+
+    Возвращает количество обновленных рецептов.
+
+    Отметка обновления изменяется в той же транзакции условным UPDATE по
+    прежней дате обновления; если ее успел изменить параллельный запуск,
+    транзакция откатывается, чтобы добавления не были учтены дважды.
+    """
+    now = timezone.now()
+    rates = (
+        _decay_rate(settings.POPULARITY_HALF_LIFE_DAYS),
+        _decay_rate(settings.POPULARITY_TRENDING_HALF_LIFE_DAYS),
+    )
+    try:
+        with transaction.atomic():
+            checkpoint, _ = PopularityCheckpoint.objects.get_or_create(pk=1)
+            if full:
+                RecipePopularity.objects.all().delete()
+                checkpoint.favorite_id = checkpoint.shopping_list_id = 0
+                checkpoint.favorite_gaps = []
+                checkpoint.shopping_list_gaps = []
+                checkpoint.epoch = now
+            elif now - checkpoint.epoch > timedelta(
+                days=settings.POPULARITY_REBASE_DAYS
+            ):
+                _rebase(checkpoint, now, rates)
+            scores = {}
+            checkpoint.favorite_id, checkpoint.favorite_gaps = _collect(
+                Favorite, checkpoint.favorite_id, checkpoint.favorite_gaps,
+                now, checkpoint.epoch, settings.POPULARITY_FAVORITE_WEIGHT,
+                rates, scores
+            )
+            (
+                checkpoint.shopping_list_id, checkpoint.shopping_list_gaps
+            ) = _collect(
+                ShoppingList, checkpoint.shopping_list_id,
+                checkpoint.shopping_list_gaps, now, checkpoint.epoch,
+                settings.POPULARITY_SHOPPING_CART_WEIGHT, rates, scores
+            )
+            existing = RecipePopularity.objects.in_bulk(scores)
+            created = []
+            for recipe_id, (score, trending, last_event) in scores.items():
+                popularity = existing.get(recipe_id)
+                if popularity is None:
+                    created.append(RecipePopularity(
+                        recipe_id=recipe_id,
+                        score=score,
+                        trending_score=trending,
+                        last_event=last_event,
+                    ))
+                    continue
+                popularity.score += score
+                popularity.trending_score += trending
+                popularity.last_event = max(popularity.last_event, last_event)
+            RecipePopularity.objects.bulk_update(
+                existing.values(),
+                ('score', 'trending_score', 'last_event'),
+                batch_size=1000
+            )
+            # рецепт мог быть удален после выборки добавлений
+            RecipePopularity.objects.bulk_create(
+                created, batch_size=1000, ignore_conflicts=True
+            )
+            updated = PopularityCheckpoint.objects.filter(
+                pk=checkpoint.pk, refreshed=checkpoint.refreshed
+            ).update(
+                favorite_id=checkpoint.favorite_id,
+                shopping_list_id=checkpoint.shopping_list_id,
+                favorite_gaps=checkpoint.favorite_gaps,
+                shopping_list_gaps=checkpoint.shopping_list_gaps,
+                epoch=checkpoint.epoch,
+                refreshed=now,
+            )
+            if not updated:
+                raise CheckpointChanged
+    except CheckpointChanged:
+        return 0
+    return len(scores)
+
+
+def schedule_refresh():
+    """
+    Запускает обновление популярности в фоне
+
+    Обновление запускается не чаще раза в POPULARITY_REFRESH_INTERVAL
+    секунд; время запуска хранится в кеше, поэтому проверка не выполняет
+    запросов к базе. Если фоновые задачи выполняются в потоке запроса
+    (BACKGROUND_TASKS_ASYNC = False, SQLite), обновление не запускается:
+    популярность обновляет команда refresh_popularity, которую нужно
+    запускать периодически.
+    """
+    if settings.BACKGROUND_TASKS_ASYNC and cache.add(
+        REFRESH_SCHEDULED_CACHE_KEY, True,
+        settings.POPULARITY_REFRESH_INTERVAL
+    ):
+        run_in_background(refresh_popularity)
@@ -9,13 +9,29 @@
         IngredientAmountSerializer - сериализатор для ингредиентов
         IngredientSerializer - сериализатор для ингредиентов
         FollowSerializer - сериализатор для подписок
+
+    Функции:
+        get_user_recipe_ids - запрос id рецептов в избранном и списке
+        покупок пользователя и id авторов его подписок
+        group_user_recipe_ids - id из get_user_recipe_ids по ключам
+        контекста RecipeGetSerializer
+        load_user_recipe_ids - те же id в контексте сериализатора одного
+        рецепта
+        get_recipes_limit - ограничение количества рецептов автора
 """
 
+from django.db import transaction
+from django.db.models import Prefetch, Value, prefetch_related_objects
 from rest_framework import serializers
+from api.metrics import TimedListSerializer, TimedSerializerMixin
 from .models import Tag, Recipe, Ingredient
 from users.models import Subscribe
-from users.serializers import UserSerializer
-from recipes.models import IngredientAmount
+from users.serializers import (
+    UserSerializer, needs_subscribed_author_ids, set_subscribed_author_ids
+)
+from recipes.models import Favorite, IngredientAmount, ShoppingList
+from .duplicates import update_signature
+from .services import get_latest_recipes, set_ingredients
 from drf_extra_fields.fields import Base64ImageField
 # Валидатор UniqueTogetherValidator
 from rest_framework.validators import UniqueTogetherValidator
@@ -23,25 +39,123 @@ from rest_framework.validators import UniqueTogetherValidator
 from collections import OrderedDict
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для ингредиентов
     """
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
+        list_serializer_class = TimedListSerializer
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для тегов
     """
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
+        list_serializer_class = TimedListSerializer
+
+
+# связанные объекты, которые выводит RecipeGetSerializer
+RECIPE_PREFETCH = (
+    'author',
+    'tags',
+    Prefetch(
+        'ingredient_amounts',
+        queryset=IngredientAmount.objects.select_related('ingredient')
+    ),
+)
+
+
+class RecipeListSerializer(TimedListSerializer):
+    """
+    Список рецептов для RecipeGetSerializer
+
+    Связанные объекты всех рецептов загружаются по одному запросу на
+    связь, id рецептов из избранного и списка покупок текущего пользователя
+    и id авторов его подписок - одним запросом, только для рецептов списка.
+    Количество запросов не зависит от количества рецептов.
+    """
+
+    def to_representation(self, data):
+        recipes = list(data.all() if hasattr(data, 'all') else data)
+        prefetch_related_objects(recipes, *RECIPE_PREFETCH)
+        request = self.context['request']
+        # асинхронные представления загружают id заранее
+        if (
+            request.user.is_authenticated and recipes
+            and 'favorited_ids' not in self.context
+        ):
+            self.context.update(group_user_recipe_ids(
+                request, get_user_recipe_ids(request, recipes)
+            ))
+        return super().to_representation(recipes)
+
+
+# ключи контекста RecipeGetSerializer и модели, из которых берутся id
+USER_RECIPE_IDS = (
+    ('favorited_ids', Favorite),
+    ('shopping_cart_ids', ShoppingList),
+)
+
+
+def get_user_recipe_ids(request, recipes):
+    """
+    Запрос пар (ключ, id): id рецептов из recipes, которые пользователь
+    запроса добавил в избранное и в список покупок, и id авторов его
+    подписок, если они еще не загружены (users.serializers), - одним
+    запросом UNION ALL вместо запроса на каждую таблицу
+    """
+    ids = [recipe.pk for recipe in recipes]
+    queries = [
+        model.objects.filter(user=request.user, recipe__in=ids).order_by()
+        .annotate(key=Value(key)).values_list('key', 'recipe_id')
+        for key, model in USER_RECIPE_IDS
+    ]
+    if needs_subscribed_author_ids(request):
+        queries.append(
+            Subscribe.objects.filter(user=request.user).order_by()
+            .annotate(key=Value('subscribed_author_ids'))
+            .values_list('key', 'author_id')
+        )
+    return queries[0].union(*queries[1:], all=True)
+
+
+def group_user_recipe_ids(request, pairs):
+    """
+    Раскладывает пары get_user_recipe_ids: id авторов подписок сохраняются
+    в запросе, id рецептов возвращаются словарем для контекста
+    RecipeGetSerializer
+    """
+    groups = {key: set() for key, _ in USER_RECIPE_IDS}
+    author_ids = set()
+    for key, pk in pairs:
+        groups.get(key, author_ids).add(pk)
+    if needs_subscribed_author_ids(request):
+        set_subscribed_author_ids(request, author_ids)
+    return {key: frozenset(ids) for key, ids in groups.items()}
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+def load_user_recipe_ids(context, recipe):
+    """
+    Возвращает контекст сериализатора одного рецепта с id рецептов
+    пользователя (USER_RECIPE_IDS)
+
+    Вне RecipeListSerializer id загружаются одним запросом при первом
+    обращении и сохраняются в контексте.
+    """
+    if 'favorited_ids' not in context:
+        request = context['request']
+        context.update(group_user_recipe_ids(
+            request, get_user_recipe_ids(request, [recipe])
+        ))
+    return context
+
+
+class RecipeGetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для рецептов и метода GET
 
@@ -85,6 +199,7 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
         )
         model = Recipe
+        list_serializer_class = RecipeListSerializer
 
     def get_ingredients(self, obj):
         """
@@ -100,7 +215,7 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             amount - количество ингредиента
         """
 
-        ingredients = IngredientAmount.objects.filter(recipe=obj)
+        ingredients = obj.ingredient_amounts.all()
         return [
             {
                 'id': ingredient.ingredient.id,
@@ -118,7 +233,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
-        return obj.favorites.filter(user=user).exists()
+        ids = load_user_recipe_ids(self.context, obj)['favorited_ids']
+        return obj.pk in ids
 
     def get_is_in_shopping_cart(self, obj):
         """
@@ -128,7 +244,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
-        return obj.shopping_cart.filter(user=user).exists()
+        ids = load_user_recipe_ids(self.context, obj)['shopping_cart_ids']
+        return obj.pk in ids
 
 
 class IngredientAmountSerializer(serializers.ModelSerializer):
@@ -166,7 +283,7 @@ class IngredientRecipeGetSerializer(serializers.ModelSerializer):
         ]
 
 
-class RecipePostSerializer(serializers.ModelSerializer):
+class RecipePostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Recipe и методов отличных от GET
 
@@ -202,9 +319,10 @@ class RecipePostSerializer(serializers.ModelSerializer):
     """
     author = UserSerializer(read_only=True)
     ingredients = IngredientAmountSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
+    # теги проверяются в validate одним запросом, PrimaryKeyRelatedField
+    # выполнял бы запрос на каждый тег
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False
     )
     image = Base64ImageField(max_length=None, use_url=True)
     name = serializers.CharField(max_length=200, required=True)
@@ -212,6 +330,8 @@ class RecipePostSerializer(serializers.ModelSerializer):
     cooking_time = serializers.IntegerField(min_value=1, required=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    # рецепт создан этим сериализатором
+    created = False
 
     class Meta:
         fields = (
@@ -238,6 +358,10 @@ class RecipePostSerializer(serializers.ModelSerializer):
             - названия
             - времени приготовления
         Проверка на наличие тегов и ингредиентов в базе
+
+        Ингредиенты и теги загружаются двумя запросами. Теги заменяются
+        объектами Tag, к ингредиентам добавляется объект Ingredient (ключ
+        ingredient), по ним строится ответ без повторных запросов.
         """
         if 'ingredients' not in data:
             raise serializers.ValidationError(
@@ -259,18 +383,21 @@ class RecipePostSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Необходимо указать время приготовления'
             )
-        if not Ingredient.objects.filter(
-            id__in=[ingredient['id'] for ingredient in data['ingredients']]
-        ).exists():
+        ingredients = Ingredient.objects.in_bulk(
+            [ingredient['id'] for ingredient in data['ingredients']]
+        )
+        if len(ingredients) != len(data['ingredients']):
             raise serializers.ValidationError(
                 'Ингредиенты не найдены'
             )
-        if not Tag.objects.filter(
-            id__in=[tag.id for tag in data['tags']]
-        ).exists():
+        tags = Tag.objects.in_bulk(data['tags'])
+        if len(tags) != len(data['tags']):
             raise serializers.ValidationError(
                 'Теги не найдены'
             )
+        for ingredient in data['ingredients']:
+            ingredient['ingredient'] = ingredients[ingredient['id']]
+        data['tags'] = [tags[pk] for pk in data['tags']]
         return data
 
     def validate_ingredients(self, value):
@@ -292,50 +419,61 @@ class RecipePostSerializer(serializers.ModelSerializer):
         """
         tags = []
         for tag in value:
-            if tag.id in tags:
+            if tag in tags:
                 raise serializers.ValidationError(
                     'Теги не должны повторяться'
                 )
-            tags.append(tag.id)
+            tags.append(tag)
 
         return value
 
     def get_is_favorited(self, obj):
         """
         Возвращает True, если рецепт добавлен в избранное текущим пользователем
+
+        Только что созданного рецепта нет в избранном.
         """
         user = self.context['request'].user
-        if user.is_anonymous:
+        if user.is_anonymous or self.created:
             return False
-        return obj.favorites.filter(user=user).exists()
+        ids = load_user_recipe_ids(self.context, obj)['favorited_ids']
+        return obj.pk in ids
 
     def get_is_in_shopping_cart(self, obj):
         """
         Возвращает True, если рецепт добавлен в список покупок текущим
         пользователем
+
+        Только что созданного рецепта нет в списке покупок.
         """
         user = self.context['request'].user
-        if user.is_anonymous:
+        if user.is_anonymous or self.created:
             return False
-        return obj.shopping_cart.filter(user=user).exists()
+        ids = load_user_recipe_ids(self.context, obj)['shopping_cart_ids']
+        return obj.pk in ids
 
     def create(self, validated_data):
         """
         Создать рецепт
+
+        Рецепт, его теги и ингредиенты записываются в одной транзакции.
         """
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(
-            author=self.context['request'].user,
-            **validated_data
-        )
-        recipe.tags.set(tags)
-        for ingredient in ingredients:
-            IngredientAmount.objects.create(
-                recipe=recipe,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
-                amount=ingredient['amount']
+        with transaction.atomic():
+            recipe = Recipe.objects.create(
+                author=self.context['request'].user,
+                **validated_data
             )
+            # у нового рецепта нет тегов, add не проверяет существующие
+            recipe.tags.add(*tags)
+            set_ingredients(recipe, ingredients)
+        self.created = True
+        recipe.saved_tags = tags
+        recipe.saved_ingredients = ingredients
+        recipe.possible_duplicates = update_signature(
+            recipe, [ingredient['id'] for ingredient in ingredients]
+        )
         return recipe
 
     def update(self, instance, validated_data):
@@ -351,23 +489,27 @@ class RecipePostSerializer(serializers.ModelSerializer):
         name - название рецепта
         text - текст рецепта
         cooking_time - время приготовления
+
+        Ингредиенты рецепта заменяются переданными. Рецепт, его теги и
+        ингредиенты записываются в одной транзакции.
         """
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        instance.tags.set(tags)
         instance.image = validated_data.get('image', instance.image)
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time
         )
-        instance.save()
-        for ingredient in ingredients:
-            IngredientAmount.objects.update_or_create(
-                recipe=instance,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
-                defaults={'amount': ingredient['amount']}
-            )
+        with transaction.atomic():
+            instance.tags.set(tags)
+            instance.save()
+            set_ingredients(instance, ingredients, replace=True)
+        instance.saved_tags = tags
+        instance.saved_ingredients = ingredients
+        instance.possible_duplicates = update_signature(
+            instance, [ingredient['id'] for ingredient in ingredients]
+        )
         return instance
 
     def to_representation(self, instance):
@@ -385,12 +527,29 @@ class RecipePostSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
         representation['id'] = instance.id
 
+        # теги и ингредиенты, записанные create или update, повторно не
+        # загружаются
+        if hasattr(instance, 'saved_ingredients'):
+            ingredients = [
+                IngredientAmount(
+                    ingredient=ingredient['ingredient'],
+                    amount=ingredient['amount']
+                )
+                for ingredient in sorted(
+                    instance.saved_ingredients,
+                    key=lambda ingredient: ingredient['id']
+                )
+            ]
+            tags = sorted(instance.saved_tags, key=lambda tag: tag.pk)
+        else:
+            ingredients = IngredientAmount.objects.filter(
+                recipe=instance
+            ).select_related('ingredient')
+            tags = instance.tags.all()
         representation['ingredients'] = IngredientRecipeGetSerializer(
-            IngredientAmount.objects.filter(recipe=instance), many=True
-        ).data
-        representation['tags'] = TagSerializer(
-            instance.tags, many=True
+            ingredients, many=True
         ).data
+        representation['tags'] = TagSerializer(tags, many=True).data
 
         representation = OrderedDict([
             ('id', representation['id']),
@@ -404,10 +563,20 @@ class RecipePostSerializer(serializers.ModelSerializer):
             ('text', representation['text']),
             ('cooking_time', representation['cooking_time']),
         ])
+        # почти одинаковые рецепты, найденные при создании или изменении
+        if hasattr(instance, 'possible_duplicates'):
+            representation['possible_duplicates'] = [
+                {
+                    'id': recipe.id,
+                    'name': recipe.name,
+                    'similarity': round(recipe.similarity, 2),
+                }
+                for recipe in instance.possible_duplicates
+            ]
         return representation
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
+class ShortRecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
         Сериализатор для модели Recipe для метода GET укороченный
 
@@ -424,10 +593,11 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         fields = ('id', 'name', 'image', 'cooking_time')
         model = Recipe
+        list_serializer_class = TimedListSerializer
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
+class SubscribeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Subscribe
 
@@ -437,7 +607,8 @@ class SubscribeSerializer(serializers.ModelSerializer):
     Параметры запроса:
         page - номер страницы
         limit - количество рецептов на странице
-        recipe_limit - количество рецептов в выдаче пользователя
+        recipes_limit (recipe_limit) - количество рецептов в выдаче
+        пользователя
 
     Поля:
         email - email пользователя
@@ -476,6 +647,7 @@ class SubscribeSerializer(serializers.ModelSerializer):
             'recipes_count',
         )
         model = Subscribe
+        list_serializer_class = TimedListSerializer
 
     def get_is_subscribed(self, obj):
         """
@@ -496,17 +668,17 @@ class SubscribeSerializer(serializers.ModelSerializer):
         Параметры:
             obj - объект пользователя
 
-        Возвращает количество рецептов автора
+        Возвращает количество рецептов автора из счетчика recipes_count
 
 
         """
-        queryset = Recipe.objects.filter(author=obj.author)
-        return queryset.count()
+        return obj.author.recipes_count
 
     def get_recipes(self, obj):
         """
         Метод для получения рецептов авторов на которых подписан пользователь
-        C ограничением по количеству согласно параметру запроса recipe_limit
+        C ограничением по количеству согласно параметру запроса recipes_limit
+        (или recipe_limit)
 
         Параметры:
             obj - объект пользователя
@@ -514,15 +686,34 @@ class SubscribeSerializer(serializers.ModelSerializer):
         Возвращает список рецептов пользователя согласно сериализатору
         ShortRecipeSerializer
 
+        Рецепты берутся из контекста latest_recipes, куда вьюсет загружает
+        рецепты всех авторов страницы одним запросом. Без него рецепты
+        автора загружаются отдельно.
         """
         request = self.context.get('request')
-        quertset = Recipe.objects.filter(author=obj.author)
-        limit = request.query_params.get('recipe_limit')
+        latest_recipes = self.context.get('latest_recipes')
+        if latest_recipes is None:
+            latest_recipes = get_latest_recipes(
+                [obj.author_id], get_recipes_limit(request)
+            )
         serializers = ShortRecipeSerializer(
-            quertset,
+            latest_recipes.get(obj.author_id, []),
             many=True,
             context={'request': request}
         )
-        if limit:
-            return serializers.data[:int(limit)]
         return serializers.data
+
+
+def get_recipes_limit(request):
+    """
+    Возвращает ограничение количества рецептов автора из параметра запроса
+    recipes_limit (или recipe_limit) или None, если ограничения нет
+    """
+    limit = request.query_params.get(
+        'recipes_limit', request.query_params.get('recipe_limit')
+    )
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return None
+    return limit if limit >= 0 else None
@@ -0,0 +1,226 @@
+"""
+Сервисные функции приложения recipes
+
+Функции:
+    bump_shopping_cart_version - увеличивает версию списка покупок
+    пользователей, выбранных по фильтру
+    get_shopping_list - возвращает текст списка покупок пользователя,
+    кешированный по версии корзины
+    change_counter - изменяет счетчик на заданную величину выражением F()
+    recount_recipe_counters - пересчитывает счетчики рецептов
+    recount_user_counters - пересчитывает счетчики пользователей
+    get_latest_recipes - последние рецепты нескольких авторов одним запросом
+    set_ingredients - записывает ингредиенты рецепта пакетом
+
+Сигналы:
+    ingredients_changed - ингредиенты рецепта записаны set_ingredients,
+    аргументы recipe_id - id рецепта, created - рецепт новый
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from collections import defaultdict
+
+from django.db import connections, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.dispatch import Signal
+
+from api.metrics import inc
+from users.models import Subscribe
+from .models import Favorite, IngredientAmount, Recipe, ShoppingList
+
+User = get_user_model()
+
+SHOPPING_LIST_CACHE_KEY = 'shopping_list:{user_id}:{version}'
+
+ingredients_changed = Signal()
+
+# поля рецепта для краткого вывода (ShortRecipeSerializer), без text
+SHORT_RECIPE_FIELDS = (
+    'id', 'author_id', 'name', 'image', 'cooking_time', 'pub_date'
+)
+
+
+def bump_shopping_cart_version(**filters):
+    """
+    Увеличивает версию списка покупок пользователей
+
+    Параметры:
+        filters - фильтр по модели пользователя, например pk=1 или
+        shopping_cart__recipe=5 (все пользователи, у которых рецепт в корзине)
+
+    Версия входит в ETag и ключ кеша списка покупок, поэтому после
+    увеличения версии старые ответы и кеш больше не используются.
+    """
+    User.objects.filter(**filters).update(
+        shopping_cart_version=F('shopping_cart_version') + 1
+    )
+
+
+def get_shopping_list(user):
+    """
+    Возвращает текст списка покупок пользователя
+
+    Текст кешируется по ключу (пользователь, версия корзины), поэтому
+    повторные запросы неизменённой корзины не выполняют агрегацию.
+    Пустая строка означает, что список покупок пуст.
+    """
+    key = SHOPPING_LIST_CACHE_KEY.format(
+        user_id=user.pk,
+        version=user.shopping_cart_version
+    )
+    shopping_list = cache.get(key)
+    if shopping_list is not None:
+        inc('cache_requests_total', 'shopping_list', 'hit')
+        return shopping_list
+    inc('cache_requests_total', 'shopping_list', 'miss')
+    ingredients = IngredientAmount.objects.filter(
+        recipe__shopping_cart__user=user).values(
+        'ingredient__name', 'ingredient__measurement_unit').annotate(
+        total_amount=Sum('amount')).order_by('ingredient__name')
+    shopping_list = '\r'.join(
+        f'{item["ingredient__name"]} - {item["total_amount"]}' +
+        f' {item["ingredient__measurement_unit"]}'
+        for item in ingredients
+    )
+    cache.set(key, shopping_list, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    return shopping_list
+
+
+def change_counter(model, field, delta, **filters):
+    """
+    Изменяет счетчик field у объектов model, выбранных по фильтру
+
+    Изменение выполняется одним запросом UPDATE с выражением F(), поэтому
+    параллельные изменения не теряются. Уменьшение не опускает счетчик
+    ниже нуля, даже если он разошелся с данными.
+    """
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    model.objects.filter(**filters).update(**{field: value})
+
+
+def _count(model, field):
+    """
+    Подзапрос с количеством строк model, ссылающихся на объект полем field
+    """
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0
+    )
+
+
+def recount_recipe_counters(**filters):
+    """
+    Пересчитывает favorites_count и shopping_cart_count рецептов,
+    выбранных по фильтру, одним запросом UPDATE
+    """
+    return Recipe.objects.filter(**filters).update(
+        favorites_count=_count(Favorite, 'recipe'),
+        shopping_cart_count=_count(ShoppingList, 'recipe'),
+    )
+
+
+def recount_user_counters(**filters):
+    """
+    Пересчитывает recipes_count и followers_count пользователей,
+    выбранных по фильтру, одним запросом UPDATE
+    """
+    return User.objects.filter(**filters).update(
+        recipes_count=_count(Recipe, 'author'),
+        followers_count=_count(Subscribe, 'author'),
+    )
+
+
+def get_latest_recipes(author_ids, limit=None):
+    """
+    Возвращает последние рецепты авторов
+
+    Параметры:
+        author_ids - список id авторов
+        limit - количество рецептов каждого автора, None - все рецепты
+
+    Возвращает словарь {id автора: [рецепты от новых к старым]}.
+
+    Рецепты всех авторов выбираются одним запросом. С ограничением limit
+    рецепты нумеруются оконной функцией ROW_NUMBER() в разрезе автора и
+    отбираются в базе, поэтому лишние рецепты не загружаются. Загружаются
+    только поля SHORT_RECIPE_FIELDS, текст рецепта не загружается.
+    """
+    recipes = Recipe.objects.filter(author__in=author_ids).only(
+        *SHORT_RECIPE_FIELDS
+    ).order_by('author', '-pub_date', '-pk')
+    if limit is not None:
+        # фильтр по оконной функции в Django 4.1 возможен только во внешнем
+        # запросе, поэтому запрос с нумерацией оборачивается в подзапрос
+        ranked = recipes.annotate(
+            recipe_rank=Window(
+                RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('pk').desc())
+            )
+        ).order_by()
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked_recipes '
+            'WHERE recipe_rank <= %s ORDER BY author_id, recipe_rank',
+            (*params, limit)
+        )
+    latest = defaultdict(list)
+    for recipe in recipes:
+        latest[recipe.author_id].append(recipe)
+    return latest
+
+
+def set_ingredients(recipe, ingredients, replace=False):
+    """
+    Записывает ингредиенты рецепта
+
+    Параметры:
+        recipe - рецепт
+        ingredients - список словарей {'id': id ингредиента, 'amount': ...}
+        replace - заменить прежние ингредиенты рецепта, без replace
+        ингредиенты записываются новому рецепту
+
+    Прежние ингредиенты удаляются одним запросом DELETE через курсор:
+    QuerySet.delete() загрузил бы строки и отправил post_delete на каждую.
+    Новые создаются одним запросом bulk_create. После записи один раз
+    отправляется сигнал ingredients_changed, поэтому количество запросов не
+    зависит от количества ингредиентов. Внутри транзакции вызывающего кода
+    точка сохранения не создается.
+    """
+    using = router.db_for_write(IngredientAmount)
+    connection = connections[using]
+    with transaction.atomic(using=using, savepoint=False):
+        if replace:
+            qn = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM {table} WHERE {recipe} = %s'.format(
+                        table=qn(IngredientAmount._meta.db_table),
+                        recipe=qn(
+                            IngredientAmount._meta.get_field('recipe').column
+                        ),
+                    ),
+                    [recipe.pk]
+                )
+        IngredientAmount.objects.using(using).bulk_create(
+            IngredientAmount(
+                recipe=recipe,
+                ingredient_id=ingredient['id'],
+                amount=ingredient['amount']
+            )
+            for ingredient in ingredients
+        )
+    ingredients_changed.send(
+        sender=Recipe, recipe_id=recipe.pk, created=not replace
+    )
@@ -0,0 +1,144 @@
+"""
+Сигналы приложения recipes
+
+Изменение ингредиентов рецепта или удаление рецепта меняет список покупок
+всех пользователей, у которых этот рецепт в корзине, поэтому версия их
+корзины увеличивается.
+
+Изменения самой корзины (ShoppingList) и избранного (Favorite) приходят
+сигналом relations_changed от api.relations, а не post_save/post_delete,
+чтобы удаление оставалось одним запросом DELETE. По этому сигналу
+обновляются счетчики рецептов favorites_count и shopping_cart_count.
+
+Создание и удаление рецепта изменяет счетчик recipes_count автора.
+
+Новый рецепт в фоне раскладывается в ленты подписчиков автора, при подписке
+в ленту добавляются последние рецепты автора, при отписке - удаляются.
+Если после отписки или удаления подписчика у автора осталось
+FEED_FANOUT_MAX_FOLLOWERS подписчиков, его последние рецепты в фоне
+добавляются в ленты всех подписчиков (recipes.feed). Счетчик
+followers_count к этому времени уже уменьшен: сигналы users подключаются
+раньше (порядок INSTALLED_APPS).
+
+Рецепт с измененными ингредиентами (в фоне, после фиксации транзакции) и
+рецепты, у которых удаляемый рецепт среди похожих, добавляются в очередь
+пересчета похожих рецептов и обновляются в индексе поиска по имеющимся
+ингредиентам. Ингредиенты,
+записанные пакетом (services.set_ingredients), приходят одним сигналом
+ingredients_changed на рецепт.
+"""
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from api.relations import relations_changed
+from users.models import CustomUser, Subscribe
+from .feed import (
+    backfill_feed, backfill_followers, fan_out_recipe, remove_from_feed
+)
+from .models import (
+    Favorite, Ingredient, IngredientAmount, Recipe, ShoppingList,
+    SimilarRecipe
+)
+from .pantry import pantry_index
+from .services import (
+    bump_shopping_cart_version, change_counter, ingredients_changed
+)
+from .similar import enqueue as enqueue_similar
+from .tasks import run_in_background
+
+
+@receiver(relations_changed, sender=Favorite)
+def favorites_changed(sender, ids, created, **kwargs):
+    change_counter(
+        Recipe, 'favorites_count', 1 if created else -1, pk__in=ids
+    )
+
+
+@receiver(relations_changed, sender=ShoppingList)
+def shopping_cart_changed(sender, user, ids, created, **kwargs):
+    bump_shopping_cart_version(pk=user.pk)
+    change_counter(
+        Recipe, 'shopping_cart_count', 1 if created else -1, pk__in=ids
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    if created:
+        change_counter(CustomUser, 'recipes_count', 1, pk=instance.author_id)
+        run_in_background(fan_out_recipe, instance.pk)
+
+
+@receiver(relations_changed, sender=Subscribe)
+def subscriptions_changed(sender, user, ids, created, **kwargs):
+    if created:
+        run_in_background(backfill_feed, user.pk, ids)
+    else:
+        remove_from_feed(user.pk, ids)
+        _back_to_fan_out(pk__in=ids)
+
+
+def _back_to_fan_out(**filters):
+    """
+    Запускает backfill_followers для авторов, выбранных по фильтру, у
+    которых подписчиков стало FEED_FANOUT_MAX_FOLLOWERS
+    """
+    author_ids = list(CustomUser.objects.filter(
+        followers_count=settings.FEED_FANOUT_MAX_FOLLOWERS, **filters
+    ).values_list('pk', flat=True))
+    if author_ids:
+        run_in_background(backfill_followers, author_ids)
+
+
+@receiver(pre_delete, sender=CustomUser)
+def subscriber_deleted(sender, instance, **kwargs):
+    _back_to_fan_out(following__user=instance)
+
+
+@receiver(ingredients_changed, sender=Recipe)
+def recipe_ingredients_changed(sender, recipe_id, created=False, **kwargs):
+    # нового рецепта нет ни в одной корзине
+    if not created:
+        bump_shopping_cart_version(shopping_cart__recipe=recipe_id)
+    pantry_index.invalidate(recipe_id)
+    run_in_background(enqueue_similar, [recipe_id])
+
+
+@receiver(post_save, sender=IngredientAmount)
+@receiver(post_delete, sender=IngredientAmount)
+def ingredient_amount_changed(sender, instance, **kwargs):
+    # при удалении самого рецепта (объекта или QuerySet) ингредиенты
+    # удаляются каскадно, версии корзин уже увеличены в recipe_deleted
+    origin = kwargs.get('origin')
+    if (
+        isinstance(origin, Recipe)
+        or getattr(origin, 'model', None) is Recipe
+    ):
+        pantry_index.invalidate(instance.recipe_id)
+        return
+    recipe_ingredients_changed(Recipe, instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_changed(sender, instance, created, **kwargs):
+    if not created:
+        bump_shopping_cart_version(
+            shopping_cart__recipe__ingredients=instance
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    bump_shopping_cart_version(shopping_cart__recipe=instance)
+    enqueue_similar(
+        SimilarRecipe.objects.filter(similar=instance).values_list(
+            'recipe_id', flat=True
+        )
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed(sender, instance, **kwargs):
+    change_counter(CustomUser, 'recipes_count', -1, pk=instance.author_id)
@@ -0,0 +1,455 @@
+"""
+Похожие рецепты
+
+Рецепт представлен разреженным вектором TF-IDF по ингредиентам: вес
+ингредиента равен idf = ln((1 + n) / (1 + df)) + 1, где n - количество
+рецептов, df - количество рецептов с этим ингредиентом. Вектор делится на
+свою норму, поэтому скалярное произведение векторов дает косинусное
+сходство рецептов. Веса хранятся в таблице IngredientWeight, нормы
+векторов - в RecipeVector: вместе с ингредиентами рецептов они задают
+нормированную матрицу, и пересчет одного рецепта не читает остальные.
+
+Результат хранится в таблице SimilarRecipe, запрос похожих рецептов - одно
+чтение по индексу (recipe, -score).
+
+При изменении ингредиентов рецепт добавляется в очередь SimilarRecipeQueue.
+Очередь обрабатывается пакетами по SIMILAR_RECIPES_QUEUE_BATCH_SIZE
+рецептов: у рецептов пакета пересчитываются нормы и похожие, сходство
+вычисляется только с рецептами, у которых есть общие ингредиенты (чтение
+IngredientAmount по индексу ingredient). Также пересчитываются похожие
+рецептов, у которых рецепты пакета были среди похожих, а рецепты, к
+которым рецепты пакета стали ближе последнего из похожих (или у которых
+похожих меньше SIMILAR_RECIPES_COUNT), получают их в свой список. Веса idf
+при этом не меняются, веса новых ингредиентов вычисляются при первом
+использовании. Полный пересчет весов, норм и похожих выполняет команда
+refresh_similar_recipes --full.
+
+Пересчет очереди запускается в пуле фоновых задач один раз на серию
+изменений. Если фоновые задачи выполняются в потоке запроса
+(BACKGROUND_TASKS_ASYNC = False, SQLite), запрос только добавляет рецепт в
+очередь, а очередь обрабатывает команда refresh_similar_recipes, которую
+нужно запускать периодически.
+
+Функции:
+    refresh_similar - пересчитать похожие рецепты из очереди или все
+    enqueue - добавить рецепты в очередь и запустить пересчет в фоне
+    get_similar - похожие рецепты рецепта
+"""
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Value
+from django.db.models.functions import Coalesce
+from scipy import sparse
+
+from .models import (
+    IngredientAmount, IngredientWeight, Recipe, RecipeVector, SimilarRecipe,
+    SimilarRecipeQueue
+)
+from .services import SHORT_RECIPE_FIELDS
+from .tasks import run_in_background
+
+REFRESH_SCHEDULED_CACHE_KEY = 'similar_recipes_refresh_scheduled'
+# время, после которого пересчет запускается снова, если фоновая задача
+# не была выполнена
+REFRESH_SCHEDULED_TIMEOUT = 60 * 10
+# наибольшее количество id в одном условии IN
+IN_BATCH_SIZE = 500
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), IN_BATCH_SIZE):
+        yield ids[start:start + IN_BATCH_SIZE]
+
+
+def _idf(recipe_count, document_frequency):
+    return np.log((1 + recipe_count) / (1 + document_frequency)) + 1
+
+
+def _load_pairs(with_norms=False, **filters):
+    """
+    Массив пар (id рецепта, id ингредиента) IngredientAmount
+
+    С with_norms возвращает также массив норм векторов рецептов пар из
+    RecipeVector (0, если нормы нет).
+    """
+    queryset = IngredientAmount.objects.filter(**filters).order_by()
+    if not with_norms:
+        return np.array(
+            queryset.values_list('recipe_id', 'ingredient_id'),
+            dtype=np.int64
+        ).reshape(-1, 2)
+    rows = np.array(
+        queryset.values_list(
+            'recipe_id', 'ingredient_id',
+            Coalesce('recipe__vector__norm', Value(0.0))
+        ),
+        dtype=float
+    ).reshape(-1, 3)
+    return rows[:, :2].astype(np.int64), rows[:, 2]
+
+
+def _get_weights(ingredient_ids):
+    """
+    Веса ингредиентов ingredient_ids: массив в порядке ingredient_ids
+
+    Веса ингредиентов, которых нет в IngredientWeight, вычисляются по
+    текущим данным и сохраняются.
+    """
+    weights = dict(
+        IngredientWeight.objects.filter(
+            ingredient__in=ingredient_ids.tolist()
+        ).values_list('ingredient_id', 'idf')
+    )
+    missing = [pk for pk in ingredient_ids.tolist() if pk not in weights]
+    if missing:
+        recipe_count = Recipe.objects.count()
+        frequency = dict(
+            IngredientAmount.objects.filter(
+                ingredient__in=missing
+            ).order_by().values('ingredient_id').annotate(
+                total=Count('pk')
+            ).values_list('ingredient_id', 'total')
+        )
+        created = [
+            IngredientWeight(
+                ingredient_id=pk,
+                idf=float(_idf(recipe_count, frequency.get(pk, 0)))
+            )
+            for pk in missing
+        ]
+        IngredientWeight.objects.bulk_create(created, ignore_conflicts=True)
+        weights.update(
+            (weight.ingredient_id, weight.idf) for weight in created
+        )
+    return np.array([weights[pk] for pk in ingredient_ids.tolist()])
+
+
+def _save_norms(recipe_ids):
+    """
+    Вычисляет и сохраняет нормы векторов рецептов recipe_ids
+
+    Возвращает {id рецепта: норма}; у рецептов без ингредиентов вектора
+    нет.
+    """
+    pairs = _load_pairs(recipe__in=recipe_ids)
+    ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    ingredient_ids, columns = np.unique(pairs[:, 1], return_inverse=True)
+    weights = _get_weights(ingredient_ids)
+    norms = np.sqrt(
+        np.bincount(rows, weights=weights[columns] ** 2, minlength=len(ids))
+    )
+    norms = dict(zip(ids.tolist(), norms.tolist()))
+    RecipeVector.objects.filter(recipe__in=recipe_ids).exclude(
+        recipe__in=list(norms)
+    ).delete()
+    RecipeVector.objects.bulk_create(
+        [RecipeVector(recipe_id=pk, norm=norm) for pk, norm in norms.items()],
+        update_conflicts=True,
+        unique_fields=['recipe'],
+        update_fields=['norm'],
+    )
+    return norms
+
+
+def _get_norms(recipe_ids):
+    """
+    Нормы векторов рецептов recipe_ids: массив в порядке recipe_ids
+
+    Нормы рецептов, которых нет в RecipeVector, вычисляются и
+    сохраняются.
+    """
+    norms = {}
+    for chunk in _chunks(recipe_ids.tolist()):
+        norms.update(
+            RecipeVector.objects.filter(recipe__in=chunk).values_list(
+                'recipe_id', 'norm'
+            )
+        )
+    missing = [pk for pk in recipe_ids.tolist() if pk not in norms]
+    for chunk in _chunks(missing):
+        norms.update(_save_norms(chunk))
+    return np.array([norms[pk] for pk in recipe_ids.tolist()])
+
+
+def _top_similar(scores, row_ids, column_ids, count):
+    """
+    Возвращает похожие рецепты по матрице сходства scores
+
+    Строки scores - рецепты row_ids, столбцы - рецепты column_ids.
+    Результат - список объектов SimilarRecipe, по count наибольших
+    значений сходства в каждой строке, без самого рецепта.
+    """
+    similar = []
+    for index, recipe_id in enumerate(row_ids.tolist()):
+        begin, end = scores.indptr[index], scores.indptr[index + 1]
+        columns = scores.indices[begin:end]
+        values = scores.data[begin:end]
+        keep = column_ids[columns] != recipe_id
+        columns, values = columns[keep], values[keep]
+        if len(values) > count:
+            top = np.argpartition(-values, count)[:count]
+            columns, values = columns[top], values[top]
+        similar.extend(
+            SimilarRecipe(
+                recipe_id=recipe_id,
+                similar_id=similar_id,
+                score=value,
+            )
+            for similar_id, value in zip(
+                column_ids[columns].tolist(), values.tolist()
+            )
+        )
+    return similar
+
+
+def _score(recipe_ids):
+    """
+    Сходство рецептов recipe_ids с рецептами, у которых есть общие с ними
+    ингредиенты
+
+    Возвращает (id рецептов строк, id рецептов столбцов, матрица
+    сходства); рецепты без ингредиентов в строки не попадают.
+    """
+    own, own_norms = _load_pairs(True, recipe__in=recipe_ids)
+    ingredient_ids = np.unique(own[:, 1])
+    loaded = [
+        _load_pairs(True, ingredient__in=chunk)
+        for chunk in _chunks(ingredient_ids.tolist())
+    ] or [(own, own_norms)]
+    pairs = np.concatenate([pairs for pairs, _ in loaded])
+    norms = np.concatenate([norms for _, norms in loaded])
+    weights = _get_weights(ingredient_ids)
+
+    def normalized(pairs, norms):
+        ids, first, rows = np.unique(
+            pairs[:, 0], return_index=True, return_inverse=True
+        )
+        norms = norms[first]
+        missing = norms == 0
+        if missing.any():
+            norms[missing] = _get_norms(ids[missing])
+        columns = np.searchsorted(ingredient_ids, pairs[:, 1])
+        matrix = sparse.csr_matrix(
+            (weights[columns] / norms[rows], (rows, columns)),
+            shape=(len(ids), len(ingredient_ids))
+        )
+        return ids, matrix
+
+    row_ids, rows = normalized(own, own_norms)
+    column_ids, columns = normalized(pairs, norms)
+    return row_ids, column_ids, sparse.csr_matrix(rows @ columns.T)
+
+
+def _refresh_rows(recipe_ids, count):
+    """
+    Похожие рецептов recipe_ids по сохраненным весам и нормам
+    """
+    row_ids, column_ids, scores = _score(recipe_ids)
+    return _top_similar(scores, row_ids, column_ids, count)
+
+
+def _refresh_full(count):
+    """
+    Пересчитывает веса, нормы и похожие всех рецептов
+    """
+    pairs = _load_pairs()
+    recipe_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    ingredient_ids, columns = np.unique(pairs[:, 1], return_inverse=True)
+    idf = _idf(
+        len(recipe_ids), np.bincount(columns, minlength=len(ingredient_ids))
+    )
+    matrix = sparse.csr_matrix(
+        (idf[columns], (rows, columns)),
+        shape=(len(recipe_ids), len(ingredient_ids))
+    )
+    norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+    matrix = sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+    similar = []
+    batch_size = settings.SIMILAR_RECIPES_BATCH_SIZE
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = slice(start, start + batch_size)
+        similar.extend(_top_similar(
+            sparse.csr_matrix(matrix[batch] @ matrix.T),
+            recipe_ids[batch], recipe_ids, count
+        ))
+    with transaction.atomic():
+        IngredientWeight.objects.all().delete()
+        IngredientWeight.objects.bulk_create(
+            [
+                IngredientWeight(ingredient_id=pk, idf=weight)
+                for pk, weight in zip(ingredient_ids.tolist(), idf.tolist())
+            ],
+            batch_size=1000
+        )
+        RecipeVector.objects.all().delete()
+        RecipeVector.objects.bulk_create(
+            [
+                RecipeVector(recipe_id=pk, norm=norm)
+                for pk, norm in zip(recipe_ids.tolist(), norms.tolist())
+            ],
+            batch_size=1000
+        )
+        SimilarRecipe.objects.all().delete()
+        SimilarRecipeQueue.objects.all().delete()
+        # рецепт мог быть удален после чтения ингредиентов
+        SimilarRecipe.objects.bulk_create(
+            similar, batch_size=1000, ignore_conflicts=True
+        )
+    return len(recipe_ids)
+
+
+def _merge(row_ids, column_ids, scores, skip, count):
+    """
+    Добавляет рецепты row_ids в списки похожих рецептов column_ids, к
+    которым они ближе последнего из похожих
+
+    Рецепты skip пропускаются. Возвращает (id рецептов с новыми
+    списками, новые объекты SimilarRecipe).
+    """
+    scores = sparse.coo_matrix(scores)
+    offers = {}
+    for row, column, value in zip(
+        scores.row.tolist(), scores.col.tolist(), scores.data.tolist()
+    ):
+        recipe_id = int(column_ids[column])
+        if recipe_id not in skip and recipe_id != row_ids[row]:
+            offers.setdefault(recipe_id, []).append(
+                (value, int(row_ids[row]))
+            )
+    changed = []
+    for chunk in _chunks(offers):
+        lowest = {
+            recipe_id: (total, threshold)
+            for recipe_id, total, threshold in SimilarRecipe.objects.filter(
+                recipe__in=chunk
+            ).order_by().values('recipe_id').annotate(
+                total=Count('pk'), threshold=Min('score')
+            ).values_list('recipe_id', 'total', 'threshold')
+        }
+        for recipe_id in chunk:
+            total, threshold = lowest.get(recipe_id, (0, 0.0))
+            if total < count or max(offers[recipe_id])[0] > threshold:
+                changed.append(recipe_id)
+    similar = []
+    for chunk in _chunks(changed):
+        current = {}
+        for recipe_id, similar_id, score in SimilarRecipe.objects.filter(
+            recipe__in=chunk
+        ).values_list('recipe_id', 'similar_id', 'score'):
+            current.setdefault(recipe_id, {})[similar_id] = score
+        for recipe_id in chunk:
+            candidates = current.get(recipe_id, {})
+            candidates.update(
+                (similar_id, score)
+                for score, similar_id in offers[recipe_id]
+            )
+            similar.extend(
+                SimilarRecipe(
+                    recipe_id=recipe_id, similar_id=similar_id, score=score
+                )
+                for similar_id, score in sorted(
+                    candidates.items(), key=lambda item: -item[1]
+                )[:count]
+            )
+    return changed, similar
+
+
+def _refresh_queued(queued, count):
+    """
+    Пересчитывает похожие после изменения рецептов queued
+
+    Возвращает количество рецептов с пересчитанными списками.
+    """
+    with transaction.atomic():
+        SimilarRecipeQueue.objects.filter(pk__in=queued).delete()
+        _save_norms(queued)
+        row_ids, column_ids, scores = _score(queued)
+        similar = _top_similar(scores, row_ids, column_ids, count)
+        # списки, где рецепт из очереди мог стать дальше или исчезнуть,
+        # пересчитываются полностью
+        dependents = set(
+            SimilarRecipe.objects.filter(similar__in=queued).values_list(
+                'recipe_id', flat=True
+            )
+        ) - set(queued)
+        for chunk in _chunks(dependents):
+            similar.extend(_refresh_rows(chunk, count))
+        merged, merged_similar = _merge(
+            row_ids, column_ids, scores, set(queued) | dependents, count
+        )
+        similar.extend(merged_similar)
+        refreshed = set(queued) | dependents | set(merged)
+        for chunk in _chunks(refreshed):
+            SimilarRecipe.objects.filter(recipe__in=chunk).delete()
+        # рецепт мог быть удален после чтения ингредиентов
+        SimilarRecipe.objects.bulk_create(
+            similar, batch_size=1000, ignore_conflicts=True
+        )
+    return len(refreshed)
+
+
+def refresh_similar(full=False):
+    """
+    Пересчитывает похожие рецепты
+
+    Параметры:
+        full - пересчитать веса, нормы и похожие всех рецептов
+
+    Без full обрабатывает очередь SimilarRecipeQueue пакетами, каждый
+    пакет - в отдельной транзакции. Возвращает количество рецептов с
+    пересчитанными списками.
+    """
+    cache.delete(REFRESH_SCHEDULED_CACHE_KEY)
+    count = settings.SIMILAR_RECIPES_COUNT
+    if full:
+        return _refresh_full(count)
+    refreshed = 0
+    while True:
+        queued = list(
+            SimilarRecipeQueue.objects.order_by('pk').values_list(
+                'pk', flat=True
+            )[:settings.SIMILAR_RECIPES_QUEUE_BATCH_SIZE]
+        )
+        if not queued:
+            return refreshed
+        refreshed += _refresh_queued(queued, count)
+
+
+def enqueue(recipe_ids):
+    """
+    Добавляет рецепты в очередь пересчета похожих
+
+    Пересчет запускается в пуле фоновых задач, если он еще не
+    запланирован; задача снимает отметку перед чтением очереди, поэтому
+    рецепты, добавленные во время пересчета, запускают его снова. Если
+    фоновые задачи выполняются в потоке запроса, очередь обрабатывает
+    команда refresh_similar_recipes.
+    """
+    SimilarRecipeQueue.objects.bulk_create(
+        [SimilarRecipeQueue(recipe_id=pk) for pk in recipe_ids],
+        ignore_conflicts=True
+    )
+    if settings.BACKGROUND_TASKS_ASYNC and cache.add(
+        REFRESH_SCHEDULED_CACHE_KEY, True, REFRESH_SCHEDULED_TIMEOUT
+    ):
+        run_in_background(refresh_similar)
+
+
+def get_similar(recipe_id):
+    """
+    Возвращает похожие рецепты от более похожих к менее похожим
+
+    Загружаются только поля SHORT_RECIPE_FIELDS.
+    """
+    return [
+        item.similar for item in SimilarRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).select_related('similar').only(
+            'similar_id', *(f'similar__{field}' for field in
+                            SHORT_RECIPE_FIELDS)
+        ).order_by('-score')
+    ]
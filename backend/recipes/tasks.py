@@ -0,0 +1,76 @@
+"""
+Фоновые задачи приложения recipes
+
+Задачи запускаются после фиксации транзакции, в которой они поставлены,
+в пуле потоков процесса. Если BACKGROUND_TASKS_ASYNC = False, задачи
+выполняются сразу после фиксации в том же потоке (удобно для отладки).
+
+Функции:
+    run_in_background - поставить задачу на выполнение после фиксации
+    транзакции
+    in_background - выполняется ли в текущем потоке фоновая задача
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_state = threading.local()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_TASKS_WORKERS,
+            thread_name_prefix='recipes-tasks',
+        )
+    return _executor
+
+
+def _run(func, args):
+    active = in_background()
+    _state.active = True
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background task %s failed', func.__name__)
+    finally:
+        _state.active = active
+
+
+def in_background():
+    """
+    Возвращает True внутри фоновой задачи
+
+    При BACKGROUND_TASKS_ASYNC = False задачи выполняются в потоке
+    запроса, по этому признаку их запросы к базе отделяются от запросов
+    самого обработчика.
+    """
+    return getattr(_state, 'active', False)
+
+
+def _run_in_thread(func, args):
+    try:
+        _run(func, args)
+    finally:
+        # соединения с базой привязаны к потоку, закрываем их после задачи
+        connections.close_all()
+
+
+def run_in_background(func, *args):
+    """
+    Выполнить func(*args) после фиксации текущей транзакции
+    """
+    def submit():
+        if settings.BACKGROUND_TASKS_ASYNC:
+            _get_executor().submit(_run_in_thread, func, args)
+        else:
+            _run(func, args)
+    transaction.on_commit(submit)
@@ -0,0 +1,440 @@
+"""
+Тесты приложения recipes
+
+Классы:
+    RecipeAdminChangelistTest - количество запросов списка рецептов в
+    админке
+    RecipePermissionsTest - права доступа к действиям RecipeViewSet
+    DownloadShoppingCartTest - условная загрузка списка покупок по ETag
+    PantrySearchTest - поиск рецептов по имеющимся ингредиентам
+    FeedTest - страницы ленты подписок, отписка и авторы с большим
+    количеством подписчиков
+"""
+
+import base64
+import tempfile
+from unittest import mock
+
+from django.contrib import admin
+from datetime import datetime, timezone
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .management.commands.generate_fake_data import IMAGE_CONTENT
+from .feed import backfill_feed, fan_out_recipe
+from .models import FeedEntry, Ingredient, IngredientAmount, Recipe, Tag
+from .pantry import pantry_index
+from .services import set_ingredients
+
+User = get_user_model()
+
+IMAGE = 'data:image/png;base64,' + base64.b64encode(IMAGE_CONTENT).decode()
+
+
+class RecipeAdminChangelistTest(TestCase):
+    """
+    Список рецептов в админке загружается постоянным количеством запросов
+
+    Автор, ингредиенты и теги рецептов страницы загружаются вместе со
+    списком (RecipeAdmin.get_queryset), поиск по ингредиентам и тегам
+    выполняется подзапросами EXISTS, поэтому количество запросов не
+    зависит от размера страницы.
+    """
+    # сессия, пользователь, теги фильтра, количество рецептов, рецепты
+    # страницы, ингредиенты и теги страницы, два запроса date_hierarchy
+    queries = 9
+    recipes = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin',
+            first_name='Админ', last_name='Админов'
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(10)
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag-{number}')
+            for number in range(3)
+        )
+        for number in range(cls.recipes):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipe_images/recipe.png'
+            )
+            IngredientAmount.objects.bulk_create(
+                IngredientAmount(
+                    recipe=recipe,
+                    ingredient=ingredients[(number + shift) % 10],
+                    amount=shift + 1
+                )
+                for shift in range(3)
+            )
+            recipe.tags.add(tags[number % 3], tags[(number + 1) % 3])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get_changelist(self, per_page, **params):
+        model_admin = admin.site._registry[Recipe]
+        with mock.patch.object(model_admin, 'list_per_page', per_page):
+            response = self.client.get(
+                reverse('admin:recipes_recipe_changelist'), params
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_changelist(self):
+        for per_page in (5, 25):
+            with self.subTest(per_page=per_page):
+                with self.assertNumQueries(self.queries):
+                    changelist = self.get_changelist(per_page)
+                self.assertEqual(len(changelist.result_list), per_page)
+
+    def test_search(self):
+        # ингредиент 1 есть в 9 рецептах из 30
+        for per_page, count in ((5, 5), (25, 9)):
+            with self.subTest(per_page=per_page):
+                with self.assertNumQueries(self.queries):
+                    changelist = self.get_changelist(
+                        per_page, q='"Ингредиент 1"'
+                    )
+                self.assertEqual(changelist.result_count, 9)
+                self.assertEqual(len(changelist.result_list), count)
+
+
+class RecipePermissionsTest(TestCase):
+    """
+    Изменять рецепт может только его автор, создавать рецепты и читать
+    ленту - только авторизованный пользователь
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.other = User.objects.bulk_create(
+            User(username=name, email=f'{name}@example.com',
+                 first_name=name, last_name=name)
+            for name in ('author', 'other')
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст',
+            cooking_time=10, image='recipe_images/recipe.png'
+        )
+
+    def test_anonymous(self):
+        detail = f'/api/recipes/{self.recipe.pk}/'
+        for method, url in (
+            ('post', '/api/recipes/'),
+            ('patch', detail),
+            ('delete', detail),
+            ('get', '/api/recipes/feed/'),
+        ):
+            with self.subTest(method=method, url=url):
+                response = getattr(self.client, method)(url)
+                self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get(detail).status_code, 200)
+
+    def test_not_author(self):
+        token, _ = Token.objects.get_or_create(user=self.other)
+        detail = f'/api/recipes/{self.recipe.pk}/'
+        for method in ('patch', 'delete'):
+            with self.subTest(method=method):
+                response = getattr(self.client, method)(
+                    detail, {'name': 'Чужой рецепт'},
+                    content_type='application/json',
+                    HTTP_AUTHORIZATION=f'Token {token.key}'
+                )
+                self.assertEqual(response.status_code, 403)
+        self.assertTrue(Recipe.objects.filter(
+            pk=self.recipe.pk, name='Рецепт'
+        ).exists())
+
+
+def token_client(user):
+    """
+    Клиент API с токеном пользователя: пользователь загружается из базы
+    на каждый запрос, как у клиентов API
+    """
+    token, _ = Token.objects.get_or_create(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+class DownloadShoppingCartTest(TestCase):
+    """
+    ETag списка покупок меняется вместе с версией корзины
+
+    На запрос с прежним ETag в If-None-Match возвращается 304, пока не
+    изменились корзина или рецепты в ней.
+    """
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.user = User.objects.bulk_create(
+            User(username=name, email=f'{name}@example.com',
+                 first_name=name, last_name=name)
+            for name in ('author', 'user')
+        )
+        cls.sugar, cls.milk = Ingredient.objects.bulk_create([
+            Ingredient(name='Сахар', measurement_unit='г'),
+            Ingredient(name='Молоко', measurement_unit='мл'),
+        ])
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#000000', slug='breakfast'
+        )
+        cls.recipes = []
+        for number, ingredient in enumerate((cls.sugar, cls.milk)):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipe_images/recipe.png'
+            )
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=100
+            )
+            recipe.tags.add(cls.tag)
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        # ключ кеша списка - id пользователя и версия корзины, а id в
+        # тестовой базе повторяются между тестами
+        cache.clear()
+        self.client = token_client(self.user)
+        response = self.client.post(
+            f'/api/recipes/{self.recipes[0].pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def download(self, etag=None):
+        headers = {} if etag is None else {'HTTP_IF_NONE_MATCH': etag}
+        return self.client.get(self.url, **headers)
+
+    def test_not_modified(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode(), 'Сахар - 100 г')
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.download(etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cart_change(self):
+        etag = self.download()['ETag']
+        self.client.post(f'/api/recipes/{self.recipes[1].pk}/shopping_cart/')
+        response = self.download(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(
+            response.content.decode(), 'Молоко - 100 мл\rСахар - 100 г'
+        )
+        self.client.delete(
+            f'/api/recipes/{self.recipes[1].pk}/shopping_cart/'
+        )
+        self.client.delete(
+            f'/api/recipes/{self.recipes[0].pk}/shopping_cart/'
+        )
+        self.assertEqual(self.download().status_code, 400)
+
+    def test_recipe_change(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        etag = self.download()['ETag']
+        response = token_client(self.author).patch(
+            f'/api/recipes/{self.recipes[0].pk}/',
+            {
+                'name': 'Рецепт 0', 'text': 'Текст', 'cooking_time': 10,
+                'image': IMAGE, 'tags': [self.tag.pk],
+                'ingredients': [{'id': self.sugar.pk, 'amount': 250}],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.download(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.content.decode(), 'Сахар - 250 г')
+
+
+class PantrySearchTest(TestCase):
+    """
+    Рецепты с параметром have упорядочены по количеству имеющихся, затем
+    недостающих ингредиентов, затем от новых к старым
+
+    Порядок одинаков при поиске запросом к базе, пока индекс не построен, и
+    по индексу; изменения ингредиентов попадают в индекс после фиксации
+    транзакции.
+    """
+    # номера ингредиентов рецептов, от старых рецептов к новым
+    contents = ((0, 1), (0, 1, 2), (0,), (2, 3), (0,))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com',
+            first_name='author', last_name='author'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(4)
+        )
+        cls.recipes = []
+        for number, ingredients in enumerate(cls.contents):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipe_images/recipe.png'
+            )
+            IngredientAmount.objects.bulk_create(
+                IngredientAmount(
+                    recipe=recipe, ingredient=cls.ingredients[index],
+                    amount=1
+                )
+                for index in ingredients
+            )
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        pantry_index.reset()
+
+    def search(self, *indexes):
+        have = ','.join(str(self.ingredients[index].pk) for index in indexes)
+        response = self.client.get(f'/api/recipes/?have={have}&limit=10')
+        self.assertEqual(response.status_code, 200)
+        ids = {recipe.pk: number for number, recipe in enumerate(self.recipes)}
+        return [
+            (ids[item['id']], item['matched_count'], item['missing_count'])
+            for item in response.data['results']
+        ]
+
+    def test_ranking(self):
+        expected = [(0, 2, 0), (1, 2, 1), (4, 1, 0), (2, 1, 0)]
+        # первый поиск запускает построение индекса после фиксации
+        # транзакции и выполняется запросом к базе
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.search(0, 1), expected)
+        self.assertEqual(self.search(0, 1), expected)
+        self.assertEqual(self.search(3), [(3, 1, 1)])
+
+    def test_invalidation(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.search(0, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            set_ingredients(self.recipes[3], [
+                {'id': self.ingredients[index].pk, 'amount': 1}
+                for index in (0, 1)
+            ], replace=True)
+            IngredientAmount.objects.filter(recipe=self.recipes[2]).delete()
+        self.assertEqual(
+            self.search(0, 1), [(3, 2, 0), (0, 2, 0), (1, 2, 1), (4, 1, 0)]
+        )
+        self.assertEqual(self.search(3), [])
+
+
+class FeedTest(TestCase):
+    """
+    Лента подписок выдается страницами по курсору от новых рецептов к
+    старым, без рецептов авторов, от которых пользователь отписался
+
+    Рецепты автора, от которого пользователь отписался, не попадают в
+    ленту и из фоновых задач, поставленных до отписки. Когда у автора
+    остается FEED_FANOUT_MAX_FOLLOWERS подписчиков, его рецепты
+    добавляются в ленты подписчиков, а не выбираются при чтении.
+    """
+    # автор и день публикации рецептов; у рецептов 1 и 3 одна дата
+    contents = ((0, 1), (0, 3), (0, 5), (1, 3), (1, 4))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.other, *cls.authors = User.objects.bulk_create(
+            User(username=name, email=f'{name}@example.com',
+                 first_name=name, last_name=name)
+            for name in ('reader', 'other', 'author0', 'author1')
+        )
+        cls.recipes = []
+        for number, (author, day) in enumerate(cls.contents):
+            recipe = Recipe.objects.create(
+                author=cls.authors[author], name=f'Рецепт {number}',
+                text='Текст', cooking_time=10,
+                image='recipe_images/recipe.png'
+            )
+            recipe.pub_date = datetime(2024, 1, day, tzinfo=timezone.utc)
+            recipe.save(update_fields=['pub_date'])
+            cls.recipes.append(recipe)
+
+    def subscribe(self, user, author, method='post'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(token_client(user), method)(
+                f'/api/users/{author.pk}/subscribe/'
+            )
+        self.assertIn(response.status_code, (201, 204))
+
+    def read_feed(self, user, limit=2):
+        """
+        Номера рецептов всех страниц ленты и размеры страниц
+        """
+        client = token_client(user)
+        numbers = {recipe.pk: number for number, recipe in enumerate(
+            self.recipes
+        )}
+        url = f'/api/recipes/feed/?limit={limit}'
+        pages = []
+        while url is not None:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([
+                numbers[item['id']] for item in response.data['results']
+            ])
+            url = response.data['next']
+        return [number for page in pages for number in page], [
+            len(page) for page in pages
+        ]
+
+    def test_pages(self):
+        for author in self.authors:
+            self.subscribe(self.reader, author)
+        self.assertEqual(
+            self.read_feed(self.reader), ([2, 4, 3, 1, 0], [2, 2, 1])
+        )
+        response = token_client(self.reader).get(
+            '/api/recipes/feed/?cursor=bad'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_unsubscribe(self):
+        for author in self.authors:
+            self.subscribe(self.reader, author)
+        self.subscribe(self.reader, self.authors[0], 'delete')
+        self.assertEqual(self.read_feed(self.reader)[0], [4, 3])
+        # задачи, поставленные до отписки, выполняются после нее
+        backfill_feed(self.reader.pk, [self.authors[0].pk])
+        fan_out_recipe(self.recipes[2].pk)
+        self.assertEqual(self.read_feed(self.reader)[0], [4, 3])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_fan_out_threshold(self):
+        author = self.authors[0]
+        self.subscribe(self.other, author)
+        self.subscribe(self.reader, author)
+        # у автора больше одного подписчика: его рецепты выбираются при
+        # чтении ленты
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.read_feed(self.reader)[0], [2, 1, 0])
+        self.subscribe(self.other, author, 'delete')
+        self.assertEqual(
+            set(FeedEntry.objects.filter(user=self.reader).values_list(
+                'recipe_id', flat=True
+            )),
+            {recipe.pk for recipe in self.recipes[:3]}
+        )
+        self.assertEqual(self.read_feed(self.reader)[0], [2, 1, 0])
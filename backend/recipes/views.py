@@ -1,50 +1,60 @@
+import numpy as np
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets
 from rest_framework.permissions import AllowAny
 from rest_framework.filters import SearchFilter
 
 from .models import (
-    Tag, Recipe, Ingredient, Favorite, ShoppingList, IngredientAmount
+    Tag, Recipe, Ingredient
 )
 from .serializers import (
     TagSerializer,
     RecipeGetSerializer,
     RecipePostSerializer,
     IngredientSerializer,
-    ShortRecipeSerializer
+    ShortRecipeSerializer,
+    RECIPE_PREFETCH
 )
 from api.pagination import CustomPageNumberPagination
 from .filters import RecipeFilter, IngredientFilter
+from .feed import decode_cursor, get_feed_page
+from .services import get_shopping_list
+from .pantry import pantry_index
+from .similar import get_similar
 
 # action decorator
 from rest_framework.decorators import action
-# get_object_or_404
-from rest_framework.generics import get_object_or_404
 # IsAuthenticated permission
 from rest_framework.permissions import IsAuthenticated
 from api.permissions import IsAuthorOrReadOnly
+from api.relations import favorite_relation, shopping_cart_relation
+from api.serializers import IdListSerializer
+from api.tracing import TracingViewMixin
 # Response
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 # status
 from rest_framework import status
-# Sum
-from django.db.models import Sum
 # HttpResponce
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 # ApiView
 from rest_framework.views import APIView
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(TracingViewMixin, viewsets.ModelViewSet):
     """
     Вьюсет для модели Tag
     """
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
+    query_budgets = {'list': 1, 'retrieve': 1}
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(TracingViewMixin, viewsets.ModelViewSet):
     """
     Вьюсет для модели Recipe
     """
@@ -52,6 +62,21 @@ class RecipeViewSet(viewsets.ModelViewSet):
     pagination_class = CustomPageNumberPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    # наибольшее количество SQL запросов действий (api.query_budgets)
+    query_budgets = {
+        'list': 7,
+        'retrieve': 6,
+        'create': 8,
+        'update': 11,
+        'partial_update': 11,
+        'destroy': 18,
+        'favorite': 3,
+        'shopping_cart': 5,
+        'feed': 8,
+        'similar': 2,
+        'favorite_bulk': 4,
+        'shopping_cart_bulk': 5,
+    }
 
     def get_queryset(self):
         """
@@ -65,10 +90,21 @@ class RecipeViewSet(viewsets.ModelViewSet):
         - is_in_shopping_cart - 1 - показывать только рецепты, которые
         находятся в списке покупок
 
+        Для GET запросов автор, теги и ингредиенты рецептов загружаются
+        заранее (RECIPE_PREFETCH), без запросов на каждый рецепт. Автора
+        изменяемого рецепта выводит ответ PUT и PATCH, он загружается
+        вместе с рецептом.
+
         :return: QuerySet
 
         """
         queryset = super().get_queryset()
+        if self.request.method == 'GET':
+            queryset = queryset.select_related('author').prefetch_related(
+                *RECIPE_PREFETCH
+            )
+        elif self.request.method in ('PUT', 'PATCH'):
+            queryset = queryset.select_related('author')
         author = self.request.query_params.get('author')
         tags = self.request.query_params.getlist('tags')
 
@@ -80,6 +116,54 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return queryset
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """
+        Список рецептов
+
+        С параметром have=1,2,3 (id имеющихся ингредиентов) возвращает
+        рецепты, в которых есть хотя бы один из ингредиентов, от рецептов с
+        наибольшим количеством имеющихся ингредиентов и наименьшим
+        количеством недостающих. Рецепты выбираются по обратному индексу
+        pantry_index, из базы загружаются только рецепты страницы. В каждый
+        рецепт добавляются поля matched_count и missing_count. Остальные
+        фильтры применяются вместе с have.
+        """
+        if 'have' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        have = IdListSerializer(data={'ids': [
+            pk for pk in request.query_params['have'].split(',') if pk
+        ]})
+        if not have.is_valid():
+            return Response(
+                {'have': have.errors['ids']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        recipe_ids, matched, missing = pantry_index.search(
+            have.validated_data['ids']
+        )
+        if any(
+            name in request.query_params
+            for name in RecipeFilter.base_filters if name != 'ordering'
+        ):
+            allowed = self.filter_queryset(self.get_queryset()).values_list(
+                'pk', flat=True
+            )
+            keep = np.isin(recipe_ids, np.fromiter(allowed, dtype=np.int64))
+            recipe_ids, matched = recipe_ids[keep], matched[keep]
+            missing = missing[keep]
+        counts = dict(zip(
+            recipe_ids.tolist(), zip(matched.tolist(), missing.tolist())
+        ))
+        page = self.paginate_queryset(recipe_ids.tolist())
+        recipes = Recipe.objects.in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes], many=True
+        )
+        results = serializer.data
+        for item in results:
+            item['matched_count'], item['missing_count'] = counts[item['id']]
+        return self.get_paginated_response(results)
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipeGetSerializer
@@ -94,8 +178,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
         Для DELETE, PUT, PATCH - доступно только автору рецепта
         """
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
-            self.permission_classes = [IsAuthorOrReadOnly]
-        self.permission_classes = [AllowAny]
+            self.permission_classes = [IsAuthenticated, IsAuthorOrReadOnly]
+        elif self.action in ['list', 'retrieve']:
+            self.permission_classes = [AllowAny]
         return super().get_permissions()
 
     def destroy(self, request, *args, **kwargs):
@@ -133,34 +218,34 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         Возвращает статус 400 при неверном запросе
             Когда рецепт уже есть в избранном при добавлении
-            Когда рецепта не существует при добавлении
             Когда рецепта нет в избранном при удалении
+        Возвращает статус 404, когда рецепта не существует
 
+        Добавление и удаление выполняются одним запросом, существование
+        рецепта проверяется только если ни одна строка не изменилась.
         """
-        recipe = get_object_or_404(Recipe, id=pk)
         user = request.user
         if request.method == 'POST':
-            if Favorite.objects.filter(user=user, recipe=recipe).exists():
+            if favorite_relation.add(user, pk):
                 return Response(
-                    {'error': 'Рецепт уже есть в избранном'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Favorite.objects.get_or_create(user=user, recipe=recipe)
-            return Response(
                     {'success': 'Рецепт успешно добавлен в избранное'},
                     status=status.HTTP_201_CREATED
                 )
-        elif request.method == 'DELETE':
-            if not Favorite.objects.filter(user=user, recipe=recipe).exists():
-                return Response(
-                    {'error': 'Рецепта нет в избранном'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Favorite.objects.filter(user=user, recipe=recipe).delete()
+            favorite_relation.get_target_or_404(pk)
             return Response(
-                    {'success': 'Рецепт успешно удален из избранного'},
-                    status=status.HTTP_204_NO_CONTENT
-                )
+                {'error': 'Рецепт уже есть в избранном'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if favorite_relation.remove(user, pk):
+            return Response(
+                {'success': 'Рецепт успешно удален из избранного'},
+                status=status.HTTP_204_NO_CONTENT
+            )
+        favorite_relation.get_target_or_404(pk)
+        return Response(
+            {'error': 'Рецепта нет в избранном'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
     # метод для добавление рецепта в список покупок
     @action(
@@ -182,39 +267,166 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         Возвращает статус 400 при неверном запросе
             Когда рецепт уже есть в списке покупок при добавлении
-            Когда рецепта не существует при добавлении
             Когда рецепта нет в списке покупок при удалении
+        Возвращает статус 404, когда рецепта не существует
 
         """
-        recipe = get_object_or_404(Recipe, id=pk)
         user = request.user
         if request.method == 'POST':
-            if ShoppingList.objects.filter(user=user, recipe=recipe).exists():
+            recipe = shopping_cart_relation.get_target_or_404(pk)
+            if not shopping_cart_relation.add(user, recipe.pk):
                 return Response(
                     {'error': 'Рецепт уже есть в списке покупок'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            ShoppingList.objects.get_or_create(user=user, recipe=recipe)
             data = ShortRecipeSerializer(recipe).data
             return Response(data, status=status.HTTP_201_CREATED)
-        elif request.method == 'DELETE':
-            if not ShoppingList.objects.filter(
-                user=user,
-                recipe=recipe
-            ).exists():
-                return Response(
-                    {'error': 'Рецепта нет в списке покупок'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            ShoppingList.objects.filter(user=user, recipe=recipe).delete()
+        if shopping_cart_relation.remove(user, pk):
             return Response(
                 {'success': 'Рецепт удален из списка покупок'},
                 status=status.HTTP_204_NO_CONTENT
             )
+        shopping_cart_relation.get_target_or_404(pk)
+        return Response(
+            {'error': 'Рецепта нет в списке покупок'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+    )
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь
+
+        GET /api/recipes/feed/ - первая страница ленты
+        GET /api/recipes/feed/?cursor=... - следующая страница
+
+        Параметры запроса:
+            limit - количество рецептов на странице
+            cursor - курсор из поля next предыдущей страницы
+
+        Возвращает статус 200 и страницу ленты от новых рецептов к старым:
+            {"next": ссылка на следующую страницу или null, "results": [...]}
+        Возвращает статус 400 при некорректном курсоре
+        """
+        cursor = request.query_params.get('cursor')
+        if cursor is not None:
+            cursor = decode_cursor(cursor)
+            if cursor is None:
+                return Response(
+                    {'error': 'Некорректный курсор'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        recipe_ids, next_cursor = get_feed_page(
+            request.user, self.paginator.get_page_size(request), cursor
+        )
+        recipes = Recipe.objects.in_bulk(recipe_ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes], many=True
+        )
+        next_url = None
+        if next_cursor is not None:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', next_cursor
+            )
+        return Response({'next': next_url, 'results': serializer.data})
+
+    @action(
+        detail=True,
+        methods=['get'],
+        permission_classes=[AllowAny],
+    )
+    def similar(self, request, pk=None):
+        """
+        Рецепты с самыми похожими наборами ингредиентов
+
+        GET /api/recipes/{id}/similar/
+
+        Возвращает статус 200 и список рецептов от более похожих к менее
+        похожим, статус 404, если рецепт не найден
+        """
+        try:
+            recipes = get_similar(int(pk))
+        except ValueError:
+            raise Http404
+        if not recipes:
+            get_object_or_404(Recipe, pk=pk)
+        return Response(ShortRecipeSerializer(recipes, many=True).data)
+
+    # пакетные методы для избранного и списка покупок
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        permission_classes=[IsAuthenticated],
+    )
+    def favorite_bulk(self, request):
+        """
+        Пакетное добавление и удаление рецептов из избранного
+
+        POST /api/recipes/favorite/ - добавление рецептов в избранное
+        DELETE /api/recipes/favorite/ - удаление рецептов из избранного
+
+        Тело запроса: {"ids": [1, 2, 3]}
+
+        Возвращает статус 200 и результат для каждого id:
+            {"results": [{"id": 1, "status": "created"}, ...]}
+        Возвращает статус 400 при неверном списке id
+        """
+        serializer = IdListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if request.method == 'POST':
+            operation = favorite_relation.bulk_add
+        else:
+            operation = favorite_relation.bulk_remove
+        _, results = operation(
+            request.user, serializer.validated_data['ids']
+        )
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        permission_classes=[IsAuthenticated],
+    )
+    def shopping_cart_bulk(self, request):
+        """
+        Пакетное добавление и удаление рецептов из списка покупок
+
+        POST /api/recipes/shopping_cart/ - добавление рецептов в список
+        покупок
+        DELETE /api/recipes/shopping_cart/ - удаление рецептов из списка
+        покупок, без поля ids в теле запроса - очистка всего списка покупок
+
+        Тело запроса: {"ids": [1, 2, 3]}
+
+        Возвращает статус 200 и результат для каждого id:
+            {"results": [{"id": 1, "status": "created"}, ...]}
+        При очистке списка покупок возвращает количество удаленных рецептов:
+            {"deleted": 3}
+        Возвращает статус 400 при неверном списке id
+        """
+        user = request.user
+        if request.method == 'DELETE' and 'ids' not in request.data:
+            deleted = shopping_cart_relation.clear(user)
+            return Response({'deleted': deleted}, status=status.HTTP_200_OK)
+        serializer = IdListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if request.method == 'POST':
+            operation = shopping_cart_relation.bulk_add
+        else:
+            operation = shopping_cart_relation.bulk_remove
+        _, results = operation(user, serializer.validated_data['ids'])
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
 # вью функция для получения списка покупок в формате pdf
 
 
-class DownloadShoppingCartView(APIView):
+class DownloadShoppingCartView(TracingViewMixin, APIView):
     """
     Возвращает список покупок в формате txt
 
@@ -236,6 +448,7 @@ class DownloadShoppingCartView(APIView):
     в url.py в urlpatterns в виде: path('download_shopping_cart/',
     download_shopping_cart, name='download_shopping_cart'),
     """
+    query_budgets = {'get': 2}
 
     def get_permissions(self):
         """
@@ -253,32 +466,35 @@ class DownloadShoppingCartView(APIView):
         return []
 
     def get(self, request):
+        """
+        Список покупок кешируется по версии корзины пользователя.
+
+        ETag ответа содержит версию корзины: если корзина не менялась,
+        на запрос с заголовком If-None-Match возвращается статус 304,
+        а без него - текст из кеша без повторной агрегации.
+        """
         user = request.user
-        shopping_list = IngredientAmount.objects.filter(
-            recipe__shopping_cart__user=user).values(
-            'ingredient__name', 'ingredient__measurement_unit').annotate(
-            total_amount=Sum('amount')).order_by('ingredient__name')
-        if not shopping_list:
-            return Response(
-                {'error': 'Список покупок пуст'},
-                status=status.HTTP_400_BAD_REQUEST
+        etag = quote_etag(f'{user.pk}-{user.shopping_cart_version}')
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            shopping_list = get_shopping_list(user)
+            if not shopping_list:
+                return Response(
+                    {'error': 'Список покупок пуст'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            response = HttpResponse(shopping_list, content_type='text/plain')
+            # response['Content-Disposition'] = 'attachment;
+            # filename="shopping_list.txt"'
+            response['Content-Disposition'] = (
+                 'attachment; filename="shopping_list.txt"'
             )
-        shopping_list = [
-            f'{item["ingredient__name"]} - {item["total_amount"]}' +
-            f' {item["ingredient__measurement_unit"]}'
-            for item in shopping_list
-        ]
-        shopping_list = '\r'.join(shopping_list)
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        # response['Content-Disposition'] = 'attachment;
-        # filename="shopping_list.txt"'
-        response['Content-Disposition'] = (
-             'attachment; filename="shopping_list.txt"'
-        )
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
         return response
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(TracingViewMixin, viewsets.ModelViewSet):
     """
     Вьюсет для модели Ingredient
     Список ингредиентов с возможностью поиска по имени вначале строки
@@ -287,3 +503,4 @@ class IngredientViewSet(viewsets.ModelViewSet):
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     filterset_class = IngredientFilter
+    query_budgets = {'list': 1, 'retrieve': 1}
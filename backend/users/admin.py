@@ -1,5 +1,10 @@
 from django.contrib import admin
 from django.conf import settings
+from api.admin import RelationAdmin
+from api.admin_filters import (
+    AdminFiltersMixin, autocomplete_filter, input_filter
+)
+from recipes.services import recount_user_counters
 from .models import CustomUser, Subscribe
 from .forms import CustomUserCreationForm
 
@@ -13,11 +18,13 @@ class CustomUserAdmin(admin.ModelAdmin):
         'last_name',
     )
     list_filter = (
-        'email',
-        'username',
-        'first_name',
-        'last_name'
-        )
+        input_filter('email__istartswith', 'Почта'),
+        input_filter('username__istartswith', 'Логин'),
+        input_filter('first_name__istartswith', 'Имя'),
+        input_filter('last_name__istartswith', 'Фамилия'),
+    )
+    date_hierarchy = 'date_joined'
+    show_full_result_count = False
     search_fields = (
         'email',
         'username',
@@ -29,22 +36,29 @@ class CustomUserAdmin(admin.ModelAdmin):
     ordering = ('-id',)
 
 
-class SubscribeAdmin(admin.ModelAdmin):
+class SubscribeAdmin(AdminFiltersMixin, RelationAdmin):
     list_display = (
         'id',
         'user',
         'author',
     )
     list_filter = (
-        'user',
-        'author'
-        )
+        autocomplete_filter('user', 'Пользователь'),
+        autocomplete_filter('author', 'Автор'),
+    )
     search_fields = (
-        'user',
-        'author'
-        )
+        'user__username',
+        'author__username',
+    )
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    show_full_result_count = False
     empty_value_display = settings.EMPTY_VALUE_DISPLAY
     ordering = ('-id',)
+    relation_field = 'author'
+
+    def relations_changed(self, user_ids, target_ids):
+        recount_user_counters(pk__in=target_ids)
 
 
 admin.site.register(CustomUser, CustomUserAdmin)
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.6 on 2026-10-19 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="shopping_cart_version",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Версия списка покупок"
+            ),
+        ),
+    ]
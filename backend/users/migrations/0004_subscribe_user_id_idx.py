@@ -0,0 +1,34 @@
+# Generated by Django 4.1.6 on 2026-10-19 11:41
+
+import api.indexes
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0003_customuser_counters"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="subscribe",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="subscriber",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="Пользователь",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscribe",
+            index=api.indexes.CoveringIndex(
+                covering=("author",),
+                fields=["user", "-id"],
+                name="subscribe_user_id_idx",
+            ),
+        ),
+    ]
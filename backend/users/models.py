@@ -10,6 +10,10 @@
                 first_name - имя
                 last_name - фамилия
                 password - пароль
+                shopping_cart_version - версия списка покупок, увеличивается
+                при любом изменении корзины или рецептов в ней
+                recipes_count, followers_count - количество рецептов и
+                подписчиков, обновляются автоматически
     Subscribe - подписка
          Модель подписки пользователя на другого пользователя
             Поля:
@@ -25,6 +29,8 @@ from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 
+from api.indexes import CoveringIndex
+
 
 class CustomUser(AbstractUser):
     """Пользователь"""
@@ -65,6 +71,21 @@ class CustomUser(AbstractUser):
         'Пароль',
         max_length=128,
     )
+    shopping_cart_version = models.PositiveIntegerField(
+        'Версия списка покупок',
+        default=0,
+        editable=False,
+    )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['email', 'first_name', 'last_name', 'password']
@@ -86,11 +107,13 @@ class CustomUser(AbstractUser):
 
 class Subscribe(models.Model):
     """Подписка"""
+    # индекс по пользователю - subscribe_user_id_idx
     user = models.ForeignKey(
         CustomUser,
         on_delete=models.CASCADE,
         related_name='subscriber',
         verbose_name='Пользователь',
+        db_index=False,
     )
     author = models.ForeignKey(
         CustomUser,
@@ -109,6 +132,15 @@ class Subscribe(models.Model):
                 name='unique_user_author',
             ),
         ]
+        indexes = [
+            # подписки пользователя в порядке ordering и id авторов для
+            # is_subscribed читают только индекс
+            CoveringIndex(
+                fields=['user', '-id'],
+                covering=['author'],
+                name='subscribe_user_id_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'
@@ -15,9 +15,17 @@
 Сериализаторы:
     UserSerializer - сериализатор для модели User
     UserCreateSerializer - сериализатор для создания нового пользователя
+
+Функции:
+    get_subscribed_author_ids - id авторов, на которых подписан пользователь
+    запроса, загружаются один раз за запрос
+    needs_subscribed_author_ids - нужно ли загружать id авторов подписок
+    set_subscribed_author_ids - сохраняет id авторов, загруженные другим
+    запросом
 """
 
 from rest_framework import serializers
+from api.metrics import TimedListSerializer, TimedSerializerMixin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.utils.translation import gettext_lazy as _
@@ -28,7 +36,7 @@ from rest_framework.exceptions import ValidationError
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для модели User"""
     # Добавляем поле is_subscribed, которое будет возвращать True, если
     # пользователь подписан на автора, и False, если нет
@@ -44,19 +52,61 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name',
             'is_subscribed',
         )
+        list_serializer_class = TimedListSerializer
 
     # Переопределяем метод для сериализации поля is_subscribed
     def get_is_subscribed(self, obj):
-        # Возвращаем True, если пользователь подписан на автора, иначе False
-        if self.context['request'].user.is_anonymous:
+        # Возвращаем True, если пользователь подписан на автора, иначе False.
+        # На себя подписаться нельзя, подписки при этом не загружаются
+        request = self.context['request']
+        if obj.pk == request.user.pk:
             return False
-        return Subscribe.objects.filter(
-            user=self.context['request'].user,
-            author=obj
-        ).exists()
+        return obj.pk in get_subscribed_author_ids(request)
+
+
+def get_subscribed_author_ids(request):
+    """
+    Возвращает множество id авторов, на которых подписан пользователь запроса
+
+    Множество загружается одним запросом и сохраняется в объекте запроса,
+    поэтому все пользователи и авторы, сериализуемые в рамках одного
+    запроса, используют его без дополнительных запросов к Subscribe.
+    """
+    if request.user.is_anonymous:
+        return frozenset()
+    author_ids = getattr(request, '_subscribed_author_ids', None)
+    if author_ids is None:
+        author_ids = frozenset(_subscribed_author_ids(request.user))
+        request._subscribed_author_ids = author_ids
+    return author_ids
+
+
+def needs_subscribed_author_ids(request):
+    """
+    Возвращает True, если id авторов подписок пользователя запроса еще не
+    загружены
+    """
+    return request.user.is_authenticated and getattr(
+        request, '_subscribed_author_ids', None
+    ) is None
+
+
+def set_subscribed_author_ids(request, author_ids):
+    """
+    Сохраняет в объекте запроса id авторов подписок, загруженные вместе с
+    другими данными (recipes.serializers.get_user_recipe_ids), после этого
+    get_subscribed_author_ids возвращает их без запроса к Subscribe
+    """
+    request._subscribed_author_ids = frozenset(author_ids)
+
+
+def _subscribed_author_ids(user):
+    return Subscribe.objects.filter(user=user).values_list(
+        'author_id', flat=True
+    )
 
 
-class UserCreateSerializer(UCS):
+class UserCreateSerializer(TimedSerializerMixin, UCS):
     """Сериализатор для создания нового пользователя"""
     email = serializers.EmailField(required=True)
     first_name = serializers.CharField(required=True)
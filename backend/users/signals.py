@@ -0,0 +1,38 @@
+"""
+Сигналы приложения users
+
+Подписки приходят сигналом relations_changed от api.relations, по нему
+обновляется счетчик followers_count авторов.
+
+При удалении пользователя каскадно удаляются его избранное, список покупок
+и подписки без сигналов relations_changed, поэтому счетчики рецептов и
+авторов уменьшаются заранее, в pre_delete.
+"""
+
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from api.relations import relations_changed
+from recipes.models import Recipe
+from recipes.services import change_counter
+from .models import CustomUser, Subscribe
+
+
+@receiver(relations_changed, sender=Subscribe)
+def subscriptions_changed(sender, ids, created, **kwargs):
+    change_counter(
+        CustomUser, 'followers_count', 1 if created else -1, pk__in=ids
+    )
+
+
+@receiver(pre_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    change_counter(
+        Recipe, 'favorites_count', -1, favorites__user=instance
+    )
+    change_counter(
+        Recipe, 'shopping_cart_count', -1, shopping_cart__user=instance
+    )
+    change_counter(
+        CustomUser, 'followers_count', -1, following__user=instance
+    )
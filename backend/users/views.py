@@ -1,8 +1,12 @@
 from .models import CustomUser, Subscribe
 from .serializers import UserSerializer
-from recipes.serializers import SubscribeSerializer
+from recipes.serializers import SubscribeSerializer, get_recipes_limit
+from recipes.services import get_latest_recipes
 from djoser.views import UserViewSet as DjoserUserViewSet
 from api.pagination import CustomPageNumberPagination
+from api.relations import subscribe_relation
+from api.serializers import IdListSerializer
+from api.tracing import TracingViewMixin
 # permissions
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -14,19 +18,27 @@ from rest_framework.decorators import action
 from rest_framework import status
 # get_user_model
 from django.contrib.auth import get_user_model
-# get_object_or_404
-from rest_framework.generics import get_object_or_404
 
 User = get_user_model()
 
 
-class CustomUserViewSet(DjoserUserViewSet):
+class CustomUserViewSet(TracingViewMixin, DjoserUserViewSet):
     """
     Вьюсет для модели User
     """
     pagination_class = CustomPageNumberPagination
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
+    # наибольшее количество SQL запросов действий (api.query_budgets)
+    query_budgets = {
+        'list': 4,
+        'retrieve': 3,
+        'me': 1,
+        'create': 3,
+        'subscriptions': 4,
+        'subscribe': 5,
+        'subscribe_bulk': 5,
+    }
 
     @action(
         detail=False,
@@ -34,13 +46,23 @@ class CustomUserViewSet(DjoserUserViewSet):
         permission_classes=[IsAuthenticated],
     )
     def subscriptions(self, request):
+        """
+        Авторы, на которых подписан пользователь, с их последними рецептами
+
+        Рецепты всех авторов страницы загружаются одним запросом и
+        передаются сериализатору в контексте latest_recipes.
+        """
         user = self.request.user
-        queryset = Subscribe.objects.filter(user=user)
+        queryset = Subscribe.objects.filter(user=user).select_related('author')
         pages = self.paginate_queryset(queryset)
+        latest_recipes = get_latest_recipes(
+            [subscribe.author_id for subscribe in pages],
+            get_recipes_limit(request)
+        )
         serializer = SubscribeSerializer(
             pages,
             many=True,
-            context={'request': request}
+            context={'request': request, 'latest_recipes': latest_recipes}
         )
         return self.get_paginated_response(serializer.data)
 
@@ -70,22 +92,60 @@ class CustomUserViewSet(DjoserUserViewSet):
 
             Метод работает по адресу /api/users/{id}/subscribe/
 
+            Подписка и отписка выполняются одним запросом, существование
+            автора проверяется только если ни одна строка не изменилась.
         """
         user = self.request.user
-        author = get_object_or_404(User, id=id)
-        if user == author:
+        author_id = subscribe_relation.clean_pk(id)
+        if author_id == user.pk:
             return Response(
                 {'error': 'Вы не можете подписаться на себя'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         if request.method == 'POST':
-            if Subscribe.objects.filter(user=user, author=author).exists():
-                return Response(
-                    {'error': 'Вы уже подписаны на этого автора'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Subscribe.objects.get_or_create(user=user, author=author)
-            return Response(status=status.HTTP_201_CREATED)
-        if request.method == 'DELETE':
-            Subscribe.objects.filter(user=user, author=author).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            if subscribe_relation.add(user, author_id):
+                return Response(status=status.HTTP_201_CREATED)
+            subscribe_relation.get_target_or_404(author_id)
+            return Response(
+                {'error': 'Вы уже подписаны на этого автора'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not subscribe_relation.remove(user, author_id):
+            subscribe_relation.get_target_or_404(author_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='subscribe',
+        permission_classes=[IsAuthenticated],
+    )
+    def subscribe_bulk(self, request):
+        """
+            Метод позволяющий подписаться или отписаться на нескольких
+            авторов одним запросом
+
+            POST - подписаться
+            DELETE - отписаться
+
+            Тело запроса: {"ids": [1, 2, 3]}
+
+            Возвращает статус 200 и результат для каждого id:
+                {"results": [{"id": 1, "status": "created"}, ...]}
+            Собственный id пользователя возвращается со статусом not_found
+            Возвращает статус 400 при неверном списке id
+
+            Метод работает по адресу /api/users/subscribe/
+        """
+        serializer = IdListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if request.method == 'POST':
+            operation = subscribe_relation.bulk_add
+        else:
+            operation = subscribe_relation.bulk_remove
+        _, results = operation(
+            request.user,
+            serializer.validated_data['ids'],
+            User.objects.exclude(pk=request.user.pk)
+        )
+        return Response({'results': results}, status=status.HTTP_200_OK)